@@ -1,8 +1,12 @@
 import sqlite3
+import fnmatch
+import os
 from encryption import EncryptText, DecryptText
 from time import time as CurrentTime
 import config
 global database
+global generation
+generation = 0  # incremented whenever changes are committed to the database
 
 
 class Database:
@@ -20,6 +24,7 @@ class Database:
         self.__connection = sqlite3.connect(self.name)
         self.__cursor = self.__connection.cursor()
         self.connected = True
+        self.commits_deferred = False
 
     @property
     def exists(self):
@@ -47,12 +52,71 @@ class Database:
             self.__cursor.execute(query, parameters)
         return self.__cursor.fetchall()
 
-    def CommitChanges(self):
+    def CommitChanges(self, bump_generation=True):
         """ Actually commits any changes to the database made by SQL queries so
             that they will take effect on the actual database.
-              Inputs: None.
+              Inputs: bump_generation (a Boolean that should only be False if
+            the changes cannot affect the results of any search, so that
+            cached search results remain valid).
               Outputs: None."""
+        global generation
+        if self.commits_deferred:
+            return
         self.__connection.commit()
+        if bump_generation:
+            generation += 1
+
+    def QueryMany(self, query, parameters):
+        """ This method is used to perform the same SQL query once for every
+            set of parameters given, using a single prepared statement.
+              Inputs: query (a string/docstring containing the SQL statement to
+            be executed, as well as '?' symbols for any parameters to be
+            replaced) and parameters (an iterable of lists or tuples of values,
+            each of which is used to fill the '?' parameter spaces once).
+              Outputs: any results of the SQL query, in the form of a tuple
+            containing the queried information."""
+        if not self.connected:
+            return
+        self.__cursor.executemany(query, parameters)
+        return self.__cursor.fetchall()
+
+    def BeginTransaction(self):
+        """ Explicitly opens a write transaction so that all following queries
+            are applied atomically when CommitChanges is next called, and are
+            only synced to disk once.
+              Inputs: None.
+              Outputs: None."""
+        if self.__connection.in_transaction:
+            return
+        self.__cursor.execute("BEGIN IMMEDIATE")
+
+    def RollbackChanges(self):
+        """ Discards any uncommitted changes made to the database since the
+            last commit.
+              Inputs: None.
+              Outputs: None."""
+        self.__connection.rollback()
+
+    def DeferCommits(self):
+        """ Opens a write transaction that lasts until EndDeferredCommits is
+            called, during which CommitChanges does nothing, so that several
+            separately committed changes are applied (or discarded) together.
+              Inputs: None.
+              Outputs: None."""
+        self.BeginTransaction()
+        self.commits_deferred = True
+
+    def EndDeferredCommits(self, commit=True):
+        """ Ends the transaction opened by DeferCommits.
+              Inputs: commit (a Boolean that is True if the changes made since
+            DeferCommits was called should be committed, and False if they
+            should be discarded).
+              Outputs: None."""
+        self.commits_deferred = False
+        if commit:
+            self.CommitChanges()
+        else:
+            self.RollbackChanges()
 
     def QueryAndCommit(self, query, arguments=None):
         result = self.Query(query, arguments)
@@ -84,6 +148,376 @@ class Database:
         self.Close()
 
 
+class TagCatalog:
+    """ A class used to hold a decrypted, in-memory copy of every tag in the
+        database (names, descriptions and synonyms), so that tag lookups do
+        not need to re-read and decrypt the Tags and Synonyms tables. It is
+        loaded once when the database is loaded and then kept up to date by
+        the functions that write tags to the database."""
+    def __init__(self):
+        """ The constructor for the TagCatalog class. Creates an empty,
+            unloaded catalog.
+              Inputs: None.
+              Outputs: None."""
+        self.version = 0  # incremented whenever the catalog changes
+        self.Clear()
+
+    def Clear(self):
+        """ Removes every tag from the catalog.
+              Inputs: None.
+              Outputs: None."""
+        self.names = {}  # tag ID -> name, in ascending tag ID order
+        self.descriptions = {}  # tag ID -> description
+        self.synonyms = {}  # tag ID -> list of synonyms, in SynID order
+        self.name_ids = {}  # name -> tag ID
+        self.synonym_ids = {}  # synonym -> list of tag IDs
+        self.name_trigrams = {}  # trigram -> set of IDs of tags whose names
+        # contain that trigram
+        self.synonym_trigrams = {}  # trigram -> {tag ID: number of that
+        # tag's synonyms containing the trigram}
+        self.loaded = False
+        self.version += 1
+
+    def Load(self):
+        """ Reads and decrypts every tag and synonym from the database,
+            replacing the current contents of the catalog.
+              Inputs: None.
+              Outputs: None."""
+        global database
+        self.Clear()
+        key = config.settings["key"]
+        for tag_id, name, desc in database.Query(
+                """SELECT TagID, Name, Description
+                   FROM Tags
+                   ORDER BY TagID ASC"""):
+            if desc != None:
+                desc = DecryptText(key, desc)
+            self.Add(tag_id, DecryptText(key, name), desc, [])
+        for tag_id, synonym in database.Query(
+                """SELECT TagID, Synonym
+                   FROM Synonyms
+                   ORDER BY SynID ASC"""):
+            if tag_id in self.names:
+                self.AddSynonym(tag_id, DecryptText(key, synonym))
+        self.loaded = True
+
+    def Add(self, tag_id, name, description, synonyms):
+        """ Adds a single tag to the catalog.
+              Inputs: tag_id (the integer TagID of the tag), name (a string),
+            description (a string or None) and synonyms (a list of strings, or
+            None if the tag has no synonyms).
+              Outputs: None."""
+        self.names[tag_id] = name
+        self.descriptions[tag_id] = description
+        self.synonyms[tag_id] = []
+        self.AddNameLookups(tag_id)
+        for synonym in (synonyms if synonyms != None else []):
+            self.AddSynonym(tag_id, synonym)
+
+    def AddSynonym(self, tag_id, synonym):
+        """ Adds a synonym to a tag that is already in the catalog.
+              Inputs: tag_id (the integer TagID of the tag) and synonym (a
+            string).
+              Outputs: None."""
+        self.synonyms[tag_id].append(synonym)
+        self.synonym_ids.setdefault(synonym, []).append(tag_id)
+        for trigram in GetTrigrams(synonym):
+            counts = self.synonym_trigrams.setdefault(trigram, {})
+            counts[tag_id] = counts.get(tag_id, 0) + 1
+        self.version += 1
+
+    def Update(self, tag_id, name, description, synonyms):
+        """ Replaces the information held about a tag in the catalog, keeping
+            its position in tag ID order. Lookups are only changed for the
+            name and synonyms that have changed, so that the tags sharing a
+            synonym stay in SynID order.
+              Inputs: tag_id (the integer TagID of the tag), name (a string),
+            description (a string or None) and synonyms (a list of strings in
+            SynID order, in which any synonyms the tag already had come
+            first).
+              Outputs: None."""
+        self.version += 1
+        if name != self.names[tag_id]:
+            self.RemoveNameLookups(tag_id)
+            self.names[tag_id] = name
+            self.AddNameLookups(tag_id)
+        self.descriptions[tag_id] = description
+        added = list(synonyms)
+        kept = []
+        for synonym in self.synonyms[tag_id]:
+            if synonym in added:
+                added.remove(synonym)
+                kept.append(synonym)
+            else:
+                self.RemoveSynonymLookups(tag_id, synonym)
+        self.synonyms[tag_id] = kept
+        for synonym in added:
+            self.AddSynonym(tag_id, synonym)
+
+    def Remove(self, tag_id):
+        """ Removes a tag from the catalog, if it is in the catalog.
+              Inputs: tag_id (the integer TagID of the tag).
+              Outputs: None."""
+        if tag_id not in self.names:
+            return
+        self.RemoveLookups(tag_id)
+        del self.names[tag_id]
+        del self.descriptions[tag_id]
+        del self.synonyms[tag_id]
+
+    def RemoveLookups(self, tag_id):
+        """ Removes the name and synonym lookup entries for a tag, leaving its
+            main entry in place.
+              Inputs: tag_id (the integer TagID of the tag).
+              Outputs: None."""
+        self.RemoveNameLookups(tag_id)
+        for synonym in self.synonyms[tag_id]:
+            self.RemoveSynonymLookups(tag_id, synonym)
+
+    def AddNameLookups(self, tag_id):
+        """ Adds the lookup entries for a tag's current name.
+              Inputs: tag_id (the integer TagID of the tag).
+              Outputs: None."""
+        self.version += 1
+        self.name_ids[self.names[tag_id]] = tag_id
+        for trigram in GetTrigrams(self.names[tag_id]):
+            self.name_trigrams.setdefault(trigram, set()).add(tag_id)
+
+    def RemoveNameLookups(self, tag_id):
+        """ Removes the lookup entries for a tag's current name.
+              Inputs: tag_id (the integer TagID of the tag).
+              Outputs: None."""
+        self.version += 1
+        if self.name_ids.get(self.names[tag_id]) == tag_id:
+            del self.name_ids[self.names[tag_id]]
+        for trigram in GetTrigrams(self.names[tag_id]):
+            tag_ids = self.name_trigrams[trigram]
+            tag_ids.discard(tag_id)
+            if len(tag_ids) == 0:
+                del self.name_trigrams[trigram]
+
+    def RemoveSynonymLookups(self, tag_id, synonym):
+        """ Removes the lookup entries for one of a tag's synonyms, leaving it
+            in the tag's list of synonyms.
+              Inputs: tag_id (the integer TagID of the tag) and synonym (a
+            string).
+              Outputs: None."""
+        self.version += 1
+        tag_ids = self.synonym_ids[synonym]
+        tag_ids.remove(tag_id)
+        if len(tag_ids) == 0:
+            del self.synonym_ids[synonym]
+        for trigram in GetTrigrams(synonym):
+            counts = self.synonym_trigrams[trigram]
+            counts[tag_id] -= 1
+            if counts[tag_id] == 0:
+                del counts[tag_id]
+                if len(counts) == 0:
+                    del self.synonym_trigrams[trigram]
+
+    def GetID(self, name):
+        """ Returns the tag ID of the tag with the given name, or None if no
+            such tag exists. """
+        return self.name_ids.get(name)
+
+    def GetIDsFromSynonym(self, synonym):
+        """ Returns a list of the IDs of all tags that have the given synonym.
+        """
+        return self.synonym_ids.get(synonym, [])
+
+    def GetIDFromText(self, text):
+        """ Returns the lowest ID of any tag whose name or synonyms match the
+            given text, or None if no tag matches. """
+        matches = self.GetIDsFromSynonym(text)
+        tag_id = self.name_ids.get(text)
+        if tag_id != None:
+            matches = matches + [tag_id]
+        return min(matches) if len(matches) > 0 else None
+
+    def GetIDsMatchingPattern(self, pattern, check_synonyms=True, limit=None):
+        """ Finds every tag whose name (or, optionally, any of whose synonyms)
+            matches a wildcard pattern. The trigram indexes are used to narrow
+            down the tags that could match before each candidate is checked
+            against the pattern with fnmatch, so only patterns without any run
+            of three literal characters need to check every tag.
+              Inputs: pattern (a string using fnmatch wildcards) and
+            check_synonyms (a Boolean describing whether tags should also be
+            matched by their synonyms) and limit (the maximum number of tag IDs
+            to find, or None to find every match).
+              Outputs: a list of the matching tag IDs in ascending order."""
+        trigrams = GetPatternTrigrams(pattern)
+        if len(trigrams) == 0:
+            candidates = self.names.keys()
+        else:
+            # every trigram must occur in the same name or synonym, so tags
+            # are intersected separately by name and by synonym.
+            candidates = None
+            for trigram in trigrams:
+                tag_ids = self.name_trigrams.get(trigram, set())
+                candidates = tag_ids if candidates == None else (candidates
+                                                                 & tag_ids)
+                if len(candidates) == 0:
+                    break
+            if check_synonyms:
+                synonym_candidates = None
+                for trigram in trigrams:
+                    tag_ids = self.synonym_trigrams.get(trigram, {}).keys()
+                    synonym_candidates = set(tag_ids) if (
+                        synonym_candidates
+                        == None) else (synonym_candidates & tag_ids)
+                    if len(synonym_candidates) == 0:
+                        break
+                candidates = candidates | synonym_candidates
+            candidates = sorted(candidates)
+        matches = []
+        for tag_id in candidates:
+            to_check = [self.names[tag_id]]
+            if check_synonyms:
+                to_check += self.synonyms[tag_id]
+            if len(fnmatch.filter(to_check, pattern)) > 0:
+                matches.append(tag_id)
+                if len(matches) == limit:
+                    break
+        return matches
+
+
+def GetTrigrams(text):
+    # fnmatch normalises case in the same way on platforms where matching is
+    # case-insensitive, so trigrams must be taken from the normalised text.
+    text = os.path.normcase(text)
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+def GetPatternTrigrams(pattern):
+    # returns the trigrams of the runs of literal characters in a wildcard
+    # pattern, all of which must occur in any text matching the pattern.
+    trigrams = set()
+    literal = ""
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        i += 1
+        if char in "*?":
+            trigrams |= GetTrigrams(literal)
+            literal = ""
+        elif char == "[":
+            # skips over character sets in the same way as fnmatch.translate;
+            # an unclosed '[' is literal, but is still treated as a break.
+            j = i
+            if j < len(pattern) and pattern[j] == "!":
+                j += 1
+            if j < len(pattern) and pattern[j] == "]":
+                j += 1
+            while j < len(pattern) and pattern[j] != "]":
+                j += 1
+            if j < len(pattern):
+                i = j + 1
+            trigrams |= GetTrigrams(literal)
+            literal = ""
+        else:
+            literal += char
+    return trigrams | GetTrigrams(literal)
+
+
+global tag_catalog
+tag_catalog = TagCatalog()
+
+
+class ItemTagIndex:
+    """ A class used to hold an inverted index of the ItemTags table in memory,
+        mapping each tag ID to the set of IDs of the items that have that tag
+        (its posting list). This lets searches be evaluated as set operations
+        on whole posting lists rather than item by item. It is loaded the first
+        time it is needed and then kept up to date by the functions that write
+        items and tags to the database."""
+    def __init__(self):
+        """ The constructor for the ItemTagIndex class. Creates an empty,
+            unloaded index.
+              Inputs: None.
+              Outputs: None."""
+        self.version = 0  # incremented whenever the index changes
+        self.Clear()
+
+    def Clear(self):
+        """ Empties the index and marks it as unloaded, so that it will be
+            re-read from the database when it is next needed.
+              Inputs: None.
+              Outputs: None."""
+        self.items = set()  # the IDs of every item in the database
+        self.postings = {}  # tag ID -> set of item IDs
+        self.loaded = False
+        self.version += 1
+
+    def Load(self):
+        """ Reads every item and item tag from the database, replacing the
+            current contents of the index.
+              Inputs: None.
+              Outputs: None."""
+        global database
+        self.items = set(i[0] for i in database.Query(
+            """SELECT ItemID FROM Items"""))
+        self.postings = {}
+        for tag_id, item_id in database.Query(
+                """SELECT TagID, ItemID FROM ItemTags"""):
+            self.postings.setdefault(tag_id, set()).add(item_id)
+        self.loaded = True
+        self.version += 1
+
+    def EnsureLoaded(self):
+        """ Loads the index from the database if it has not yet been loaded.
+              Inputs: None.
+              Outputs: None."""
+        if not self.loaded:
+            self.Load()
+
+    def AddItem(self, item_id, tag_ids):
+        """ Adds an item and its tags to the index, if the index is loaded.
+              Inputs: item_id (the integer ItemID of the item) and tag_ids (a
+            list of the integer TagIDs of the item's tags).
+              Outputs: None."""
+        if not self.loaded:
+            return
+        self.items.add(item_id)
+        for tag_id in tag_ids:
+            self.postings.setdefault(tag_id, set()).add(item_id)
+        self.version += 1
+
+    def RemoveItem(self, item_id, tag_ids):
+        """ Removes an item and its tags from the index, if the index is
+            loaded.
+              Inputs: item_id (the integer ItemID of the item) and tag_ids (a
+            list of the integer TagIDs of the item's tags).
+              Outputs: None."""
+        if not self.loaded:
+            return
+        self.items.discard(item_id)
+        for tag_id in tag_ids:
+            if tag_id in self.postings:
+                self.postings[tag_id].discard(item_id)
+        self.version += 1
+
+    def RemoveTag(self, tag_id):
+        """ Removes a tag's posting list from the index.
+              Inputs: tag_id (the integer TagID of the tag).
+              Outputs: None."""
+        if self.postings.pop(tag_id, None) != None:
+            self.version += 1
+
+    def GetItems(self, tag_id):
+        """ Returns the set of IDs of the items that have the given tag. The
+            returned set must not be modified. """
+        return self.postings.get(tag_id, set())
+
+    def GetCount(self, tag_id):
+        """ Returns the number of items that have the given tag (its document
+            frequency), which is used to estimate the cost of searches. """
+        return len(self.postings.get(tag_id, ()))
+
+
+global item_tag_index
+item_tag_index = ItemTagIndex()
+
+
 def CreateDatabase():
     global database
     database.QueryAndCommit("""CREATE TABLE Tags (
@@ -135,8 +569,92 @@ def CreateDatabase():
     )""")
 
 
-def LoadDatabase(database_path):
+def MigrateToVersion1():
+    # EncryptText is deterministic, so lookups on the encrypted Name, Synonym
+    # and ItemText columns can use these indexes directly.
+    global database
+    database.Query("""CREATE INDEX IF NOT EXISTS TagsNameIndex
+                      ON Tags (Name)""")
+    database.Query("""CREATE INDEX IF NOT EXISTS SynonymsSynonymIndex
+                      ON Synonyms (Synonym)""")
+    database.Query("""CREATE INDEX IF NOT EXISTS SynonymsTagIDIndex
+                      ON Synonyms (TagID)""")
+    database.Query("""CREATE INDEX IF NOT EXISTS ItemTagsTagIDIndex
+                      ON ItemTags (TagID, ItemID)""")
+    database.Query("""CREATE INDEX IF NOT EXISTS ItemTagsItemIDIndex
+                      ON ItemTags (ItemID, TagID)""")
+    database.Query("""CREATE INDEX IF NOT EXISTS ItemsItemTextIndex
+                      ON Items (ItemText)""")
+
+
+def MigrateToVersion2():
+    # records how many times each tag has been searched for, which is used to
+    # rank search bar suggestions.
     global database
+    database.Query("""CREATE TABLE IF NOT EXISTS TagSearches (
+        TagID INTEGER NOT NULL,
+        Count INTEGER NOT NULL,
+        PRIMARY KEY (TagID),
+        FOREIGN KEY (TagID) REFERENCES Tags (TagID)
+        ON UPDATE CASCADE ON DELETE CASCADE
+        )""")
+
+
+def MigrateToVersion3():
+    # supports delta exports. TimeChanged is the local time an item was last
+    # written, unlike TimeLastUpdated which is kept from wherever the item was
+    # imported from. deleted items leave tombstones so deletions can be
+    # exported, and ExportMarkers holds the times of previous delta exports.
+    global database
+    database.Query("""ALTER TABLE Items ADD COLUMN TimeChanged TIME""")
+    database.Query("""UPDATE Items
+                      SET TimeChanged = COALESCE(TimeLastUpdated, TimeAdded)""")
+    database.Query("""CREATE INDEX IF NOT EXISTS ItemsTimeChangedIndex
+                      ON Items (TimeChanged)""")
+    database.Query("""CREATE TABLE IF NOT EXISTS DeletedItems (
+        ItemText TEXT NOT NULL,
+        TimeDeleted TIME NOT NULL,
+        TimeChanged TIME NOT NULL,
+        PRIMARY KEY (ItemText)
+        )""")
+    database.Query("""CREATE TABLE IF NOT EXISTS ExportMarkers (
+        Name TEXT NOT NULL,
+        Time TIME NOT NULL,
+        PRIMARY KEY (Name)
+        )""")
+
+
+# MIGRATIONS[i] upgrades a database from schema version i to version i + 1.
+# The schema version is stored in the database file as PRAGMA user_version,
+# so new migrations must only ever be appended to the end of this list.
+MIGRATIONS = [MigrateToVersion1, MigrateToVersion2, MigrateToVersion3]
+
+
+def GetSchemaVersion():
+    global database
+    return database.Query("PRAGMA user_version")[0][0]
+
+
+def MigrateDatabase():
+    global database
+    version = GetSchemaVersion()
+    while version < len(MIGRATIONS):
+        try:
+            database.BeginTransaction()
+            MIGRATIONS[version]()
+            # PRAGMA statements cannot take parameters; version is an int.
+            database.Query(f"PRAGMA user_version = {version + 1}")
+            database.CommitChanges()
+        except:
+            database.RollbackChanges()
+            raise
+        version += 1
+        import debug
+        debug.Log(f'Migrated the database to schema version {version}.')
+
+
+def LoadDatabase(database_path):
+    global database, tag_search_counts, tag_search_version
     try:
         database = Database(database_path)
         if not database.exists:
@@ -144,170 +662,297 @@ def LoadDatabase(database_path):
     except:
         database = Database(database_path)
         CreateDatabase()
+    MigrateDatabase()
+    tag_catalog.Load()
+    item_tag_index.Clear()
+    tag_search_counts = None
+    tag_search_version += 1
+    BumpGeneration()
+
+
+def BumpGeneration():
+    # marks anything derived from the database's previous contents as stale.
+    global generation
+    generation += 1
+
+
+def GetGeneration():
+    return generation
+
+
+def BeginImport():
+    # makes every change until EndImport is called part of one transaction,
+    # so that an import that fails part of the way through adds nothing.
+    global database
+    database.DeferCommits()
+
+
+def EndImport(successful):
+    # commits the changes made since BeginImport if the import was
+    # successful. otherwise they are discarded, and the tags and item tags
+    # held in memory are read from the database again.
+    global database
+    database.EndDeferredCommits(successful)
+    if not successful:
+        tag_catalog.Load()
+        item_tag_index.Clear()
+        BumpGeneration()
+
+
+global tag_search_counts
+tag_search_counts = None  # tag ID -> times searched, read when first needed
+global tag_search_version
+tag_search_version = 0  # incremented whenever tag_search_counts changes
+
+
+def GetTagSearchCounts():
+    global database, tag_search_counts
+    if tag_search_counts == None:
+        tag_search_counts = dict(
+            database.Query("""SELECT TagID, Count FROM TagSearches"""))
+    return tag_search_counts
+
+
+def RecordTagSearches(tag_ids):
+    # search counts do not affect search results, so they are committed
+    # without invalidating any cached results.
+    global database, tag_search_version
+    counts = GetTagSearchCounts()
+    database.QueryMany(
+        """INSERT OR IGNORE INTO TagSearches (TagID, Count)
+           VALUES (?, 0)""", [(tag_id, ) for tag_id in tag_ids])
+    database.QueryMany(
+        """UPDATE TagSearches
+           SET Count = Count + 1
+           WHERE TagID = ?""", [(tag_id, ) for tag_id in tag_ids])
+    database.CommitChanges(bump_generation=False)
+    for tag_id in tag_ids:
+        counts[tag_id] = counts.get(tag_id, 0) + 1
+    tag_search_version += 1
+
+
+def GetTagPopularity(tag_id):
+    # tags are ranked by how often they have been searched for, and then by
+    # how many items have them.
+    return (GetTagSearchCounts().get(tag_id, 0),
+            GetItemTagIndex().GetCount(tag_id))
+
+
+def GetTagPopularityVersion():
+    # changes whenever the result of GetTagPopularity may have changed.
+    return (tag_search_version, item_tag_index.version)
+
+
+def GetTagCatalogVersion():
+    return tag_catalog.version
+
+
+def GetItemTagIndex():
+    item_tag_index.EnsureLoaded()
+    return item_tag_index
+
+
+def ConnectDatabase(name):
+    # connects to an existing database without loading or migrating it, for
+    # processes that only read from it (i.e. parallel search workers).
+    global database
+    database = Database(name)
+
+
+def GetDatabaseName():
+    global database
+    return database.name
+
+
+def GetItemIDRange():
+    # returns the number of items, and the lowest and highest item IDs.
+    global database
+    return database.Query("""SELECT COUNT(*), MIN(ItemID), MAX(ItemID)
+                             FROM Items""")[0]
+
+
+def GetShardItemTags(first_id, last_id):
+    # returns a dictionary of the ID of every item with an ID in the given
+    # (inclusive) range to the set of its tag IDs, in ascending item ID order.
+    global database
+    item_tags = {}
+    for item_id in database.Query(
+            """SELECT ItemID
+               FROM Items
+               WHERE ItemID BETWEEN ? AND ?
+               ORDER BY ItemID ASC""", (first_id, last_id)):
+        item_tags[item_id[0]] = set()
+    for item_id, tag_id in database.Query(
+            """SELECT ItemID, TagID
+               FROM ItemTags
+               WHERE ItemID BETWEEN ? AND ?""", (first_id, last_id)):
+        if item_id in item_tags:
+            item_tags[item_id].add(tag_id)
+    return item_tags
 
 
 def AddTag(name, description, synonyms):
+    return AddTags([(name, description, synonyms)])[0]
+
+
+def AddTags(records):
+    # records are in the form [(name, description, synonyms), ...]
     global database
-    name = EncryptText(config.settings["key"], name)
-    description = EncryptText(config.settings["key"], description)
-    database.QueryAndCommit(
-        """INSERT INTO Tags (Name, Description) 
-           VALUES (?, ?)""", (name, description))
-    tag_id = database.lastrowid
-    if synonyms == None:
-        return
-    for synonym in synonyms:
-        synonym = EncryptText(config.settings["key"], synonym)
-        database.QueryAndCommit(
-            """INSERT INTO Synonyms (TagID, Synonym) 
-               VALUES (?, ?)""", (tag_id, synonym))
-    return tag_id
+    records = list(records)
+    if len(records) == 0:
+        return []
+    key = config.settings["key"]
+    tag_rows = []
+    for name, description, _ in records:
+        if description != None:
+            description = EncryptText(key, description)
+        tag_rows.append((EncryptText(key, name), description))
+    try:
+        database.BeginTransaction()
+        # new TagIDs are allocated sequentially from the current maximum, and
+        # the open transaction stops anything else from taking them first.
+        first_id = database.Query(
+            """SELECT COALESCE(MAX(TagID), 0) FROM Tags""")[0][0] + 1
+        database.QueryMany(
+            """INSERT INTO Tags (TagID, Name, Description)
+               VALUES (?, ?, ?)""",
+            [(first_id + i, ) + row for i, row in enumerate(tag_rows)])
+        tag_ids = list(range(first_id, first_id + len(records)))
+        synonym_rows = []
+        for tag_id, record in zip(tag_ids, records):
+            if record[2] == None:
+                continue
+            for synonym in record[2]:
+                synonym_rows.append((tag_id, EncryptText(key, synonym)))
+        database.QueryMany(
+            """INSERT INTO Synonyms (TagID, Synonym)
+               VALUES (?, ?)""", synonym_rows)
+        database.CommitChanges()
+    except:
+        database.RollbackChanges()
+        raise
+    for tag_id, record in zip(tag_ids, records):
+        tag_catalog.Add(tag_id, *record)
+    return tag_ids
 
 
 def AddItem(text, desc, times_served, time_added, time_last_updated, score,
             rating, tags):
-    text = EncryptText(config.settings["key"], text)
-    desc = EncryptText(config.settings["key"], desc)
-    database.QueryAndCommit(
-        """INSERT INTO Items (ItemText, Description, TimesServed, TimeAdded, TimeLastUpdated, Score, Rating)
-           VALUES (?, ?, ?, ?, ?, ?, ?)""",
-        (text, desc, times_served, time_added, time_last_updated, score,
-         rating))
-    item_id = database.lastrowid
-    if tags == None:
-        return
+    return AddItems([(text, desc, times_served, time_added, time_last_updated,
+                      score, rating, tags)])[0]
+
+
+def AddItems(records):
+    # records are in the form [(text, desc, times_served, time_added,
+    # time_last_updated, score, rating, tags), ...]
+    global database
+    records = list(records)
+    if len(records) == 0:
+        return []
+    key = config.settings["key"]
+    item_rows = []
+    for record in records:
+        desc = record[1]
+        if desc != None:
+            desc = EncryptText(key, desc)
+        item_rows.append((EncryptText(key, record[0]), desc) +
+                         tuple(record[2:7]))
     current_tags = GetTagNamesAndIDs(dict_form=True)
-    for tag in tags:
-        tag_id = current_tags[tag]
-        database.QueryAndCommit(
+    time_changed = CurrentTime()
+    try:
+        database.BeginTransaction()
+        first_id = database.Query(
+            """SELECT COALESCE(MAX(ItemID), 0) FROM Items""")[0][0] + 1
+        database.QueryMany(
+            """INSERT INTO Items (ItemID, ItemText, Description, TimesServed, TimeAdded, TimeLastUpdated, Score, Rating, TimeChanged)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            [(first_id + i, ) + row + (time_changed, )
+             for i, row in enumerate(item_rows)])
+        # an item that is added again is no longer deleted.
+        database.QueryMany("""DELETE FROM DeletedItems WHERE ItemText = ?""",
+                           [row[0:1] for row in item_rows])
+        item_ids = list(range(first_id, first_id + len(records)))
+        item_tag_rows = []
+        for item_id, record in zip(item_ids, records):
+            if record[7] == None:
+                continue
+            for tag in record[7]:
+                item_tag_rows.append((item_id, current_tags[tag]))
+        database.QueryMany(
             """INSERT INTO ItemTags (ItemID, TagID)
-               VALUES (?, ?)""", (item_id, tag_id))
+               VALUES (?, ?)""", item_tag_rows)
+        database.CommitChanges()
+    except:
+        database.RollbackChanges()
+        raise
+    for item_id, record in zip(item_ids, records):
+        tags = record[7] if record[7] != None else []
+        item_tag_index.AddItem(item_id, [current_tags[tag] for tag in tags])
+    return item_ids
 
 
 def FindReplicaTags(name, synonyms=None, exclude=None):
-    global database
+    # looks up the name and synonyms in the tag catalog, returning how the
+    # first of them that is already used by a tag (not in exclude) is used.
     if synonyms == None:
         synonyms = []
     if exclude == None:
         exclude = []
-    to_search = [name] + synonyms
-    for item in to_search:
-        enc_item = EncryptText(config.settings["key"], item)
-        matches = database.Query(
-            """SELECT COUNT(*)
-               FROM Tags
-               WHERE Name = ?""", (enc_item, ))[0][0]
-        if matches > 0 and item not in exclude:
+    for item in [name] + synonyms:
+        if tag_catalog.GetID(item) != None and item not in exclude:
             return (item, item, "name")
-        matches = database.Query(
-            """SELECT Tags.Name
-               FROM Tags
-               INNER JOIN Synonyms ON Tags.TagID = Synonyms.TagID
-               WHERE Synonyms.Synonym = ?""", (enc_item, ))
-        if len(matches) > 0:
-            if len(exclude) > 0:
-                for m in matches:
-                    match_name = DecryptText(config.settings["key"], m[0])
-                    if match_name not in exclude:
-                        return (item, match_name, "synonym")
-            else:
-                match_name = DecryptText(config.settings["key"], matches[0][0])
+        for tag_id in tag_catalog.GetIDsFromSynonym(item):
+            match_name = tag_catalog.names[tag_id]
+            if match_name not in exclude:
                 return (item, match_name, "synonym")
     return None
 
 
+def FindReplicaTagsMany(names, exclude=None):
+    # returns a dictionary mapping each name to FindReplicaTags(name).
+    return {name: FindReplicaTags(name, exclude=exclude) for name in names}
+
+
+def FindReplicaTexts(texts):
+    # returns the set of the given texts that are already used as the name or
+    # a synonym of some tag.
+    return set(text for text in texts if tag_catalog.GetID(text) != None
+               or len(tag_catalog.GetIDsFromSynonym(text)) > 0)
+
+
 def GetSuggestedSynonyms(phrases, exclude=None):
-    global database
     if exclude == None:
         exclude = []
     suggestions = []
-    for phrase_info in phrases:
-        phrase = EncryptText(config.settings["key"], phrase_info[0])
-        start = phrase_info[1]
-        end = phrase_info[2]
-        matches = database.Query(
-            """SELECT Synonyms.Synonym, Tags.Name
-               FROM Synonyms
-               INNER JOIN Tags on Synonyms.TagID = Tags.TagID
-               WHERE Tags.Name = ?
-               ORDER BY Synonyms.SynID ASC""", (phrase, ))
-        if len(matches) > 0:  # i.e. synonyms found therefore matches tag name
-            if len(exclude) > 0:
-                do_continue = False
-                for m in matches:
-                    name = DecryptText(config.settings["key"], m[1])
-                    if name not in exclude:
-                        synonym = DecryptText(config.settings["key"], m[0])
-                        suggestions.append([synonym, start, end])
-                        do_continue = True
-                if do_continue:
-                    continue
-            else:
-                suggestions += [[
-                    DecryptText(config.settings["key"], i[0]), start, end
-                ] for i in matches]
-                continue
-        matches = database.Query(
-            """SELECT Synonyms.TagID, Tags.Name
-               FROM Synonyms
-               INNER JOIN Tags on Synonyms.TagID = Tags.TagID
-               WHERE Synonyms.Synonym = ?
-               ORDER BY Synonyms.SynID ASC""", (phrase, ))
-        if len(matches) == 0:  # i.e. not found as a synonym
+    for phrase, start, end in phrases:
+        # a tag name with synonyms suggests those synonyms, unless excluded.
+        tag_id = tag_catalog.GetID(phrase)
+        if (tag_id != None and len(tag_catalog.synonyms[tag_id]) > 0
+                and phrase not in exclude):
+            suggestions += [[synonym, start, end]
+                            for synonym in tag_catalog.synonyms[tag_id]]
             continue
-        else:
-            do_continue = False
-            for m in matches:
-                name = DecryptText(config.settings["key"], m[1])
-                # TODO check changed so not sure if this broke something
-                if name in exclude:
-                    do_continue = True
-            if do_continue:
-                continue
-        # if the code below runs, it was found as a synonym.
-        tag_id = matches[0][0]
-        matches = database.Query(
-            """SELECT Synonyms.Synonym
-               FROM Synonyms
-               WHERE Synonyms.TagID = ?
-               AND Synonyms.Synonym <> ?
-               ORDER BY Synonyms.SynID ASC""", (tag_id, phrase))
-        suggestions += [[
-            DecryptText(config.settings["key"], i[0]), start, end
-        ] for i in matches]
-        matches = database.Query(
-            """SELECT Tags.Name
-               FROM Tags
-               WHERE Tags.TagID = ?""", (tag_id, ))
-        suggestions.append(
-            [DecryptText(config.settings["key"], matches[0][0]), start, end])
+        # otherwise a synonym suggests the other synonyms and the name of the
+        # first tag it belongs to, unless any of its tags are excluded.
+        tag_ids = tag_catalog.GetIDsFromSynonym(phrase)
+        if len(tag_ids) == 0 or any(tag_catalog.names[t] in exclude
+                                    for t in tag_ids):
+            continue
+        tag_id = tag_ids[0]
+        suggestions += [[synonym, start, end]
+                        for synonym in tag_catalog.synonyms[tag_id]
+                        if synonym != phrase]
+        suggestions.append([tag_catalog.names[tag_id], start, end])
     return suggestions
 
 
 def GetAllTagData(return_dict=False):
-    # TODO change to a more efficient method (e.g. see GetAllItemData below)
-    global database
     tag_data = {}
-    db_data = database.Query(
-        """SELECT Tags.TagID, Tags.Name, Tags.Description, Synonyms.Synonym
-           FROM TAGS
-           LEFT JOIN Synonyms ON Tags.TagID = Synonyms.TagID
-           ORDER BY Tags.TagID ASC""")
-    for info in db_data:
-        id_ = info[0]
-        name = DecryptText(config.settings["key"], info[1])
-        desc = info[2]
-        if desc != None:
-            desc = DecryptText(config.settings["key"], desc)
-        synonym = info[3]
-        if synonym != None:
-            synonym = DecryptText(config.settings["key"], synonym)
-        if id_ not in tag_data:
-            tag_data[id_] = [name, desc, []]
-            if synonym != None:
-                tag_data[id_][2].append(synonym)
-        elif synonym != None:
-            tag_data[id_][2].append(synonym)
+    for tag_id, name in tag_catalog.names.items():
+        tag_data[tag_id] = [
+            name, tag_catalog.descriptions[tag_id],
+            tag_catalog.synonyms[tag_id].copy()
+        ]
     if return_dict:
         return tag_data
     return list(tag_data.values())
@@ -356,11 +1001,270 @@ def GetAllItemData(return_dict=False):
     return list(item_data.values())
 
 
+def GetItemDataBatches(batch_size=1000, changed_since=None):
+    # yields the records given by GetAllItemData in lists of at most
+    # batch_size records, so that all of them are never held at once. items
+    # without any tags are given an empty tag list. if changed_since is given,
+    # only items written to the database after that time are included.
+    global database
+    key = config.settings["key"]
+    last_id = 0
+    if changed_since == None:
+        changed_since = float("-inf")
+    while True:
+        db_data = database.Query(
+            """SELECT ItemID, ItemText, Description, TimesServed, TimeAdded, TimeLastUpdated, Score, Rating
+               FROM Items
+               WHERE ItemID > ? AND COALESCE(TimeChanged, 0) > ?
+               ORDER BY ItemID ASC
+               LIMIT ?""", [last_id, changed_since, batch_size])
+        if len(db_data) == 0:
+            return
+        first_id, last_id = db_data[0][0], db_data[-1][0]
+        item_tags = {}
+        for item_id, tag_id in database.Query(
+                """SELECT ItemID, TagID
+                   FROM ItemTags
+                   WHERE ItemID BETWEEN ? AND ?""", [first_id, last_id]):
+            # databases from before RemoveTag deleted a tag's ItemTags rows
+            # can still have rows for tags that no longer exist.
+            if tag_id in tag_catalog.names:
+                item_tags.setdefault(item_id,
+                                     []).append(tag_catalog.names[tag_id])
+        batch = []
+        for info in db_data:
+            desc = info[2]
+            if desc != None:
+                desc = DecryptText(key, desc)
+            batch.append([DecryptText(key, info[1]), desc] + list(info[3:8]) +
+                         [item_tags.get(info[0], [])])
+        yield batch
+
+
+def GetChangedItemTagData(changed_since):
+    # returns the GetAllTagData records of the tags of every item written to
+    # the database after the given time.
+    global database
+    return [[
+        tag_catalog.names[tag_id], tag_catalog.descriptions[tag_id],
+        tag_catalog.synonyms[tag_id].copy()
+    ] for (tag_id, ) in database.Query(
+        """SELECT DISTINCT ItemTags.TagID
+           FROM Items
+           JOIN ItemTags ON Items.ItemID = ItemTags.ItemID
+           WHERE COALESCE(Items.TimeChanged, 0) > ?""", [changed_since])
+            if tag_id in tag_catalog.names]
+
+
+def GetDeletedItems(changed_since):
+    # returns [text, time deleted] for every item deleted (or whose deletion
+    # was imported) after the given time.
+    global database
+    return [[DecryptText(config.settings["key"], text), time_deleted]
+            for text, time_deleted in database.Query(
+                """SELECT ItemText, TimeDeleted
+                   FROM DeletedItems
+                   WHERE TimeChanged > ?""", [changed_since])]
+
+
+def GetExportMarker(name):
+    # returns the time of the last delta export with the given name, or None.
+    global database
+    data = database.Query("""SELECT Time FROM ExportMarkers WHERE Name = ?""",
+                          [name])
+    return data[0][0] if len(data) > 0 else None
+
+
+def SetExportMarker(name, time):
+    global database
+    database.Query(
+        """INSERT OR REPLACE INTO ExportMarkers (Name, Time)
+           VALUES (?, ?)""", [name, time])
+    database.CommitChanges(bump_generation=False)
+
+
+def GetItemTimes(texts):
+    # returns a dictionary mapping the encrypted text of each of the given
+    # items that exists to its ItemID and TimeLastUpdated.
+    global database
+    key = config.settings["key"]
+    encrypted = [EncryptText(key, text) for text in texts]
+    times = {}
+    for i in range(0, len(encrypted), MAX_QUERY_PARAMETERS):
+        batch = encrypted[i:i + MAX_QUERY_PARAMETERS]
+        for text, item_id, time_last_updated in database.Query(
+                """SELECT ItemText, ItemID, COALESCE(TimeLastUpdated, 0)
+                   FROM Items
+                   WHERE ItemText IN (""" + ", ".join("?" * len(batch)) + ")",
+                batch):
+            times[text] = (item_id, time_last_updated)
+    return times
+
+
+def GetDeletedItemTimes(texts):
+    # returns a dictionary mapping the encrypted text of each of the given
+    # items that has a tombstone to the time it was deleted.
+    global database
+    key = config.settings["key"]
+    encrypted = [EncryptText(key, text) for text in texts]
+    times = {}
+    for i in range(0, len(encrypted), MAX_QUERY_PARAMETERS):
+        batch = encrypted[i:i + MAX_QUERY_PARAMETERS]
+        for text, time_deleted in database.Query(
+                """SELECT ItemText, TimeDeleted
+                   FROM DeletedItems
+                   WHERE ItemText IN (""" + ", ".join("?" * len(batch)) + ")",
+                batch):
+            times[text] = time_deleted
+    return times
+
+
+def GetTagIDsOfItems(item_ids):
+    global database
+    item_tags = {item_id: [] for item_id in item_ids}
+    for i in range(0, len(item_ids), MAX_QUERY_PARAMETERS):
+        batch = list(item_ids[i:i + MAX_QUERY_PARAMETERS])
+        for item_id, tag_id in database.Query(
+                """SELECT ItemID, TagID
+                   FROM ItemTags
+                   WHERE ItemID IN (""" + ", ".join("?" * len(batch)) + ")",
+                batch):
+            item_tags[item_id].append(tag_id)
+    return item_tags
+
+
+def RemoveItem(text, time_deleted=None):
+    # deletes an item, leaving a tombstone so that the deletion is included
+    # in delta exports. returns whether the item existed.
+    global database
+    key = config.settings["key"]
+    if time_deleted == None:
+        time_deleted = CurrentTime()
+    enc_text = EncryptText(key, text)
+    item_id = GetItemTimes([text]).get(enc_text, (None, ))[0]
+    if item_id == None:
+        return False
+    tag_ids = GetTagIDsOfItems([item_id])[item_id]
+    try:
+        database.BeginTransaction()
+        database.Query("""DELETE FROM ItemTags WHERE ItemID = ?""", [item_id])
+        database.Query("""DELETE FROM Items WHERE ItemID = ?""", [item_id])
+        database.Query(
+            """INSERT OR REPLACE INTO DeletedItems (ItemText, TimeDeleted, TimeChanged)
+               VALUES (?, ?, ?)""", [enc_text, time_deleted,
+                                     CurrentTime()])
+        database.CommitChanges()
+    except:
+        database.RollbackChanges()
+        raise
+    item_tag_index.RemoveItem(item_id, tag_ids)
+    return True
+
+
+def ApplyDeletedItems(deletions):
+    # applies [text, time deleted] tombstones from a delta export. an item is
+    # only deleted if it has not been updated since it was deleted, and
+    # tombstones that are already known are ignored, so applying the same
+    # deletions again changes nothing. the tombstone is recorded even if the
+    # item does not exist yet, so that UpsertItems will not add it from an
+    # older delta applied afterwards. returns the number of items deleted.
+    global database
+    key = config.settings["key"]
+    deleted = 0
+    for text, time_deleted in deletions:
+        enc_text = EncryptText(key, text)
+        known = database.Query(
+            """SELECT TimeDeleted FROM DeletedItems WHERE ItemText = ?""",
+            [enc_text])
+        if len(known) > 0 and known[0][0] >= time_deleted:
+            continue
+        item = GetItemTimes([text]).get(enc_text)
+        if item != None and item[1] > time_deleted:
+            continue
+        if RemoveItem(text, time_deleted):
+            deleted += 1
+        else:
+            database.Query(
+                """INSERT OR REPLACE INTO DeletedItems (ItemText, TimeDeleted, TimeChanged)
+                   VALUES (?, ?, ?)""", [enc_text, time_deleted,
+                                         CurrentTime()])
+            database.CommitChanges(bump_generation=False)
+    return deleted
+
+
+def UpsertItems(records):
+    # adds items in the same form as AddItems, except that an item whose text
+    # already exists is replaced if the record was updated more recently (by
+    # TimeLastUpdated) and skipped otherwise, so applying the same records
+    # again changes nothing. records that are exactly as recent only replace
+    # the item if its tags differ, as removing or editing a tag changes an
+    # item's tags without changing its TimeLastUpdated. records for items that
+    # were deleted at or after the time they were last updated are skipped, so
+    # that replaying an older delta export cannot bring them back. returns the
+    # number of items added or replaced.
+    global database
+    records = list(records)
+    key = config.settings["key"]
+    existing = GetItemTimes([record[0] for record in records])
+    deleted = GetDeletedItemTimes([record[0] for record in records])
+    to_add = []
+    to_replace = []
+    tied = []
+    for record in records:
+        text = EncryptText(key, record[0])
+        item = existing.get(text)
+        if text in deleted and (record[4] or 0) <= deleted[text]:
+            continue
+        elif item == None:
+            to_add.append(record)
+        elif (record[4] or 0) > item[1]:
+            to_replace.append((item[0], record))
+        elif (record[4] or 0) == item[1]:
+            tied.append((item[0], record))
+    current_tags = GetTagNamesAndIDs(dict_form=True)
+    if len(tied) > 0:
+        tied_tags = GetTagIDsOfItems([item_id for item_id, _ in tied])
+        to_replace += [(item_id, record) for item_id, record in tied
+                       if set(tied_tags[item_id]) != set(
+                           current_tags.get(tag) for tag in record[7] or [])]
+    if len(to_replace) > 0:
+        old_tags = GetTagIDsOfItems([item_id for item_id, _ in to_replace])
+        time_changed = CurrentTime()
+        try:
+            database.BeginTransaction()
+            for item_id, record in to_replace:
+                desc = record[1]
+                if desc != None:
+                    desc = EncryptText(key, desc)
+                database.Query(
+                    """UPDATE Items
+                       SET Description=?, TimesServed=?, TimeAdded=?, TimeLastUpdated=?, Score=?, Rating=?, TimeChanged=?
+                       WHERE ItemID = ?""", (desc, ) + tuple(record[2:7]) +
+                    (time_changed, item_id))
+                database.Query("""DELETE FROM ItemTags WHERE ItemID = ?""",
+                               [item_id])
+                database.QueryMany(
+                    """INSERT INTO ItemTags (ItemID, TagID)
+                       VALUES (?, ?)""",
+                    [(item_id, current_tags[tag]) for tag in record[7] or []])
+            database.CommitChanges()
+        except:
+            database.RollbackChanges()
+            raise
+        for item_id, record in to_replace:
+            item_tag_index.RemoveItem(item_id, old_tags[item_id])
+            item_tag_index.AddItem(
+                item_id, [current_tags[tag] for tag in record[7] or []])
+    AddItems(to_add)
+    return len(to_add) + len(to_replace)
+
+
 def GetAllItemTags():
     global database
     db_data = database.Query("""SELECT Items.ItemID, ItemTags.TagID
            FROM Items
-           LEFT JOIN ItemTags on Items.ItemID = ItemTags.ItemID""")
+           LEFT JOIN ItemTags on Items.ItemID = ItemTags.ItemID
+           ORDER BY Items.ItemID ASC""")
     item_data = {}
     for info in db_data:
         id_ = info[0]
@@ -378,34 +1282,124 @@ def GetAllItemTags():
     return to_return
 
 
-def GetTagData(tag_name):
+# SQLite's default limits on bound parameters and compound SELECT terms.
+MAX_QUERY_PARAMETERS = 999
+MAX_COMPOUND_SELECTS = 500
+
+
+def TranslatePostfixToSQL(postfix, tag_ids):
+    # translates a Boolean postfix query into a single compound SELECT that
+    # returns the IDs of all matching items, or returns None if the query
+    # cannot be translated. Each node is [sql, parameters, negated], where a
+    # negated node's SQL selects the items that do NOT match it, so that
+    # 'x AND NOT y' can become 'x EXCEPT y' instead of going through Items.
+    def Materialise(node):
+        if not node[2]:
+            return node[0], node[1]
+        return ("SELECT ItemID FROM Items EXCEPT SELECT ItemID FROM (" +
+                node[0] + ")", node[1])
+
+    def Combine(a, operator, b):
+        return ("SELECT ItemID FROM (" + a[0] + ") " + operator +
+                " SELECT ItemID FROM (" + b[0] + ")", a[1] + b[1], False)
+
+    stack = []
+    compound_selects = 0
+    for word in postfix:
+        if word in ("CALCWEIGHT", "ADDWEIGHT"):
+            return None  # weighted queries cannot be evaluated as sets
+        if word not in ("AND", "OR", "XOR", "NOT"):
+            if word not in tag_ids:
+                return None
+            term_ids = tag_ids[word]
+            if isinstance(term_ids, int):
+                term_ids = [term_ids]
+            stack.append([
+                "SELECT ItemID FROM ItemTags WHERE TagID IN (" +
+                ", ".join("?" * len(term_ids)) + ")",
+                list(term_ids), False
+            ])
+            continue
+        if word == "NOT":
+            if len(stack) < 1:
+                return None
+            node = stack.pop()
+            stack.append([node[0], node[1], not node[2]])
+            continue
+        if len(stack) < 2:
+            return None
+        b = stack.pop()
+        a = stack.pop()
+        compound_selects += 1
+        if word == "AND" and a[2] and b[2]:
+            # NOT x AND NOT y is NOT (x OR y)
+            node = Combine(a, "UNION", b)
+            stack.append([node[0], node[1], True])
+        elif word == "AND" and (a[2] or b[2]):
+            if a[2]:
+                a, b = b, a
+            stack.append(list(Combine(a, "EXCEPT", b)))
+        elif word == "AND":
+            stack.append(list(Combine(a, "INTERSECT", b)))
+        elif word == "OR":
+            stack.append(
+                list(Combine(Materialise(a), "UNION", Materialise(b))))
+        else:  # XOR, i.e. (x UNION y) EXCEPT (x INTERSECT y)
+            compound_selects += 2
+            a = Materialise(a)
+            b = Materialise(b)
+            stack.append(
+                list(
+                    Combine(Combine(a, "UNION", b), "EXCEPT",
+                            Combine(a, "INTERSECT", b))))
+    if len(stack) != 1:
+        return None
+    sql, parameters = Materialise(stack[0])
+    if len(parameters) > MAX_QUERY_PARAMETERS or (compound_selects >
+                                                  MAX_COMPOUND_SELECTS):
+        return None
+    return ("SELECT DISTINCT ItemID FROM (" + sql + ") ORDER BY ItemID ASC",
+            parameters)
+
+
+def GetItemIDsMatchingPostfix(postfix, tag_ids):
+    # evaluates a Boolean postfix query entirely within SQLite, so that only
+    # the IDs of matching items are loaded. Returns None if the query could
+    # not be translated to (or run as) a single SQL statement.
     global database
-    tag_data = {}
-    enc_name = EncryptText(config.settings["key"], tag_name)
-    data = database.Query(
-        """SELECT Tags.Description, Synonyms.Synonym
-           FROM TAGS
-           LEFT JOIN Synonyms ON Tags.TagID = Synonyms.TagID
-           WHERE Tags.Name = ?
-           ORDER BY Synonyms.SynID ASC""", (enc_name, ))
-    if len(data) == 0:
+    translated = TranslatePostfixToSQL(postfix, tag_ids)
+    if translated == None:
+        return None
+    try:
+        return [i[0] for i in database.Query(*translated)]
+    except sqlite3.OperationalError:
+        return None  # e.g. the statement exceeded one of SQLite's limits
+
+
+def ExplainPostfixQuery(postfix, tag_ids):
+    # returns the steps of SQLite's plan for evaluating a Boolean postfix query
+    # in the database, or None if the query cannot be translated (or run).
+    global database
+    translated = TranslatePostfixToSQL(postfix, tag_ids)
+    if translated == None:
         return None
+    try:
+        return [
+            row[-1] for row in database.Query("EXPLAIN QUERY PLAN " +
+                                              translated[0], translated[1])
+        ]
+    except sqlite3.OperationalError:
+        return None  # e.g. the statement exceeded one of SQLite's limits
+
+
+def GetTagData(tag_name):
+    tag_id = tag_catalog.GetID(tag_name)
+    if tag_id == None:
+        return None
+    tag_data = {}
     tag_data["NAME"] = tag_name
-    if data[0][0] != None:
-        tag_data["DESCRIPTION"] = DecryptText(config.settings["key"],
-                                              data[0][0])
-    else:
-        tag_data["DESCRIPTION"] = data[0][0]
-    tag_data["SYNONYMS"] = []
-    if len(data) == 1:
-        synonym = data[0][1]
-        if synonym != None:
-            synonym = DecryptText(config.settings["key"], synonym)
-            tag_data["SYNONYMS"].append(synonym)
-    else:
-        for record in data:
-            synonym = DecryptText(config.settings["key"], record[1])
-            tag_data["SYNONYMS"].append(synonym)
+    tag_data["DESCRIPTION"] = tag_catalog.descriptions[tag_id]
+    tag_data["SYNONYMS"] = tag_catalog.synonyms[tag_id].copy()
     return tag_data
 
 
@@ -422,49 +1416,61 @@ def GetItemTextFromID(item_id):
         return text
 
 
-def GetTagDataFromSynonym(synonym):
+def GetItemTextsFromIDs(item_ids):
+    # returns the texts of the given items in the same order as their IDs,
+    # using one query per batch of IDs instead of one query per item.
     global database
-    synonym = EncryptText(config.settings["key"], synonym)
-    data = database.Query(
-        """SELECT Tags.Name
-           FROM TAGS
-           INNER JOIN Synonyms ON Tags.TagID = Synonyms.TagID
-           WHERE Synonyms.Synonym = ?""", (synonym, ))
-    if len(data) == 0:
+    texts = {}
+    for i in range(0, len(item_ids), MAX_QUERY_PARAMETERS):
+        batch = list(item_ids[i:i + MAX_QUERY_PARAMETERS])
+        for item_id, text in database.Query(
+                """SELECT ItemID, ItemText
+                   FROM Items
+                   WHERE ItemID IN (""" + ", ".join("?" * len(batch)) + ")",
+                batch):
+            texts[item_id] = DecryptText(config.settings["key"], text)
+    return [texts.get(item_id) for item_id in item_ids]
+
+
+def GetTagDataFromSynonym(synonym):
+    tag_ids = tag_catalog.GetIDsFromSynonym(synonym)
+    if len(tag_ids) == 0:
         return None
     else:
-        tag_name = DecryptText(config.settings["key"], data[0][0])
-        return GetTagData(tag_name)
+        return GetTagData(tag_catalog.names[min(tag_ids)])
 
 
 def GetTagIDsFromNames(tags):
-    import fnmatch
-    tags_data = GetAllTagData(return_dict=True)
     tag_ids = {}
     for tag in tags:
         if "*" in tag:
-            added = 0
-            for s_tag in tags_data.keys():
-                data = tags_data[s_tag]
-                if config.settings["check_synonyms_for_wildcards"]:
-                    to_check = [data[0]] + data[2]
-                else:
-                    to_check = [data[0]]
-                if len(fnmatch.filter(to_check, tag)) > 0:
-                    if added == 0:
-                        tag_ids[tag] = [s_tag]
-                    else:
-                        tag_ids[tag].append(s_tag)
-                    added += 1
+            matches = tag_catalog.GetIDsMatchingPattern(
+                tag, config.settings["check_synonyms_for_wildcards"])
+            if len(matches) > 0:
+                tag_ids[tag] = matches
         else:
-            for s_tag in tags_data:
-                data = tags_data[s_tag]
-                if data[0] == tag or (data[2] != None and tag in data[2]):
-                    tag_ids[tag] = s_tag
-                    break
+            s_tag = tag_catalog.GetIDFromText(tag)
+            if s_tag != None:
+                tag_ids[tag] = s_tag
     return tag_ids
 
 
+def GetTagNamesMatchingPattern(pattern, limit=None, ranked=False):
+    # matches names and synonyms regardless of check_synonyms_for_wildcards,
+    # returning the names of the first (limit) matching tags in tag ID order,
+    # or of the (limit) most popular matching tags if ranked.
+    if ranked:
+        import heapq
+        tag_ids = tag_catalog.GetIDsMatchingPattern(pattern)
+        if limit == None:
+            tag_ids = sorted(tag_ids, key=GetTagPopularity, reverse=True)
+        else:
+            tag_ids = heapq.nlargest(limit, tag_ids, key=GetTagPopularity)
+    else:
+        tag_ids = tag_catalog.GetIDsMatchingPattern(pattern, limit=limit)
+    return [tag_catalog.names[tag_id] for tag_id in tag_ids]
+
+
 def GetTagID(text):
     global database
     text = EncryptText(config.settings["key"], text)
@@ -488,25 +1494,14 @@ def GetItemNames():
 
 
 def GetTagNames():
-    global database
-    return [
-        DecryptText(config.settings["key"], i[0])
-        for i in database.Query("""SELECT Name FROM Tags""")
-    ]
+    return list(tag_catalog.names.values())
 
 
 def GetTagNamesAndIDs(dict_form=True):
-    global database
-    data = database.Query("""SELECT Name, TagID FROM Tags""")
     if dict_form:
-        new_data = {}
-        for i in data:
-            new_data[DecryptText(config.settings["key"], i[0])] = i[1]
-        return new_data
+        return tag_catalog.name_ids.copy()
     else:
-        data = [[DecryptText(config.settings["key"], i[0]), i[1]]
-                for i in data]
-        return data
+        return [[name, tag_id] for tag_id, name in tag_catalog.names.items()]
 
 
 def GetIgnoredTags():
@@ -530,10 +1525,44 @@ def RemoveIgnoredTag(tag):
     database.QueryAndCommit("DELETE FROM IgnoredTags WHERE Name = ?", (tag, ))
 
 
-def RemoveTag(tag):
+def MarkItemsWithTagChanged(tag_id):
+    # sets the TimeChanged of every item with the given tag, so that they and
+    # the tag are included in the next delta export. must be called within a
+    # transaction, before any of the tag's ItemTags rows are deleted.
     global database
+    database.Query(
+        """UPDATE Items
+           SET TimeChanged = ?
+           WHERE ItemID IN (SELECT ItemID FROM ItemTags WHERE TagID = ?)""",
+        [CurrentTime(), tag_id])
+
+
+def RemoveTag(tag):
+    global database, tag_search_version
+    tag_id = tag_catalog.GetID(tag)
     tag = EncryptText(config.settings["key"], tag)
-    database.QueryAndCommit("DELETE FROM Tags WHERE Name = ?", (tag, ))
+    try:
+        database.BeginTransaction()
+        if tag_id != None:
+            # foreign keys are not enforced, so rows that refer to the tag are
+            # deleted here rather than by ON DELETE CASCADE. the items that
+            # lose the tag are marked as changed for delta exports.
+            MarkItemsWithTagChanged(tag_id)
+            database.Query("DELETE FROM TagSearches WHERE TagID = ?",
+                           (tag_id, ))
+            database.Query("DELETE FROM ItemTags WHERE TagID = ?", (tag_id, ))
+            database.Query("DELETE FROM Synonyms WHERE TagID = ?", (tag_id, ))
+        database.Query("DELETE FROM Tags WHERE Name = ?", (tag, ))
+        database.CommitChanges()
+    except:
+        database.RollbackChanges()
+        raise
+    if tag_id != None:
+        tag_catalog.Remove(tag_id)
+        item_tag_index.RemoveTag(tag_id)
+        if tag_search_counts != None:
+            tag_search_counts.pop(tag_id, None)
+            tag_search_version += 1
 
 
 def RemoveTags(tags):
@@ -543,32 +1572,40 @@ def RemoveTags(tags):
 
 def UpdateTag(old_name, old_synonyms, name, desc, synonyms):
     global database
-    old_name = EncryptText(config.settings["key"], old_name)
-    name = EncryptText(config.settings["key"], name)
-    if desc != None:
-        desc = EncryptText(config.settings["key"], desc)
-    database.QueryAndCommit(
-        """UPDATE Tags
-           SET Name=?, Description=?
-           WHERE Tags.Name = ?""", (name, desc, old_name))
-    # TODO check: not sure why, but tag_id = database.lastrowid was throwing up errors here.
-    # so for now, just the less efficient way.
-    tag_id = database.Query(
-        """SELECT TagID
-           FROM Tags
-           WHERE Tags.Name = ?""", (name, ))[0][0]
-    for s in old_synonyms:
-        if s not in synonyms:
-            s = EncryptText(config.settings["key"], s)
-            database.QueryAndCommit(
-                """DELETE FROM Synonyms 
-                   WHERE Synonym=?""", (s, ))
-    for s in synonyms:
-        if s not in old_synonyms:
-            s = EncryptText(config.settings["key"], s)
-            database.QueryAndCommit(
-                """INSERT INTO Synonyms (TagID, Synonym) 
-                   VALUES (?, ?)""", (tag_id, s))
+    key = config.settings["key"]
+    enc_old_name = EncryptText(key, old_name)
+    enc_name = EncryptText(key, name)
+    enc_desc = EncryptText(key, desc) if desc != None else None
+    try:
+        database.BeginTransaction()
+        database.Query(
+            """UPDATE Tags
+               SET Name=?, Description=?
+               WHERE Tags.Name = ?""", (enc_name, enc_desc, enc_old_name))
+        tag_id = database.Query(
+            """SELECT TagID
+               FROM Tags
+               WHERE Tags.Name = ?""", (enc_name, ))[0][0]
+        # only this tag's rows are removed. deleting by synonym alone would
+        # also remove the synonym from every other tag that shares it.
+        database.QueryMany(
+            """DELETE FROM Synonyms
+               WHERE TagID=? AND Synonym=?""",
+            [(tag_id, EncryptText(key, s))
+             for s in old_synonyms if s not in synonyms])
+        database.QueryMany(
+            """INSERT INTO Synonyms (TagID, Synonym)
+               VALUES (?, ?)""", [(tag_id, EncryptText(key, s))
+                                  for s in synonyms if s not in old_synonyms])
+        MarkItemsWithTagChanged(tag_id)
+        database.CommitChanges()
+    except:
+        database.RollbackChanges()
+        raise
+    # kept synonyms stay in their original SynID order, before any new ones.
+    kept = [s for s in tag_catalog.synonyms.get(tag_id, []) if s in synonyms]
+    tag_catalog.Update(tag_id, name, desc,
+                       kept + [s for s in synonyms if s not in kept])
 
 
 def GetFirstTags(amount):
@@ -0,0 +1,230 @@
+""" Microbenchmarks for performance-sensitive parts of Valor. These do not need
+    a database or a display, and can be run directly with 'python benchmarks.py'.
+"""
+import random
+from time import perf_counter as CurrentTime
+
+
+def TimeCall(func, *args, repeats=3):
+    """ Returns the fastest time (in seconds) taken by any of several calls of
+        the given function with the given arguments. """
+    best = None
+    for _ in range(repeats):
+        t = CurrentTime()
+        func(*args)
+        t = CurrentTime() - t
+        if best == None or t < best:
+            best = t
+    return best
+
+
+def MakeItemTags(items, tags, max_tags_per_item, seed=0):
+    """ Returns a list of randomly generated [item ID, tag ID list] records,
+        in the same form as returned by SQL.GetAllItemTags. """
+    generator = random.Random(seed)
+    return [[i, generator.sample(range(tags),
+                                 generator.randint(0, max_tags_per_item))]
+            for i in range(items)]
+
+
+def BenchmarkQueryCompiler(items=100000, tags=200, max_tags_per_item=8):
+    """ Compares the per-item postfix interpreter (InsertValuesIntoQuery and
+        EvaluatePostfix) with queries compiled by CompileQuery, for both a
+        Boolean and a weighted query. """
+    from searches import ConvertSearchText, ConvertWeightedSearchText
+    from searches import InfixToPostfix, InsertValuesIntoQuery
+    from searches import EvaluatePostfix, CompileQuery
+    data = MakeItemTags(items, tags, max_tags_per_item)
+    boolean_text = "t1 -t2 (t3 OR t4 OR t5*) (t6 XOR t7)"
+    weighted_text = "t1[2] -t2[1] (t3 OR t4)[3] t5"
+    boolean_query, boolean_tags = ConvertSearchText(boolean_text)
+    weighted_query, weighted_tags, _ = ConvertWeightedSearchText(weighted_text)
+    queries = [("boolean", InfixToPostfix(boolean_query), boolean_tags),
+               ("weighted", InfixToPostfix(weighted_query), weighted_tags)]
+
+    for name, query, tag_names in queries:
+        tag_ids = {}
+        for i, tag in enumerate(tag_names):
+            # wildcard terms match several tags, so are given lists of IDs.
+            tag_ids[tag] = [i, i + 10, i + 20] if "*" in tag else i
+
+        def Interpret():
+            results = []
+            for item in data:
+                values = {}
+                for tag in tag_ids:
+                    if isinstance(tag_ids[tag], int):
+                        values[tag] = tag_ids[tag] in item[1]
+                    else:
+                        values[tag] = any(t in item[1] for t in tag_ids[tag])
+                results.append(
+                    EvaluatePostfix(InsertValuesIntoQuery(query, values)))
+            return results
+
+        def Compiled():
+            compiled = CompileQuery(query, tag_ids)
+            return [compiled(set(item[1])) for item in data]
+
+        if Interpret() != Compiled():
+            raise Exception(f'Compiled {name} query gave different results.')
+        interpreted_time = TimeCall(Interpret)
+        compiled_time = TimeCall(Compiled)
+        print(f'{name} query over {items} items: interpreted '
+              f'{interpreted_time:.3f}s, compiled {compiled_time:.3f}s '
+              f'({interpreted_time / compiled_time:.1f}x faster)')
+
+
+def BenchmarkQueryPlanner(items=200000, tags=200):
+    """ Compares evaluating Boolean queries over the ItemTagIndex in textual
+        order (EvaluatePostfixOnIndex) with evaluating their plans from
+        PlanQuery, using tags whose item counts vary widely. """
+    from SQL import ItemTagIndex
+    from searches import ConvertSearchText, EvaluatePostfixOnIndex, PlanQuery
+    generator = random.Random(0)
+    index = ItemTagIndex()
+    index.items = set(range(items))
+    for tag in range(tags):
+        # tag 0 is on about half of all items, and each later tag on fewer.
+        count = items // (2 * (tag + 1)**2) if tag % 10 != 9 else 0
+        index.postings[tag] = set(generator.sample(range(items), count))
+    index.loaded = True
+    for text in [
+            "t0 t1 t2 t20", "t0 -t1 -t2 t3 -(t4 OR t5)", "t0 t9 (t1 OR t2)",
+            "-t0 -t1 -(t2 XOR t3) t30"
+    ]:
+        query, tag_names = ConvertSearchText(text)
+        tag_ids = {tag: int(tag[1:]) for tag in tag_names}
+
+        def Textual():
+            return EvaluatePostfixOnIndex(query.postfix, tag_ids, index)
+
+        def Planned():
+            return sorted(PlanQuery(query, tag_ids, index).Evaluate(index))
+
+        if Textual() != Planned():
+            raise Exception(f'Planned query "{text}" gave different results.')
+        textual_time = TimeCall(Textual)
+        planned_time = TimeCall(Planned)
+        print(f'"{text}" over {items} items: textual order '
+              f'{textual_time:.5f}s, planned {planned_time:.5f}s '
+              f'({textual_time / planned_time:.1f}x faster)')
+
+
+def BenchmarkTopWeighted(items=200000, tags=200, limit=100):
+    """ Compares scoring every item of a weighted query and sorting them all
+        with pruning the candidates for only the top scores, as WeightedSearch
+        does when given a limit. """
+    from SQL import ItemTagIndex
+    from searches import ConvertWeightedSearchText, IncidenceColumns
+    from searches import EvaluateWeightedPostfixOnColumns, AsScores
+    from searches import PruneWeightedCandidates, GetTopPositions
+    index = ItemTagIndex()
+    index.items = set(range(items))
+    for item, item_tags in MakeItemTags(items, tags, 8):
+        for tag in item_tags:
+            index.postings.setdefault(tag, set()).add(item)
+    index.loaded = True
+    columns = IncidenceColumns()
+    columns.Update(index)
+    text = " ".join(f't{i}[{20 - i}]' for i in range(20))
+    query, tag_names, total_shift = ConvertWeightedSearchText(text)
+    tag_ids = {tag: int(tag[1:]) for tag in tag_names}
+
+    def Full():
+        scores = AsScores(
+            EvaluateWeightedPostfixOnColumns(query.postfix, tag_ids,
+                                             columns)) + total_shift
+        ranked = sorted(zip(columns.item_ids.tolist(), scores.tolist()),
+                        key=lambda k: k[1],
+                        reverse=True)
+        return ranked[:limit]
+
+    def Top():
+        positions = PruneWeightedCandidates(query, tag_ids, columns, limit,
+                                            None)
+        scores = AsScores(
+            EvaluateWeightedPostfixOnColumns(query.postfix, tag_ids, columns,
+                                             positions)) + total_shift
+        top = GetTopPositions(columns.item_ids[positions], scores, limit)
+        return list(
+            zip(columns.item_ids[positions][top].tolist(),
+                scores[top].tolist()))
+
+    columns.GetColumn(list(range(tags)))  # builds every tag's rows first
+    if Full() != Top():
+        raise Exception("Top weighted results differ from the full results.")
+    full_time = TimeCall(Full)
+    top_time = TimeCall(Top)
+    print(f'top {limit} of a {len(tag_names)} term weighted query over {items} '
+          f'items: full sort {full_time:.3f}s, pruned {top_time:.3f}s '
+          f'({full_time / top_time:.1f}x faster)')
+
+
+def MatrixLevenshteinDist(a, b):
+    """ The NumPy matrix implementation that searches.GetLevenshteinDist used
+        before the edit_distance module, kept to benchmark against. """
+    import numpy as np
+    rows = len(a) + 1
+    columns = len(b) + 1
+    distance = np.zeros((rows, columns), dtype=int)
+    for i in range(1, rows):
+        for j in range(1, columns):
+            distance[i][0] = i
+            distance[0][j] = j
+    for column in range(1, columns):
+        for row in range(1, rows):
+            if a[row - 1] == b[column - 1]:
+                cost = 0
+            else:
+                cost = 1
+            distance[row][column] = min(distance[row - 1][column] + 1,
+                                        distance[row][column - 1] + 1,
+                                        distance[row - 1][column - 1] + cost)
+    return distance[row][column]
+
+
+def BenchmarkEditDistance(candidates=2000, max_distance=3):
+    """ Compares the NumPy matrix edit distance with the bit-parallel one, one
+        pair at a time, in a batch, and in a batch with a distance cutoff, for
+        one query against many tag-like strings. """
+    from edit_distance import GetEditDistance, GetEditDistances
+    generator = random.Random(0)
+    letters = "abcdefghijklmnopqrstuvwxyz "
+    options = [
+        "".join(generator.choice(letters)
+                for _ in range(generator.randint(3, 30)))
+        for _ in range(candidates)
+    ]
+    query = "example tag name"
+
+    def Matrix():
+        return [int(MatrixLevenshteinDist(query, o)) for o in options]
+
+    def BitParallel():
+        return [GetEditDistance(query, o) for o in options]
+
+    def Batch():
+        return GetEditDistances(query, options)
+
+    def Bounded():
+        return GetEditDistances(query, options, max_distance)
+
+    expected = Matrix()
+    if BitParallel() != expected or Batch() != expected:
+        raise Exception("Bit-parallel edit distances differ from the matrix.")
+    if Bounded() != [d if d <= max_distance else None for d in expected]:
+        raise Exception("Bounded edit distances differ from the matrix.")
+    matrix_time = TimeCall(Matrix)
+    for name, func in [("bit-parallel", BitParallel), ("batch", Batch),
+                       (f'batch with cutoff {max_distance}', Bounded)]:
+        func_time = TimeCall(func)
+        print(f'edit distance against {candidates} strings: matrix '
+              f'{matrix_time:.3f}s, {name} {func_time:.4f}s '
+              f'({matrix_time / func_time:.0f}x faster)')
+
+
+if __name__ == "__main__":
+    BenchmarkQueryCompiler()
+    BenchmarkQueryPlanner()
+    BenchmarkTopWeighted()
+    BenchmarkEditDistance()
@@ -19,7 +19,10 @@ DEFAULT_SETTINGS = {
     "background_image": None,
     "number_of_category_tags": 3,
     "item_tags_shown_per_row": 3,
-    "scroll_speed": 1
+    "scroll_speed": 1,
+    "search_execution_mode": "memory",
+    "search_result_display_limit": 1000,
+    "search_workers": 4
 }  # default settings used if config.JSON cannot be found
 
 global settings
@@ -0,0 +1,294 @@
+""" Reading and writing of CVAL files, which hold exported tag or item data.
+
+    The original CVAL format is a single Fernet token of a JSON list of every
+    record, so the whole file, its plaintext and the decoded records must all
+    be held in memory at once. Version 2 files are instead made up of lines:
+    the header 'CVAL2', an encrypted description of the file, any number of
+    independently encrypted blocks of records and an encrypted trailer. Each
+    block is numbered and the trailer holds the block and record counts, so
+    missing, reordered or truncated blocks are detected. Only one block needs
+    to be held in memory while reading or writing.
+
+    Binary CVAL files have the same structure in a much smaller form. They
+    begin with a fixed header giving the format version and the compression
+    used, followed by frames of a 4 byte length and a Fernet token in its raw
+    (not base64) form. Each token holds compact JSON that is compressed with
+    zlib or lzma before it is encrypted; JSON is kept as it is parsed far
+    faster than values decoded one at a time in Python. Which format is
+    written is chosen by the file's extension, and any format can be read
+    whatever the extension.
+"""
+import io
+import os
+import json
+import struct
+import encryption
+
+CVAL_HEADER = "CVAL2"
+BINARY_HEADER = b"CVALB"
+BINARY_VERSION = 1
+BLOCK_RECORDS = 1000  # the number of records in each block that is written
+COMPRESSIONS = {"zlib": 1, "lzma": 2}
+EXTENSION_COMPRESSIONS = {".cvalz": "zlib", ".cvalx": "lzma"}
+
+
+def GetFileCompression(filename):
+    """ Returns the compression used by the binary CVAL format chosen by the
+        filename's extension, or None if the text format should be used. """
+    return EXTENSION_COMPRESSIONS.get(os.path.splitext(filename)[1].lower())
+
+
+def Compress(data, compression):
+    if compression == "zlib":
+        from zlib import compress as CompressZlib
+        return CompressZlib(data)
+    from lzma import compress as CompressLZMA
+    return CompressLZMA(data)
+
+
+def Decompress(data, compression):
+    if compression == "zlib":
+        from zlib import decompress as DecompressZlib
+        return DecompressZlib(data)
+    from lzma import decompress as DecompressLZMA
+    return DecompressLZMA(data)
+
+
+class CVALWriter:
+    """ A class used to write records to a version 2 CVAL file one block at a
+        time, as they are given."""
+    def __init__(self,
+                 file_,
+                 key,
+                 kind,
+                 total=None,
+                 block_records=BLOCK_RECORDS,
+                 progress=None):
+        """ The constructor for the CVALWriter class, which writes the header.
+              Inputs: file_ (a file object opened for writing text), key (a
+            Fernet key), kind (a string such as 'tags' or 'items'), total (the
+            number of records that will be written, or None if unknown),
+            block_records (the number of records in each block) and progress
+            (None, or a function called with the number of records written
+            and the total after each block is written).
+              Outputs: None."""
+        self.file_ = file_
+        self.key = key
+        self.total = total
+        self.block_records = block_records
+        self.progress = progress
+        self.block = []
+        self.blocks = 0
+        self.records = 0
+        self.WriteHeader()
+        self.WriteToken({"kind": kind, "records": total})
+
+    def WriteHeader(self):
+        self.file_.write(CVAL_HEADER + "\n")
+
+    def WriteToken(self, data):
+        self.file_.write(
+            encryption.EncryptTextWithKey(self.key, json.dumps(data)) + "\n")
+
+    def Write(self, record):
+        self.block.append(record)
+        if len(self.block) >= self.block_records:
+            self.Flush()
+
+    def WriteMany(self, records):
+        for record in records:
+            self.Write(record)
+
+    def Flush(self):
+        # encrypts and writes any records that are not yet written.
+        if len(self.block) == 0:
+            return
+        self.WriteToken([self.blocks, self.block])
+        self.blocks += 1
+        self.records += len(self.block)
+        self.block = []
+        if self.progress != None:
+            self.progress(self.records, self.total)
+
+    def Close(self):
+        """ Writes any remaining records and the trailer. The file itself is
+            not closed. No inputs or outputs."""
+        self.Flush()
+        self.WriteToken({"blocks": self.blocks, "records": self.records})
+
+
+class BinaryCVALWriter(CVALWriter):
+    """ A class used to write records to a binary CVAL file, which has the
+        same blocks as a version 2 CVAL file in a smaller form."""
+    def __init__(self,
+                 file_,
+                 key,
+                 kind,
+                 total=None,
+                 block_records=BLOCK_RECORDS,
+                 progress=None,
+                 compression="zlib"):
+        """ The constructor for the BinaryCVALWriter class, which takes the
+            same inputs as CVALWriter except that file_ must be opened for
+            writing bytes, as well as compression (either 'zlib' or 'lzma')."""
+        self.compression = compression
+        super().__init__(file_, key, kind, total, block_records, progress)
+
+    def WriteHeader(self):
+        self.file_.write(BINARY_HEADER + bytes(
+            [BINARY_VERSION, COMPRESSIONS[self.compression]]))
+
+    def WriteToken(self, data):
+        from base64 import urlsafe_b64decode as DecodeURLSafeB64
+        data = json.dumps(data, separators=(",", ":")).encode()
+        token = DecodeURLSafeB64(
+            encryption.EncryptBytesWithKey(self.key,
+                                           Compress(data, self.compression)))
+        self.file_.write(struct.pack("<I", len(token)) + token)
+
+
+def WriteRecords(file_,
+                 key,
+                 kind,
+                 records,
+                 total=None,
+                 progress=None,
+                 compression=None):
+    """ Writes an iterable of records to a CVAL file.
+          Inputs: file_ (a file object, opened for writing text if
+        compression is None and bytes otherwise), key (a Fernet key), kind (a
+        string such as 'tags' or 'items'), records (an iterable of JSON
+        serialisable records), total (the number of records, or None),
+        progress (None, or a function called with the number of records
+        written and the total) and compression (None for a version 2 CVAL
+        file, or 'zlib' or 'lzma' for a binary one).
+          Outputs: the number of records written."""
+    if compression == None:
+        writer = CVALWriter(file_, key, kind, total, progress=progress)
+    else:
+        writer = BinaryCVALWriter(file_,
+                                  key,
+                                  kind,
+                                  total,
+                                  progress=progress,
+                                  compression=compression)
+    writer.WriteMany(records)
+    writer.Close()
+    return writer.records
+
+
+def ReadRecordBlocks(file_, key, kind=None, progress=None):
+    """ A generator that reads a CVAL file of any format, one block of records
+        at a time. Files in the original format are read whole and given as a
+        single block.
+          Inputs: file_ (a file object opened for reading text or bytes; only
+        binary CVAL files need bytes), key (a Fernet key), kind (the kind of
+        records expected, which is checked against the kind given in version
+        2 and binary files, or None to accept any) and progress (None, or a
+        function called with the number of records read and the total number
+        of records, or None if unknown).
+          Outputs: yields lists of records. A ValueError is raised if the file
+        is not a valid CVAL file, has been truncated or holds the wrong kind
+        of records."""
+    if not isinstance(file_, io.TextIOBase):
+        start = file_.read(len(BINARY_HEADER))
+        file_.seek(-len(start), io.SEEK_CUR)
+        if start == BINARY_HEADER:
+            yield from ReadBinaryRecordBlocks(file_, key, kind, progress)
+            return
+        file_ = io.TextIOWrapper(file_, encoding="ascii")
+    yield from ReadTextRecordBlocks(file_, key, kind, progress)
+
+
+def ReadTextRecordBlocks(file_, key, kind=None, progress=None):
+    # reads a CVAL file in the original or version 2 format.
+    first_line = file_.readline().strip()
+    if first_line != CVAL_HEADER:
+        # the original format, in which the whole file is one token.
+        text = first_line + "".join(line.strip() for line in file_)
+        records = json.loads(encryption.DecryptTextWithKey(key, text))
+        if progress != None:
+            progress(len(records), len(records))
+        yield records
+        return
+    header = None
+    blocks = 0
+    records = 0
+    for line in file_:
+        line = line.strip()
+        if line == "":
+            continue
+        data = json.loads(encryption.DecryptTextWithKey(key, line))
+        if header == None:
+            header = data
+            if kind != None and header.get("kind") != kind:
+                raise ValueError(
+                    f'The file holds {header.get("kind")}, not {kind}.')
+        elif isinstance(data, dict):
+            if data.get("blocks") != blocks or data.get("records") != records:
+                raise ValueError("The file is missing some of its records.")
+            return
+        elif data[0] != blocks:
+            raise ValueError("The blocks of the file are out of order.")
+        else:
+            blocks += 1
+            records += len(data[1])
+            yield data[1]
+            if progress != None:
+                progress(records, header.get("records"))
+    raise ValueError("The file has been truncated.")
+
+
+def ReadBinaryRecordBlocks(file_, key, kind=None, progress=None):
+    # reads a binary CVAL file, which must be opened for reading bytes.
+    from base64 import urlsafe_b64encode as EncodeURLSafeB64
+    header = file_.read(len(BINARY_HEADER) + 2)
+    if len(header) < len(BINARY_HEADER) + 2 or (header[:len(BINARY_HEADER)]
+                                                != BINARY_HEADER):
+        raise ValueError("The file is not a binary CVAL file.")
+    if header[-2] != BINARY_VERSION:
+        raise ValueError(
+            f'Binary CVAL files of version {header[-2]} are not supported.')
+    compressions = {value: name for name, value in COMPRESSIONS.items()}
+    if header[-1] not in compressions:
+        raise ValueError("The file uses an unknown compression.")
+    compression = compressions[header[-1]]
+    description = None
+    blocks = 0
+    records = 0
+    while True:
+        length = file_.read(4)
+        if len(length) < 4:
+            raise ValueError("The file has been truncated.")
+        length = struct.unpack("<I", length)[0]
+        token = file_.read(length)
+        if len(token) < length:
+            raise ValueError("The file has been truncated.")
+        data = json.loads(
+            Decompress(
+                encryption.DecryptBytesWithKey(key, EncodeURLSafeB64(token)),
+                compression))
+        if description == None:
+            description = data
+            if kind != None and description.get("kind") != kind:
+                raise ValueError(
+                    f'The file holds {description.get("kind")}, not {kind}.')
+        elif isinstance(data, dict):
+            if data.get("blocks") != blocks or data.get("records") != records:
+                raise ValueError("The file is missing some of its records.")
+            return
+        elif data[0] != blocks:
+            raise ValueError("The blocks of the file are out of order.")
+        else:
+            blocks += 1
+            records += len(data[1])
+            yield data[1]
+            if progress != None:
+                progress(records, description.get("records"))
+
+
+def ReadRecords(file_, key, kind=None, progress=None):
+    """ A generator that reads a CVAL file of either version one record at a
+        time, taking the same inputs as ReadRecordBlocks."""
+    for block in ReadRecordBlocks(file_, key, kind, progress):
+        yield from block
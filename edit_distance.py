@@ -0,0 +1,93 @@
+""" Functions for finding the Levenshtein (edit) distance between strings,
+    the minimum number of single character insertions, deletions and
+    substitutions needed to turn one string into the other.
+
+    These use the bit-parallel algorithm of Myers, in the form given by Hyyro
+    for edit distance: each column of the dynamic programming matrix is held as
+    two bit vectors of vertical +1/-1 differences, so every character of the
+    text updates a whole column in a handful of integer operations. Python's
+    integers have no fixed width, so strings of any length are supported, but
+    the speed-up is largest for short strings such as tag names.
+"""
+
+
+def GetPatternMasks(pattern):
+    """ Returns a dictionary mapping each character in the pattern to a bit
+        mask of the positions it occurs at, which only needs to be computed
+        once for each pattern that is compared. """
+    masks = {}
+    for i, char in enumerate(pattern):
+        masks[char] = masks.get(char, 0) | (1 << i)
+    return masks
+
+
+def GetDistanceFromMasks(masks, length, text, max_distance=None):
+    """ Finds the edit distance between a pattern and a text.
+          Inputs: masks (the pattern's masks, from GetPatternMasks), length
+        (the length of the pattern), text (a string) and max_distance (an
+        integer cutoff, or None for no cutoff).
+          Outputs: the edit distance as an integer, or None if the distance is
+        greater than max_distance."""
+    if max_distance != None and abs(length - len(text)) > max_distance:
+        return None
+    if length == 0:
+        return len(text)
+    all_bits = (1 << length) - 1
+    last_bit = 1 << (length - 1)
+    positive = all_bits  # the vertical +1 differences of the current column
+    negative = 0  # the vertical -1 differences of the current column
+    distance = length
+    remaining = len(text)
+    for char in text:
+        matches = masks.get(char, 0)
+        vertical = matches | negative
+        horizontal = (((matches & positive) + positive) ^ positive) | matches
+        horizontal_positive = negative | (~(horizontal | positive) & all_bits)
+        horizontal_negative = positive & horizontal
+        if horizontal_positive & last_bit:
+            distance += 1
+        elif horizontal_negative & last_bit:
+            distance -= 1
+        remaining -= 1
+        # the distance can fall by at most one for each remaining character.
+        if max_distance != None and distance - remaining > max_distance:
+            return None
+        horizontal_positive = ((horizontal_positive << 1) | 1) & all_bits
+        horizontal_negative = (horizontal_negative << 1) & all_bits
+        positive = horizontal_negative | (~(vertical | horizontal_positive)
+                                          & all_bits)
+        negative = horizontal_positive & vertical
+    if max_distance != None and distance > max_distance:
+        return None
+    return distance
+
+
+def GetEditDistance(a, b):
+    """ Returns the edit distance between two strings as an integer. """
+    if len(a) > len(b):
+        a, b = b, a  # the shorter string needs smaller bit vectors
+    return GetDistanceFromMasks(GetPatternMasks(a), len(a), b)
+
+
+def GetBoundedEditDistance(a, b, max_distance):
+    """ Returns the edit distance between two strings if it is no greater than
+        max_distance, and None otherwise. Strings whose lengths differ by more
+        than max_distance are rejected without being compared, and comparisons
+        stop as soon as the distance can no longer fall within the cutoff. """
+    if len(a) > len(b):
+        a, b = b, a
+    return GetDistanceFromMasks(GetPatternMasks(a), len(a), b, max_distance)
+
+
+def GetEditDistances(query, candidates, max_distance=None):
+    """ Finds the edit distance between one string and each of many others,
+        only building the bit masks for the query once.
+          Inputs: query (a string), candidates (an iterable of strings) and
+        max_distance (an integer cutoff, or None for no cutoff).
+          Outputs: a list of the distances in the same order as the candidates,
+        where any distance greater than max_distance is given as None."""
+    masks = GetPatternMasks(query)
+    return [
+        GetDistanceFromMasks(masks, len(query), candidate, max_distance)
+        for candidate in candidates
+    ]
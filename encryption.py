@@ -42,6 +42,16 @@ def DecryptTextWithKey(key, ciphertext, decode=True):
     encoded_text = Fernet(key).decrypt(str.encode(ciphertext))
     return encoded_text.decode() if decode else encoded_text
 
+
+def EncryptBytesWithKey(key, data):
+    from cryptography.fernet import Fernet
+    return Fernet(key).encrypt(data)
+
+
+def DecryptBytesWithKey(key, token):
+    from cryptography.fernet import Fernet
+    return Fernet(key).decrypt(token)
+
 """
 def HashText(text):
     salt = uuid.uuid4().hex  # generates random salt value
@@ -248,6 +248,8 @@ class AdvancedLabel(BaseElement):
         self.width = self.size.x
         self.height = self.size.y
         self.display_text = ['']
+        self.line_heights = [0]
+        self.text_height = 0  # the total height of the lines of display_text
         self.max_height = self.height
         self.max_scroll = 0
         self.current_scroll = 0
@@ -263,12 +265,42 @@ class AdvancedLabel(BaseElement):
     @text.setter
     def text(self, new_text):
         self._text = new_text
-        self.display_text = new_text.split("\n")
+        self.display_text = self.WrapLines(new_text.split("\n"))
+        self.line_heights = [
+            self.font.size(line)[1] for line in self.display_text
+        ]
+        self.text_height = sum(self.line_heights)
+        self.UpdateMaxScroll()
+        if self.auto_scroll_position != None:
+            self.current_scroll = self.max_scroll * self.auto_scroll_position
+            if self.current_scroll < 0:
+                self.current_scroll = 0
+        self.UpdateImage()
+
+    def AppendText(self, new_text):
+        # adds text to the end of the label, only wrapping and measuring the
+        # new text (and the line it continues) rather than all of the label's
+        # text again.
+        last_line = self._text[self._text.rfind("\n") + 1:]
+        replaced = len(self.WrapLines([last_line]))
+        del self.display_text[-replaced:]
+        self.text_height -= sum(self.line_heights[-replaced:])
+        del self.line_heights[-replaced:]
+        self._text += new_text
+        new_lines = self.WrapLines((last_line + new_text).split("\n"))
+        new_heights = [self.font.size(line)[1] for line in new_lines]
+        self.display_text += new_lines
+        self.line_heights += new_heights
+        self.text_height += sum(new_heights)
+        self.UpdateMaxScroll()
+        self.UpdateImage()
+
+    def WrapLines(self, lines):
         max_line_width = self.width - 2 * (self.padding.x +
                                            self.outline_size.x)
         new_display_text = []
-        for i in range(len(self.display_text)):
-            new_line = self.display_text[i]
+        for i in range(len(lines)):
+            new_line = lines[i]
             if new_line == '':  # i.e. an empty line that won't get caught
                 new_display_text.append(new_line)
             while new_line != '':
@@ -280,19 +312,13 @@ class AdvancedLabel(BaseElement):
                     text = text[:-1]
                     j += 1
                 new_display_text.append(text)
-        self.display_text = new_display_text
-        sizes = []
-        for line in self.display_text:
-            sizes.append(Vector2D(self.font.size(line)))
-        height = (len(sizes) - 1) * self.line_seperation
-        height += sum([size.y for size in sizes])
+        return new_display_text
+
+    def UpdateMaxScroll(self):
+        height = (len(self.display_text) - 1) * self.line_seperation
+        height += self.text_height
         self.max_height = height + 2 * (self.padding.y + self.outline_size.y)
         self.max_scroll = self.max_height - self.height
-        if self.auto_scroll_position != None:
-            self.current_scroll = self.max_scroll * self.auto_scroll_position
-            if self.current_scroll < 0:
-                self.current_scroll = 0
-        self.UpdateImage()
 
     def UpdateImage(self):
         self.image = pygame.Surface(tuple(self.size), pygame.SRCALPHA, 32)
@@ -304,7 +330,7 @@ class AdvancedLabel(BaseElement):
         smaller_image.fill(self.background_colour)
         self.image.blit(smaller_image, tuple(self.outline_size))
         added = Vector2D(0, 0)
-        for line in self.display_text:
+        for line, line_height in zip(self.display_text, self.line_heights):
             position = self.padding + added - Vector2D(0, self.current_scroll)
             if position.y >= self.height:
                 label = self.font.render(line, 1, self.text_colour)
@@ -314,10 +340,10 @@ class AdvancedLabel(BaseElement):
                 label = self.font.render(line, 1, self.text_colour)
                 self.image.blit(label, tuple(position))
             else:
-                if position.y + self.font.size(line)[1] > 0:
+                if position.y + line_height > 0:
                     label = self.font.render(line, 1, self.text_colour)
                     self.image.blit(label, tuple(position))
-            added.y += self.line_seperation + self.font.size(line)[1]
+            added.y += self.line_seperation + line_height
 
     def Draw(self, surface, shift=Vector2D(0, 0), draw_end=None):
         if super().Draw(surface, shift, draw_end) == False:
@@ -8,15 +8,17 @@ import pygame
 import debug
 import SQL
 import encryption
+import cval
 import startup
 from controls import controls
-from searches import GetTagMostSimilar, SplitByCharacters, FormatImportTags, StrictSearch, WeightedSearch, ExtremeSearch, Operators, FormatResultsToHTML
+from searches import GetSimilarTags, SplitByCharacters, FormatImportTags, StrictSearchChunks, WeightedSearchChunks, ExtremeSearchChunks, Operators, FormatResultsToHTML
+from searches import search_cache, ExplainSearch, TagPrefixIndex, RecordSearchedTags
+from searches import TagSearchWorker, CountWeightedMatches
 from vectors import Vector2D
 from interface import ScalePosition, Entry, Button, Label, Container, FunctionalEntry, AdvancedLabel, CheckButton, CacheButton, Rectangle
 from interface import HoverButton, UnfocusEntry, ConstantFunctionalEntry, RegulatedContainer, ScrollingRegulatedContainer, ImageElement, RatingsBar
 from interface import SearchBar
 from components import StaticComponent, ScrollComponent
-from fnmatch import filter as WildcardMatch
 from time import time as CurrentTime
 from enum import Enum
 
@@ -111,7 +113,11 @@ class MenuConstructor:
             "tag view": self.CLIViewTag,
             "tag edit": self.CLIEditTag,
             "tag remove": self.CLIRemoveTag,
+            "sync export": self.CLIExportItemChanges,
+            "sync import": self.CLIImportItemChanges,
             "tag delete": self.CLIRemoveTag,
+            "search cache": self.CLISearchCache,
+            "search explain": self.CLIExplainSearch,
             "quit": self.CLIQuit,
             "font": self.CLIFontChange,
             "cls": self.CLIClear,
@@ -258,6 +264,10 @@ class MenuConstructor:
                 "tag view x - View a tag's information. See 'tag view help' for more",
                 "tag edit x - Edit and update a tag's details. See 'tag edit help' for more",
                 "tag remove x - Remove a tag. See 'tag remove help' for more",
+                "sync export x - Exports only the items changed since the last sync. See 'sync export help' for more",
+                "sync import x - Applies the item changes from a sync export. See 'sync import help' for more",
+                "search cache - Shows search cache statistics. See 'search cache help' for more",
+                "search explain x - Shows how a search is evaluated. See 'search explain help' for more",
                 "font x - Changes the command line font to the font named x",
                 "clear / cls - Clears the command line output",
                 "quit - Quit the program",
@@ -359,7 +369,7 @@ class MenuConstructor:
         elif import_data[0].lower() in ["file", "choose"]:
             self.ImportTagsFromFile()
             debug.Log("Attempted to import tags from a file through the CLI.")
-        elif command.endswith(".CVAL") or command.endswith(".txt"):
+        elif command.endswith((".CVAL", ".CVALZ", ".CVALX", ".txt")):
             file_path = "".join(import_data)
             self.ImportTagsFromFile(filename=file_path)
             debug.Log("Attempted to import tags from a file through the CLI.")
@@ -390,7 +400,7 @@ class MenuConstructor:
         elif export_data[0].lower() in ["file", "choose"]:
             self.ExportTagsToFile()
             debug.Log("Attempted to export tags to a file through the CLI.")
-        elif command.endswith(".CVAL") or command.endswith(".txt"):
+        elif command.endswith((".CVAL", ".CVALZ", ".CVALX", ".txt")):
             file_path = "".join(export_data)
             self.ExportTagsToFile(filename=file_path)
             debug.Log("Attempted to export tags to a file through the CLI.")
@@ -399,6 +409,77 @@ class MenuConstructor:
                 "That input was not understood. Look at 'tag export help' for"
                 + "\nmore information.")
 
+    def CLIExportItemChanges(self, command):
+        command = command.strip()
+        export_data = command.split(" ")[2:]
+        RemoveStringFromList(export_data, '')
+        if len(export_data) == 0:
+            self.PrintToCLI(
+                "That input was not understood. Look at 'sync export help' for"
+                + "\nmore information.")
+            return
+        if export_data[0].lower() == "help":
+            self.PrintToCLI(
+                "\nExport the items added, changed or removed since the last sync"
+                + "\nexport to a given file in the following format:" +
+                '\n > sync export [path to file] ' +
+                '\nExport them to a file you can manually select using:' +
+                '\n > sync export file' +
+                '\nOr export the changes since a given Unix timestamp with:' +
+                '\n > sync export [path to file] since [timestamp]')
+            return
+        since = None
+        if len(export_data) > 2 and export_data[-2].lower() == "since":
+            try:
+                since = float(export_data[-1])
+            except ValueError:
+                self.PrintToCLI("That timestamp is not a number.")
+                return
+            export_data = export_data[:-2]
+        if export_data[0].lower() in ["file", "choose"]:
+            self.ExportItemChangesToFile(since=since)
+            debug.Log(
+                "Attempted to export item changes to a file through the CLI.")
+        elif export_data[-1].endswith((".CVAL", ".CVALZ", ".CVALX", ".txt")):
+            file_path = "".join(export_data)
+            self.ExportItemChangesToFile(filename=file_path, since=since)
+            debug.Log(
+                "Attempted to export item changes to a file through the CLI.")
+        else:
+            self.PrintToCLI(
+                "That input was not understood. Look at 'sync export help' for"
+                + "\nmore information.")
+
+    def CLIImportItemChanges(self, command):
+        command = command.strip()
+        import_data = command.split(" ")[2:]
+        RemoveStringFromList(import_data, '')
+        if len(import_data) == 0:
+            self.PrintToCLI(
+                "That input was not understood. Look at 'sync import help' for"
+                + "\nmore information.")
+            return
+        if import_data[0].lower() == "help":
+            self.PrintToCLI(
+                "\nApply the item changes from a sync export file with:" +
+                '\n > sync import [path to file] ' +
+                '\nOr from a file you can manually select using:' +
+                '\n > sync import file' +
+                '\nApplying the same changes more than once has no effect.')
+        elif import_data[0].lower() in ["file", "choose"]:
+            self.ImportItemChangesFromFile()
+            debug.Log(
+                "Attempted to import item changes from a file through the CLI.")
+        elif command.endswith((".CVAL", ".CVALZ", ".CVALX", ".txt")):
+            file_path = "".join(import_data)
+            self.ImportItemChangesFromFile(filename=file_path)
+            debug.Log(
+                "Attempted to import item changes from a file through the CLI.")
+        else:
+            self.PrintToCLI(
+                "That input was not understood. Look at 'sync import help' for"
+                + "\nmore information.")
+
     def CLISearchTags(self, command):
         command = command.strip()
         tag_data = command.split(" ")[2:]
@@ -436,12 +517,7 @@ class MenuConstructor:
         if len(query) == 0:
             self.PrintToCLI("No matches found.")
             return
-        matches = GetTagMostSimilar(query, SQL.GetTagNames())
-        tags = sorted(list(matches), key=lambda k: matches[k], reverse=True)
-        for i, tag in enumerate(tags):
-            if matches[tag] < distance:
-                tags = tags[:i]
-                break
+        tags = GetSimilarTags(query, SQL.GetTagNames(), distance)
         debug.Log(
             f'Searched for tags through the CLI. {len(tags)} matches found.')
         if len(tags) == 0:
@@ -637,6 +713,67 @@ class MenuConstructor:
                 "That tag could not be found. Look at 'tag remove help' for" +
                 "\nmore information")
 
+    def CLISearchCache(self, command):
+        command = command.strip()
+        cache_data = command.split(" ")[2:]
+        RemoveStringFromList(cache_data, '')
+        if len(cache_data) > 0 and cache_data[0].lower() == "help":
+            self.PrintToCLI(
+                "\nShow how often repeated searches were answered from the cache with:"
+                + '\n > search cache' +
+                '\nEmpty the cache and reset its statistics with:' +
+                '\n > search cache clear')
+            return
+        if len(cache_data) > 0 and cache_data[0].lower() == "clear":
+            search_cache.Clear()
+            self.PrintToCLI("Search cache cleared.")
+            debug.Log("Cleared the search cache through the CLI.")
+            return
+        stats = search_cache.stats
+        self.PrintToCLI("\n HITS: {}".format(stats["HITS"]) +
+                        "\n MISSES: {}".format(stats["MISSES"]) +
+                        "\n CACHED SEARCHES: {} / {}".format(
+                            stats["SIZE"], stats["MAX_SIZE"]))
+
+    def CLIExplainSearch(self, command):
+        command = command.strip()
+        search_data = command.split(" ")[2:]
+        RemoveStringFromList(search_data, '')
+        if len(search_data) == 0:
+            self.PrintToCLI(
+                "That input was not understood. Look at 'search explain help' for"
+                + "\nmore information.")
+            return
+        if search_data[0].lower() == "help":
+            self.PrintToCLI(
+                "\nShow how a search would be evaluated, without running it, with:"
+                + '\n > search explain [type] [query]' +
+                '\nWhere the type is strict, weighted or extreme, and the query is'
+                + '\nwritten as it would be in the search bar. You can also leave the'
+                + '\ntype blank to explain a strict search:' +
+                '\n > search explain [query]' +
+                '\nEach step shows roughly how many items it matches; steps that'
+                + '\ncannot match anything are skipped.')
+            return
+        search_type = "STRICT"
+        if search_data[0].upper() in ["STRICT", "WEIGHTED", "EXTREME"]:
+            search_type = search_data[0].upper()
+            search_data = search_data[1:]
+        try:
+            plan = ExplainSearch(" ".join(search_data), search_type)
+        except:
+            self.PrintToCLI("That search query is invalid.")
+            return
+        if isinstance(plan, tuple) and plan[0] == "INVALID":
+            if plan[1] == "TAGS":
+                self.PrintToCLI("That search contains tags that do not exist.")
+            else:
+                self.PrintToCLI("That query is innapropriate for a {} search.".
+                                format(search_type.lower()))
+            return
+        debug.Log("Explained a search through the CLI.")
+        self.PrintToCLI("\n" + "\n".join(plan))
+
     def CLIConfirm(self, command):
         if len(self.cli_history) > 0:
             debug.Log(
@@ -913,23 +1050,50 @@ class MenuConstructor:
                      PhotoImage(file='gui\\images\\Logo32.png'))
 
     def AttemptTagImport(self, ImportText):
+        from io import StringIO
+        self.ImportTagData(StringIO(ImportText))
+
+    def ImportTagData(self, file_):
+        # reads the tags from a CVAL file one block at a time, adding each
+        # block's valid tags before the next block is read. nothing is
+        # committed until the whole file has been read, so a truncated or
+        # corrupted file adds no tags.
         from base64 import b64encode as EncodeB64
-        from json import loads as LoadJSON
+        successful = 0
+        SQL.BeginImport()
         try:
-            imported_text = encryption.DecryptTextWithKey(
-                EncodeB64(config.settings["key"]), ImportText)
-            tag_data = LoadJSON(imported_text)
-            successful = 0
+            error_args = [
+                self.tag_first_bar,
+                [ComponentID.TAG_SECOND_BAR, ComponentID.TAG_LIST]
+            ]
+            used_names = set()  # names & synonyms of the tags being imported
             failed = []
-            for tag in tag_data:
-                success = self.AttemptAddNewTag(tag[0], tag[1], tag[2], [
-                    self.tag_first_bar,
-                    [ComponentID.TAG_SECOND_BAR, ComponentID.TAG_LIST]
-                ], False, False)
-                if success:
-                    successful += 1
-                else:
-                    failed.append(tag[0])
+            categories = []  # names of the tags that become categories
+            for tag_data in cval.ReadRecordBlocks(
+                    file_, EncodeB64(config.settings["key"]), "tags"):
+                to_add = []
+                for tag in tag_data:
+                    synonyms = tag[2] if tag[2] != None else []
+                    names = [tag[0]] + synonyms
+                    if any(n in used_names for n in names) or (
+                            not self.CheckTagInfo(tag[0], tag[1], synonyms,
+                                                  error_args, False)):
+                        failed.append(tag[0])
+                        continue
+                    used_names.update(names)
+                    to_add.append((tag[0], tag[1], synonyms))
+                SQL.AddTags(to_add)
+                successful += len(to_add)
+                ignored = SQL.GetIgnoredTags()
+                for name, _, synonyms in to_add:
+                    if len(categories) < self.categories_to_add:
+                        categories.append(name)
+                    for item in [name] + synonyms:
+                        if item in ignored:
+                            SQL.RemoveIgnoredTag(name)
+            SQL.EndImport(True)
+            for name in categories:
+                self.AddNewCategory(name)
             self.AddNotification(
                 "{} tags successfully added & {} failed".format(
                     successful, len(failed)),
@@ -937,11 +1101,14 @@ class MenuConstructor:
             debug.Log(
                 f'Successfully imported {successful} tags and failed to import {len(failed)} tags.'
             )
-            if successful > 0:
-                self.RefreshTags()
         except:
-            self.AddNotification("Failed to import tags")
-            debug.Log("Failed to import tags.")
+            SQL.EndImport(False)
+            self.AddNotification("Failed to import tags, so none were added")
+            debug.Log(f'Failed to import tags, so the {successful} valid tags '
+                      'read before the failure were not added.')
+            successful = 0
+        if successful > 0:
+            self.RefreshTags()
 
     def ImportTagsFromClipboard(self):
         from pyperclip import paste as PasteFromClipboard
@@ -956,25 +1123,28 @@ class MenuConstructor:
                 from tkinter.filedialog import askopenfilename as AskOpenFileName
                 filename = AskOpenFileName(
                     title="Select a file to import tag data from",
-                    filetypes=(("CVAL files", "*.CVAL"), ("Text files",
-                                                          "*.txt")))
+                    filetypes=(("CVAL files", "*.CVAL *.CVALZ *.CVALX"),
+                               ("Text files", "*.txt")))
             if filename != '':
                 debug.Log(f'Attempted to import tags from a file.')
-                with open(filename, "r") as f:
-                    data = f.read()
-                    f.close()
-                self.AttemptTagImport(data.strip())
+                with open(filename, "rb") as f:
+                    self.ImportTagData(f)
         except FileNotFoundError:
             self.AddNotification("The specified file could not be found")
         except:
             self.AddNotification("An error occurred accessing the file")
 
-    def GetTagExport(self):
+    def WriteTagExport(self, file_, progress=None, compression=None):
         from base64 import b64encode as EncodeB64
-        from json import dumps as DumpJSON
-        tag_data = DumpJSON(SQL.GetAllTagData())
-        return encryption.EncryptTextWithKey(EncodeB64(config.settings["key"]),
-                                             tag_data)
+        tag_data = SQL.GetAllTagData()
+        cval.WriteRecords(file_, EncodeB64(config.settings["key"]), "tags",
+                          tag_data, len(tag_data), progress, compression)
+
+    def GetTagExport(self):
+        from io import StringIO
+        export = StringIO()
+        self.WriteTagExport(export)
+        return export.getvalue()
 
     def ExportTagsToClipboard(self):
         from pyperclip import copy as CopyToClipboard
@@ -987,18 +1157,20 @@ class MenuConstructor:
                 if not self.file_dialog_used:
                     self.SetupDefaultFileDialog()
                     self.file_dialog_used = True
-                from tkinter.filedialog import asksaveasfile as AskSaveAsFile
-                file_ = AskSaveAsFile(
+                from tkinter.filedialog import asksaveasfilename as AskSaveAsFileName
+                filename = AskSaveAsFileName(
                     title="Create a file to save tag data to",
-                    filetypes=(("CVAL files", "*.CVAL"), ("Text files",
-                                                          "*.txt")),
+                    filetypes=(("CVAL files", "*.CVAL"),
+                               ("Compressed CVAL files", "*.CVALZ"),
+                               ("Smallest CVAL files", "*.CVALX"),
+                               ("Text files", "*.txt")),
                     defaultextension="CVAL")
-            else:
-                file_ = open(filename, 'w+')
-            if file_ != None:
-                debug.Log(f'Exported tag information to a file.')
-                file_.write(self.GetTagExport())
-                file_.close()
+            if filename != '':
+                # binary CVAL files are chosen by the file's extension.
+                compression = cval.GetFileCompression(filename)
+                with open(filename, 'w' if compression == None else 'wb') as f:
+                    debug.Log(f'Exported tag information to a file.')
+                    self.WriteTagExport(f, compression=compression)
                 self.AddNotification("Tag data successfully exported to file")
         except:
             self.AddNotification("An error occurred accessing the file")
@@ -1321,17 +1493,34 @@ class MenuConstructor:
     def UpdateSearchedTags(self, new_text):
         self.tags_container.current_row = 0
         if len(new_text) == 0:
+            self.tag_search_worker.Cancel()
             self.tags = [t[:4] + [True] for t in self.original_tags]
             self.UpdateDisplayedTags()
             return
-        matches = GetTagMostSimilar(new_text.lower(),
-                                    [tag[0] for tag in self.tags])
+        # tags that cannot reach the threshold are not scored, and are hidden
+        # by UpdateTagsFromResults as they are missing from the matches.
+        self.tag_search_worker.Submit(
+            new_text.lower(), [tag[0] for tag in self.tags],
+            config.settings["levenshtein_search_threshold"])
+        if not self.tag_search_polling:
+            self.tag_search_polling = True
+            self.PollTagSearchResults()
+
+    def PollTagSearchResults(self):
+        # runs on the main thread once a frame until the worker is idle, so
+        # that results are only ever applied on the main thread.
+        busy = self.tag_search_worker.busy
+        matches = self.tag_search_worker.TakeResult()
+        if matches != None:
+            self.UpdateTagsFromResults(matches)
+        if not busy:
+            self.tag_search_polling = False
+            return
         self.tags_list_component.AddCommand({
             "TYPE": "EXECUTE",
-            "FUNCTION": self.UpdateTagsFromResults,
-            "ARGUMENTS": [matches],
-            "KWARGUMENTS": {},
-            "THREADED": True
+            "FUNCTION": self.PollTagSearchResults,
+            "ARGUMENTS": [],
+            "KWARGUMENTS": {}
         })
 
     def ResetTagsMenuFromThirdBar(self):
@@ -1360,6 +1549,7 @@ class MenuConstructor:
         self.RefreshTags()
         self.tags_menu_remove_button.pressed = selection_mode
         self.tags_menu_search_entry.Reset()
+        self.tag_search_worker.Cancel()
         for button in self.tags_buttons:
             button.position = Vector2D(-config.settings["window_width"], 0)
 
@@ -1809,6 +1999,8 @@ class MenuConstructor:
         size = config.settings["window_size"] - pos
         self.tags_list_component = StaticComponent(pos, size, (0, 0, 0, 0))
         self.tags_list_component.additional_height = self.wider_padding.y
+        self.tag_search_worker = TagSearchWorker()
+        self.tag_search_polling = False
         self.excluded_tag_data = []
         self.selected_tag_data = {}
         self.tags = []
@@ -1995,10 +2187,9 @@ class MenuConstructor:
                 unchecked_synonyms.append("_".join((name[0:s[1]]) + [s[0]] +
                                                    name[s[2]:]))
         synonyms = []  # final list of synonyms
+        replicas = SQL.FindReplicaTexts(unchecked_synonyms)
         for synonym in unchecked_synonyms:
-            if SQL.FindReplicaTags(
-                    synonym
-            ) == None:  # i.e. no matches in tag names or synonyms
+            if synonym not in replicas:  # i.e. not a tag name or synonym
                 synonyms.append(synonym)
         for s in self.synonyms:
             if s in synonyms:
@@ -2723,35 +2914,81 @@ class MenuConstructor:
         self.on_bar = 1
 
     def AttemptItemImport(self, ImportText):
+        from io import StringIO
+        self.ImportItemData(StringIO(ImportText))
+
+    def ImportItemData(self, file_):
+        # reads the items from a CVAL file one block at a time, adding each
+        # block's valid items before the next is read. nothing is committed
+        # until the whole file has been read, so a truncated or corrupted file
+        # adds no items.
         from base64 import b64encode as EncodeB64
-        from json import loads as LoadJSON
+        successful = 0
+        SQL.BeginImport()
         try:
-            imported_text = encryption.DecryptTextWithKey(
-                EncodeB64(config.settings["key"]), ImportText)
-            item_data = LoadJSON(imported_text)
-            successful = 0
-            failed = []
-            for item in item_data:
-                success = self.AttemptAddNewItem(*item[0:8], [
-                    self.items_second_bar,
-                    [ComponentID.ITEM_SECOND_BAR, ComponentID.ITEM_LIST]
-                ], False, False)
-                if success:
-                    successful += 1
-                else:
-                    failed.append(item[0])
+            item_names = set(SQL.GetItemNames())
+            tag_names = set(SQL.GetTagNames())
+            failed = 0
+            read = 0
+            for item_data in cval.ReadRecordBlocks(
+                    file_, EncodeB64(config.settings["key"]), "items"):
+                to_add, block_failed = self.ValidateImportedItems(
+                    item_data, item_names, tag_names, read)
+                for position, text, error in block_failed:
+                    debug.Log(
+                        f'Could not import item {position} (\'{text}\'): ' +
+                        error.replace("\n", " "))
+                SQL.AddItems(to_add)
+                successful += len(to_add)
+                failed += len(block_failed)
+                read += len(item_data)
+            SQL.EndImport(True)
             self.AddNotification(
                 "{} items successfully added & {} failed".format(
-                    successful, len(failed)),
+                    successful, failed),
                 display_time=8)
             debug.Log(
-                f'Successfully imported {successful} items and failed to import {len(failed)} items.'
+                f'Successfully imported {successful} items and failed to import {failed} items.'
             )
             if successful > 0:
                 pass  # TODO ADD self.RefreshItems() when added
         except:
-            self.AddNotification("Failed to import items")
-            debug.Log("Failed to import items.")
+            SQL.EndImport(False)
+            self.AddNotification("Failed to import items, so none were added")
+            debug.Log(f'Failed to import items, so the {successful} valid '
+                      'items read before the failure were not added.')
+
+    def ValidateImportedItems(self, item_data, item_names, tag_names,
+                              start=0):
+        # checks imported items against sets of the existing item and tag
+        # names, which only need to be fetched (and decrypted) once for the
+        # whole import. the texts of valid items are added to item_names so
+        # that later items cannot reuse them. returns the valid records and
+        # a list of (position, text, error) for each record that could not be
+        # imported, where positions are counted from start.
+        used_texts = set()  # item texts of the items being imported
+        to_add = []
+        failed = []
+        for position, item in enumerate(item_data, start):
+            try:
+                text, rating = item[0], item[6]
+                # older exports give items without tags a tag list of [None].
+                tags = [tag for tag in item[7] or [] if tag != None]
+                if text in used_texts:
+                    error = "The item text is used by another imported item."
+                else:
+                    error = self.GetItemInfoError(text, rating, tags,
+                                                  item_names, tag_names)
+            except (IndexError, KeyError, TypeError, ValueError):
+                text = None
+                error = "The item record is not in the correct format."
+            if error != None:
+                failed.append((position, text, error))
+                continue
+            used_texts.add(text)
+            to_add.append(tuple(item[0:7]) + (tags, ))
+        item_names.update(used_texts)
+        return to_add, failed
 
     def ImportItemsFromClipboard(self):
         from pyperclip import paste as PasteFromClipboard
@@ -2766,25 +3003,30 @@ class MenuConstructor:
                 from tkinter.filedialog import askopenfilename as AskOpenFileName
                 filename = AskOpenFileName(
                     title="Select a file to import item data from",
-                    filetypes=(("CVAL files", "*.CVAL"), ("Text files",
-                                                          "*.txt")))
+                    filetypes=(("CVAL files", "*.CVAL *.CVALZ *.CVALX"),
+                               ("Text files", "*.txt")))
             if filename != '':
                 debug.Log(f'Attempted to import items from a file.')
-                with open(filename, "r") as f:
-                    data = f.read()
-                    f.close()
-                self.AttemptItemImport(data.strip())
+                with open(filename, "rb") as f:
+                    self.ImportItemData(f)
         except FileNotFoundError:
             self.AddNotification("The specified file could not be found")
         except:
             self.AddNotification("An error occurred accessing the file")
 
-    def GetItemExport(self):
+    def WriteItemExport(self, file_, progress=None, compression=None):
         from base64 import b64encode as EncodeB64
-        from json import dumps as DumpJSON
-        item_data = DumpJSON(SQL.GetAllItemData())
-        return encryption.EncryptTextWithKey(EncodeB64(config.settings["key"]),
-                                             item_data)
+        item_data = (item for batch in SQL.GetItemDataBatches()
+                     for item in batch)
+        cval.WriteRecords(file_, EncodeB64(config.settings["key"]), "items",
+                          item_data, SQL.GetItemIDRange()[0], progress,
+                          compression)
+
+    def GetItemExport(self):
+        from io import StringIO
+        export = StringIO()
+        self.WriteItemExport(export)
+        return export.getvalue()
 
     def ExportItemsToClipboard(self):
         from pyperclip import copy as CopyToClipboard
@@ -2797,22 +3039,156 @@ class MenuConstructor:
                 if not self.file_dialog_used:
                     self.SetupDefaultFileDialog()
                     self.file_dialog_used = True
-                from tkinter.filedialog import asksaveasfile as AskSaveAsFile
-                file_ = AskSaveAsFile(
+                from tkinter.filedialog import asksaveasfilename as AskSaveAsFileName
+                filename = AskSaveAsFileName(
                     title="Create a file to save item data to",
-                    filetypes=(("CVAL files", "*.CVAL"), ("Text files",
-                                                          "*.txt")),
+                    filetypes=(("CVAL files", "*.CVAL"),
+                               ("Compressed CVAL files", "*.CVALZ"),
+                               ("Smallest CVAL files", "*.CVALX"),
+                               ("Text files", "*.txt")),
                     defaultextension="CVAL")
-            else:
-                file_ = open(filename, 'w+')
-            if file_ != None:
-                debug.Log(f'Exported item information to the a file.')
-                file_.write(self.GetItemExport())
-                file_.close()
+            if filename != '':
+                compression = cval.GetFileCompression(filename)
+                with open(filename, 'w' if compression == None else 'wb') as f:
+                    debug.Log(f'Exported item information to the a file.')
+                    self.WriteItemExport(f, compression=compression)
                 self.AddNotification("Item data successfully exported to file")
         except:
             self.AddNotification("An error occurred accessing the file")
 
+    def WriteItemChanges(self, file_, since=None, compression=None):
+        # writes the items changed or deleted since the given time, or since
+        # the last delta export if it is None, along with the tags that the
+        # changed items use. only exports made since the last one move the
+        # export marker on. returns the number of records written.
+        from base64 import b64encode as EncodeB64
+        export_time = CurrentTime()
+        update_marker = since == None
+        if since == None:
+            since = SQL.GetExportMarker("items")
+            if since == None:
+                since = 0
+
+        def GetChanges():
+            for tag in SQL.GetChangedItemTagData(since):
+                yield ["tag"] + tag
+            for deletion in SQL.GetDeletedItems(since):
+                yield ["deleted"] + deletion
+            for batch in SQL.GetItemDataBatches(changed_since=since):
+                for item in batch:
+                    yield ["item"] + item
+
+        written = cval.WriteRecords(file_,
+                                    EncodeB64(config.settings["key"]),
+                                    "item changes",
+                                    GetChanges(),
+                                    compression=compression)
+        if update_marker:
+            SQL.SetExportMarker("items", export_time)
+        return written
+
+    def ExportItemChangesToFile(self, filename=None, since=None):
+        try:
+            if filename == None:
+                if not self.file_dialog_used:
+                    self.SetupDefaultFileDialog()
+                    self.file_dialog_used = True
+                from tkinter.filedialog import asksaveasfilename as AskSaveAsFileName
+                filename = AskSaveAsFileName(
+                    title="Create a file to save item changes to",
+                    filetypes=(("CVAL files", "*.CVAL"),
+                               ("Compressed CVAL files", "*.CVALZ"),
+                               ("Smallest CVAL files", "*.CVALX"),
+                               ("Text files", "*.txt")),
+                    defaultextension="CVAL")
+            if filename != '':
+                compression = cval.GetFileCompression(filename)
+                with open(filename, 'w' if compression == None else 'wb') as f:
+                    written = self.WriteItemChanges(f, since, compression)
+                debug.Log(f'Exported {written} item changes to a file.')
+                self.AddNotification(
+                    f'{written} item changes successfully exported to file')
+        except:
+            self.AddNotification("An error occurred accessing the file")
+
+    def ImportItemChanges(self, file_):
+        # applies the changes from a delta export one block at a time. tags
+        # that are used by the changed items but do not exist yet are added
+        # first, and every change is only applied if it is newer than the
+        # local data, so the same file can be imported more than once.
+        # nothing is committed until the whole file has been read.
+        from base64 import b64encode as EncodeB64
+        changed = 0
+        deleted = 0
+        failed = 0
+        SQL.BeginImport()
+        try:
+            tag_names = set(SQL.GetTagNames())
+            item_names = set()  # texts of the changed items already read
+            read = 0
+            for block in cval.ReadRecordBlocks(
+                    file_, EncodeB64(config.settings["key"]), "item changes"):
+                new_tags = []
+                deletions = []
+                items = []
+                for record in block:
+                    if record[0] == "tag":
+                        name, desc, synonyms = record[1:4]
+                        if name not in tag_names and SQL.FindReplicaTags(
+                                name, synonyms) == None:
+                            new_tags.append((name, desc, synonyms))
+                            tag_names.add(name)
+                    elif record[0] == "deleted":
+                        deletions.append(record[1:3])
+                    elif record[0] == "item":
+                        items.append(record[1:])
+                SQL.AddTags(new_tags)
+                deleted += SQL.ApplyDeletedItems(deletions)
+                to_update, block_failed = self.ValidateImportedItems(
+                    items, item_names, tag_names, read)
+                for position, text, error in block_failed:
+                    debug.Log(
+                        f'Could not apply item change {position} (\'{text}\'): '
+                        + error.replace("\n", " "))
+                changed += SQL.UpsertItems(to_update)
+                failed += len(block_failed)
+                read += len(items)
+            SQL.EndImport(True)
+            self.AddNotification(
+                "{} items added or changed, {} removed & {} failed".format(
+                    changed, deleted, failed),
+                display_time=8)
+            debug.Log(
+                f'Applied {changed} item changes and {deleted} item deletions, and failed to apply {failed} item changes.'
+            )
+        except:
+            SQL.EndImport(False)
+            self.AddNotification(
+                "Failed to import item changes, so none were applied")
+            debug.Log(f'Failed to import item changes, so the {changed} '
+                      f'changes and {deleted} deletions read before the '
+                      'failure were not applied.')
+
+    def ImportItemChangesFromFile(self, filename=None):
+        try:
+            if filename == None:
+                if not self.file_dialog_used:
+                    self.SetupDefaultFileDialog()
+                    self.file_dialog_used = True
+                from tkinter.filedialog import askopenfilename as AskOpenFileName
+                filename = AskOpenFileName(
+                    title="Select a file to import item changes from",
+                    filetypes=(("CVAL files", "*.CVAL *.CVALZ *.CVALX"),
+                               ("Text files", "*.txt")))
+            if filename != '':
+                debug.Log(f'Attempted to import item changes from a file.')
+                with open(filename, "rb") as f:
+                    self.ImportItemChanges(f)
+        except FileNotFoundError:
+            self.AddNotification("The specified file could not be found")
+        except:
+            self.AddNotification("An error occurred accessing the file")
+
     def ResetItemsMenu(self):
         self.item_tag_search_entry.Reset()
         self.item_desc_search_entry.Reset()
@@ -3517,15 +3893,17 @@ class MenuConstructor:
                                  display_time=8)
             return
         debug.Log("Data in clipboard was valid for item tag imports.")
-        tag_names = SQL.GetTagNames()
+        tag_names = set(SQL.GetTagNames())
         permanent_ignored = SQL.GetIgnoredTags()
+        replicas = SQL.FindReplicaTagsMany(
+            [tag for tag in self.item_added_tags if tag not in tag_names])
         known_tags = []
         unknown_tags = []
         for tag in self.item_added_tags:
             if tag in self.import_ignore_list:
                 continue
             if tag not in tag_names:
-                matches = SQL.FindReplicaTags(tag)
+                matches = replicas[tag]
                 if matches == None:
                     if tag not in unknown_tags:
                         if tag in permanent_ignored:
@@ -3549,42 +3927,33 @@ class MenuConstructor:
                 self.UpdateImportedItemTags(known_tags)
             self.HandleUnknownItemTags(unknown_tags)
 
-    def CheckItemInfo(self, text, rating, tags, error_args, do_notifications):
+    def GetItemInfoError(self, text, rating, tags, item_names, tag_names):
+        # item_names and tag_names are sets of the existing names, so that
+        # they can be fetched once when checking many items.
         if text == '':
-            if do_notifications:
-                self.DisplayError("You must enter the item's text.",
-                                  *error_args)
-            return False
+            return "You must enter the item's text."
         elif " " in text:
-            if do_notifications:
-                self.DisplayError("The item text cannot contain any spaces.",
-                                  *error_args)
-            return False
+            return "The item text cannot contain any spaces."
         elif int(rating) != rating:
-            if do_notifications:
-                self.DisplayError("The item rating must be a whole number.",
-                                  *error_args)
-            return False
+            return "The item rating must be a whole number."
         elif rating < 0 or rating > 10:
+            return "The item rating must be between 0 and 10."
+        elif text in item_names:
+            return "An item with that item text already exists."
+        for tag in tags:
+            if tag not in tag_names:
+                to_format = tag if len(tag) < 75 else (tag[:75] + '...')
+                return f'The tag \'{to_format}\'\ndoes not exist.'
+        return None
+
+    def CheckItemInfo(self, text, rating, tags, error_args, do_notifications):
+        error = self.GetItemInfoError(text, rating, tags,
+                                      set(SQL.GetItemNames()),
+                                      set(SQL.GetTagNames()))
+        if error != None:
             if do_notifications:
-                self.DisplayError("The item rating must be between 0 and 10.",
-                                  *error_args)
-            return False
-        all_items = SQL.GetItemNames()
-        if text in all_items:
-            if do_notifications:
-                self.DisplayError(
-                    "An item with that item text already exists.", *error_args)
+                self.DisplayError(error, *error_args)
             return False
-        current_tags = SQL.GetTagNames()
-        for tag in tags:
-            if tag not in current_tags:
-                if do_notifications:
-                    to_format = tag if len(tag) < 75 else (tag[:75] + '...')
-                    self.DisplayError(
-                        f'The tag \'{to_format}\'\ndoes not exist.',
-                        *error_args)
-                return False
         return True
 
     def AttemptAddNewItem(self,
@@ -4530,26 +4899,29 @@ class MenuConstructor:
         if selected_word[0] in Operators.pre_operators:
             selected_word = selected_word[1:]
         suggestions = []
+        if cursor_index >= len(selected_word) and not any(
+                char in selected_word for char in "*?["):
+            # tags starting with the word are suggested first, most popular
+            # first.
+            suggestions = self.tag_prefix_index.GetMatches(
+                selected_word, max_suggestions, SQL.GetTagPopularity,
+                SQL.GetTagPopularityVersion())
+            if len(suggestions) == max_suggestions:
+                return suggestions
         formatted = selected_word[:cursor_index] + "*" + selected_word[
             cursor_index:]
         if not formatted[0] == "*":
             formatted = "*" + formatted
         if not formatted[-1] == "*":
             formatted += "*"
-        num = 0
-        for tag_info in self.tag_cache:
-            if tag_info[0] == selected_word:
-                suggestions.append(tag_info[0])
-                num += 1
-                if num == max_suggestions:
-                    break
-                continue
-            names = [tag_info[0]] + tag_info[2]  # name + synonyms
-            filtered = WildcardMatch(names, formatted)
-            if len(filtered) > 0:
-                suggestions.append(tag_info[0])
-                num += 1
-                if num == max_suggestions:
+        # the tag catalog's trigram index narrows down the tags to check.
+        limit = None
+        if max_suggestions != None:
+            limit = max_suggestions + len(suggestions)
+        for name in SQL.GetTagNamesMatchingPattern(formatted, limit, True):
+            if name not in suggestions:
+                suggestions.append(name)
+                if len(suggestions) == max_suggestions:
                     break
         return suggestions
 
@@ -4613,34 +4985,43 @@ class MenuConstructor:
             self.AddNotification("The entered minimum score is invalid")
             return None
 
-    def LoadSearchOutput(self, output):
+    def LoadSearchOutput(self, output, limit=None, total=None):
+        # output is a generator of lists of matching item IDs. Text output is
+        # shown from the first list, and each later list is appended on a
+        # later frame so that the program does not freeze on large results.
+        # if a limit is given, text output stops after that many items, and
+        # total is the number of items the search matched in all.
         # TODO temp change when functionality implemented
-        if len(output) == 0:
+        first_chunk = next(output, None)
+        if first_chunk == None:
             self.AddNotification("No matching items were found")
             return
         text = ""
+        self.search_output_stream = None
         if self.format_text_button.pressed:
             self.search_output_label.scroll_speed = config.settings[
                 "scroll_speed"] * 25
-            if self.type_weighted_button.pressed:
-                temp_out = output.keys()
-                output = sorted(list(temp_out),
-                                key=lambda k: output[k],
-                                reverse=True)
-            for match in output:
-                text += f'{SQL.GetItemTextFromID(match)}\n'
+            self.search_output_label.text = ""
+            self.search_output_count = 0
+            self.search_output_limit = limit
+            self.search_output_total = total
+            self.search_output_stream = output
+            self.AppendSearchOutput(output, first_chunk)
         elif self.format_report_button.pressed:
             self.search_output_label.scroll_speed = config.settings[
                 "scroll_speed"] * 25
-            pass
+            self.search_output_label.text = text
+            self.search_count_label.text = ""
         elif self.format_html_button.pressed:
             self.search_output_label.scroll_speed = config.settings[
                 "scroll_speed"] * 60
-            items = [SQL.GetItemTextFromID(i) for i in output]
+            matches = first_chunk + [i for chunk in output for i in chunk]
+            items = SQL.GetItemTextsFromIDs(matches)
             text += FormatResultsToHTML(items)
+            self.search_output_label.text = text
+            self.search_count_label.text = f'{len(matches)} results'
         else:
             return
-        self.search_output_label.text = text
         self.search_component.AddCommands({
             "TYPE":
             "TRANSITION",
@@ -4659,6 +5040,37 @@ class MenuConstructor:
             }]
         })
 
+    def AppendSearchOutput(self, output, chunk=None):
+        if output is not self.search_output_stream:
+            return  # a newer search has replaced these results
+        if chunk == None:
+            chunk = next(output, None)
+        if chunk != None and self.search_output_limit != None:
+            chunk = chunk[:self.search_output_limit - self.search_output_count]
+        if chunk == None or len(chunk) == 0:
+            self.search_output_stream = None
+            total = self.search_output_total
+            if total != None and total > self.search_output_count:
+                self.search_count_label.text = (
+                    f'showing {self.search_output_count} of {total} results')
+            else:
+                self.search_count_label.text = (
+                    f'{self.search_output_count} results')
+            return
+        text = ""
+        for match in SQL.GetItemTextsFromIDs(chunk):
+            text += f'{match}\n'
+        self.search_output_label.AppendText(text)
+        self.search_output_count += len(chunk)
+        self.search_count_label.text = (f'{self.search_output_count} results '
+                                        'found so far...')
+        self.search_result_component.AddCommand({
+            "TYPE": "EXECUTE",
+            "FUNCTION": self.AppendSearchOutput,
+            "ARGUMENTS": [output],
+            "KWARGUMENTS": {}
+        })
+
     def MakeSearch(self, search_text):
         if len(search_text) == 0 or len(search_text.replace(" ", "")) == 0:
             return
@@ -4668,7 +5080,7 @@ class MenuConstructor:
                 self.search_bar.is_focused = False
                 self.search_bar.Unfocus()
             if self.type_strict_button.pressed:
-                matches = StrictSearch(search_text)
+                matches = StrictSearchChunks(search_text)
                 if isinstance(matches, tuple) and matches[0] == "INVALID":
                     if matches[1] == "TAGS":
                         self.AddNotification(
@@ -4678,11 +5090,19 @@ class MenuConstructor:
                             "Innapropriate query for a strict search.")
                     return
                 self.LoadSearchOutput(matches)
+                RecordSearchedTags(search_text)
             elif self.type_weighted_button.pressed:
                 min_score = self.GetMinimumWeightedScore()
                 if min_score == None:
                     return
-                matches = WeightedSearch(search_text, minimum_score=min_score)
+                limit = None
+                total = None
+                if self.format_text_button.pressed:
+                    # only as many results as the text output will display
+                    limit = config.settings["search_result_display_limit"]
+                matches = WeightedSearchChunks(search_text,
+                                               minimum_score=min_score,
+                                               limit=limit)
                 if isinstance(matches, tuple) and matches[0] == "INVALID":
                     if matches[1] == "TAGS":
                         self.AddNotification(
@@ -4691,9 +5111,12 @@ class MenuConstructor:
                         self.AddNotification(
                             "Innapropriate query for a weighted search.")
                     return
-                self.LoadSearchOutput(matches)
+                if limit != None:
+                    total = CountWeightedMatches(search_text, min_score)
+                self.LoadSearchOutput(matches, limit, total)
+                RecordSearchedTags(search_text, weighted=True)
             elif self.type_extreme_button.pressed:
-                matches = ExtremeSearch(search_text)
+                matches = ExtremeSearchChunks(search_text)
                 if isinstance(matches, tuple) and matches[0] == "INVALID":
                     if matches[1] == "TAGS":
                         self.AddNotification(
@@ -4703,6 +5126,7 @@ class MenuConstructor:
                             "Innapropriate query for an extreme search.")
                     return
                 self.LoadSearchOutput(matches)
+                RecordSearchedTags(search_text)
         except:
             self.AddNotification("Invalid search query")
 
@@ -4724,7 +5148,10 @@ class MenuConstructor:
                              **kwargs)
 
     def ResetSearchesMenu(self):
-        self.tag_cache = SQL.GetAllTagData()
+        # the suggestion index is only rebuilt if the tags have changed.
+        if self.tag_prefix_index.version != SQL.GetTagCatalogVersion():
+            self.tag_prefix_index.Build(SQL.GetAllTagData(return_dict=True),
+                                        SQL.GetTagCatalogVersion())
         self.search_bar.Reset()
         self.minimum_score_entry.Reset()
         self.format_text_button.pressed = True
@@ -4748,7 +5175,7 @@ class MenuConstructor:
         self.search_component = StaticComponent(Vector2D(0, 0),
                                                 config.settings["window_size"],
                                                 (0, 0, 0, 0))
-        self.tag_cache = []
+        self.tag_prefix_index = TagPrefixIndex()
         bar_size = Vector2D(config.settings["window_width"],
                             config.settings["window_height"] // 7)
         bar_background = Rectangle(bar_size, (50, 50, 50), is_active=False)
@@ -5182,6 +5609,17 @@ Please note that '-tag1[500]' means 'give 500 score for not having tag1' as oppo
         self.search_output_label.position = ScalePosition(
             Vector2D(0, 0), self.search_result_component.size,
             Vector2D(0.5, 0.425), self.search_output_label.size)
+        self.search_output_stream = None
+        self.search_output_count = 0
+        self.search_output_limit = None
+        self.search_output_total = None
+        self.search_count_label = Label('',
+                                        self.standard_ui_font,
+                                        text_colour=(255, 255, 255))
+        self.search_count_label.position = Vector2D(
+            self.search_output_label.position.x,
+            self.search_output_label.position.y +
+            self.search_output_label.height + self.larger_padding.y // 2)
 
         button_container = Container(4,
                                      1,
@@ -5221,6 +5659,7 @@ Please note that '-tag1[500]' means 'give 500 score for not having tag1' as oppo
             Vector2D(0, 0), self.search_result_component.size,
             Vector2D(0.5, 0.9), button_container.size)
         self.search_result_component.AddUIElements(self.search_output_label,
+                                                   self.search_count_label,
                                                    button_container)
 
         window.AddComponent(self.search_result_component,
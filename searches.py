@@ -1,6 +1,10 @@
 import numpy as np
 from fuzzywuzzy import fuzz
 from data_types import Stack
+from edit_distance import GetEditDistance
+from functools import lru_cache
+import config
+import debug
 
 
 def SplitByCharacters(text, characters):
@@ -39,6 +43,46 @@ def EvaluateOR(a, b):
     return a or b
 
 
+def CompileTerm(term_ids):
+    # a term is either a single tag ID, or a list of the tag IDs that matched a
+    # wildcard (in which case an item matches if it has any of them).
+    if isinstance(term_ids, int):
+        return lambda tags: term_ids in tags
+    term_ids = frozenset(term_ids)
+    return lambda tags: not term_ids.isdisjoint(tags)
+
+
+def CompileConstant(value):
+    return lambda tags: value
+
+
+def CompileCalcWeight(a, b):
+    if callable(b):
+        return lambda tags: float(b(tags)) if a(tags) else 0
+    weight = float(b)
+    return lambda tags: weight if a(tags) else 0
+
+
+def CompileAddWeight(a, b):
+    return lambda tags: a(tags) + b(tags)
+
+
+def CompileNot(a):
+    return lambda tags: not a(tags)
+
+
+def CompileXOR(a, b):
+    return lambda tags: a(tags) != b(tags)
+
+
+def CompileAND(a, b):
+    return lambda tags: a(tags) and b(tags)
+
+
+def CompileOR(a, b):
+    return lambda tags: a(tags) or b(tags)
+
+
 class Operators:
     operators = {}
     operators["AND"] = ["AND", "and", "&", "&&"]
@@ -47,8 +91,12 @@ class Operators:
     operators["XOR"] = ["XOR", "xor", "^"]
     pre_operators = ['+', '-', '!']
     all_operators = ['(', ')', 'CALCWEIGHT', 'ADDWEIGHT']
+    types = {}  # operator text -> operator type
     for key in operators.keys():
         all_operators += operators[key]
+        for operator in operators[key]:
+            types[operator] = key
+    operator_set = frozenset(all_operators)  # for constant time lookups
     precedence = {
         "CALCWEIGHT": 1,
         "ADDWEIGHT": 2,
@@ -66,6 +114,20 @@ class Operators:
         "AND": 2,
         "OR": 2
     }
+    set_operators = {
+        "NOT": None,  # evaluated as difference against all items
+        "XOR": set.symmetric_difference,
+        "AND": set.intersection,
+        "OR": set.union
+    }
+    compile_funcs = {
+        "CALCWEIGHT": CompileCalcWeight,
+        "ADDWEIGHT": CompileAddWeight,
+        "NOT": CompileNot,
+        "XOR": CompileXOR,
+        "AND": CompileAND,
+        "OR": CompileOR
+    }
     evaluation_funcs = {
         "CALCWEIGHT": EvaluateCalcWeight,
         "ADDWEIGHT": EvaluateAddWeight,
@@ -77,126 +139,280 @@ class Operators:
 
 
 def IsOperator(text):
-    return text in Operators.all_operators
+    return text in Operators.operator_set
 
 
 def GetOperatorType(text):
-    for key in Operators.operators.keys():
-        if text in Operators.operators[key]:
-            return key
-    return None
+    return Operators.types.get(text)
 
 
 def EvaluateOperator(operator, operands):
     return Operators.evaluation_funcs[operator](*operands)
 
 
-def ReducePreOperators(word):
-    # returns formatted expression, actual word
-    char_1 = word[0]
-    if char_1 in Operators.pre_operators:
-        word = word[1:]
-        if char_1 == '+':  # (+ means inclusive)
-            formatted = word
+def TokeniseSearchText(text):
+    # splits search text into (kind, value) tokens in a single pass. kinds are
+    # "TAG", "OPERATOR" (valued with the operator's type), "PRE" (a pre-operator
+    # directly before a tag or bracket), "WEIGHT", "(" and ")".
+    tokens = []
+    i = 0
+    length = len(text)
+    while i < length:
+        char = text[i]
+        if char.isspace():
+            i += 1
+        elif char in "()":
+            tokens.append((char, char))
+            i += 1
+        elif char == "[":
+            end = text.find("]", i)
+            if end == -1:
+                raise Exception("Unclosed weight in search query.")
+            weight = text[i + 1:end].strip()
+            float(weight)  # raises a ValueError if the weight is not a number
+            tokens.append(("WEIGHT", weight))
+            i = end + 1
+        elif char == "]":
+            raise Exception("Unopened weight in search query.")
         else:
-            formatted = GetOperatorType(char_1) + ' ' + word
-    else:
-        formatted = word
-    return formatted, word
+            start = i
+            while i < length and not text[i].isspace() and text[i] not in "()[]":
+                i += 1
+            word = text[start:i]
+            if word in Operators.types:
+                tokens.append(("OPERATOR", Operators.types[word]))
+            elif word[0] in Operators.pre_operators:
+                tokens.append(("PRE", word[0]))
+                if len(word) > 1:
+                    tokens.append(("TAG", word[1:].lower()))
+            else:
+                tokens.append(("TAG", word.lower()))
+    return tokens
 
 
-def ConvertSearchText(text):
-    # returns formatted search text, list of required tags
-    tag_names = []
-    split_text = text.split(" ")
-    output = ""
-    last_index = len(split_text) - 1
-    for i, word in enumerate(split_text):
-        start_brackets = 0
-        end_brackets = 0
-        for char in word:
-            if char == '(':
-                start_brackets += 1
-            else:
-                break
-        for char in word[::-1]:
-            if char == ')':
-                end_brackets += 1
-            else:
+class QueryNode:
+    """ A class used to represent a node in the syntax tree of a parsed search
+        query. Trees are not changed once parsed, so they can be cached and
+        shared between searches."""
+    def __init__(self, type, children=None, value=None):
+        """ The constructor for the QueryNode class.
+              Inputs: type (a string: "TAG", "NOT", "AND", "OR", "XOR",
+            "CALCWEIGHT" or "ADDWEIGHT"), children (a list of the QueryNodes
+            that are the operands of this node; AND, OR, XOR and ADDWEIGHT nodes
+            can have any number of operands, which are applied left to right)
+            and value (a string: the tag name of a TAG node, or the weight of a
+            CALCWEIGHT node).
+              Outputs: None."""
+        self.type = type
+        self.children = children if children != None else []
+        self.value = value
+        self.brackets = 0  # the number of brackets directly around this node
+        self.weight = None  # the text of any [weight] directly after this node
+
+
+class QueryParser:
+    """ A class used to parse a list of search tokens into a syntax tree by
+        recursive descent. NOT binds the tightest, followed by XOR, then AND
+        (including the implicit AND between adjacent terms), then OR."""
+    binary_levels = ["OR", "AND", "XOR"]
+
+    def __init__(self, tokens):
+        """ The constructor for the QueryParser class.
+              Inputs: tokens (a list of tokens from TokeniseSearchText).
+              Outputs: None."""
+        self.tokens = tokens
+        self.position = 0
+        self.tags = []
+        self.weighted_nodes = []
+
+    def Peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def Next(self):
+        token = self.Peek()
+        self.position += 1
+        return token
+
+    def StartsTerm(self):
+        kind, value = self.Peek()
+        return kind in ("TAG", "PRE", "(") or (kind == "OPERATOR"
+                                               and value == "NOT")
+
+    def Parse(self):
+        """ Parses all of the tokens, returning the root QueryNode of the
+            tree. Raises an exception if the tokens are not a well formed
+            query. """
+        if len(self.tokens) == 0:
+            raise Exception("Empty search query.")
+        tree = self.ParseBinary(0)
+        if self.position != len(self.tokens):
+            raise Exception("Unexpected '" + str(self.Peek()[1]) +
+                            "' in search query.")
+        return tree
+
+    def ParseBinary(self, level):
+        if level == len(self.binary_levels):
+            return self.ParseUnary()
+        operator = self.binary_levels[level]
+        operands = [self.ParseBinary(level + 1)]
+        while True:
+            kind, value = self.Peek()
+            if kind == "OPERATOR" and value == operator:
+                self.position += 1
+            elif not (operator == "AND" and self.StartsTerm()):
                 break
-        checked_word = word.replace('(', '')
-        checked_word = checked_word.replace(')', '')
-        if IsOperator(checked_word):
-            output += start_brackets * '(' + GetOperatorType(
-                checked_word) + end_brackets * ')' + ' '
-        elif i < last_index:
-            next_word = split_text[i + 1]
-            if IsOperator(next_word):
-                new_text, word = ReducePreOperators(
-                    word.lower()[start_brackets:len(word) - end_brackets])
-                output += start_brackets * '(' + new_text + end_brackets * ')' + ' '
-                if word not in tag_names:
-                    tag_names.append(word)
-            else:
-                new_text, word = ReducePreOperators(
-                    word.lower()[start_brackets:len(word) - end_brackets])
-                output += start_brackets * '(' + new_text + end_brackets * ')' + ' AND '
-                if word not in tag_names:
-                    tag_names.append(word)
-        else:
-            new_text, word = ReducePreOperators(
-                word.lower()[start_brackets:len(word) - end_brackets])
-            output += start_brackets * '(' + new_text + end_brackets * ')'
-            if word not in tag_names:
-                tag_names.append(word)
-    return SplitText(output), tag_names
-
-
-def SplitText(text):
-    output = []
-    word = ''
-    max_index = len(text) - 1
-    for i in range(len(text) + 1):
-        if i > max_index:  # we let it iterate 1 more time to finish off
-            if len(word) == 0:
-                continue
+            operands.append(self.ParseBinary(level + 1))
+        if len(operands) == 1:
+            return operands[0]
+        return QueryNode(operator, operands)
+
+    def ParseUnary(self):
+        kind, value = self.Peek()
+        if kind == "PRE" and value == '+':  # (+ means inclusive)
+            self.position += 1
+            return self.ParseUnary()
+        if kind == "PRE" or (kind == "OPERATOR" and value == "NOT"):
+            self.position += 1
+            return QueryNode("NOT", [self.ParseUnary()])
+        return self.ParsePrimary()
+
+    def ParsePrimary(self):
+        kind, value = self.Next()
+        if kind == "TAG":
+            node = QueryNode("TAG", value=value)
+            self.tags.append(value)
+        elif kind == "(":
+            node = self.ParseBinary(0)
+            if self.Next()[0] != ")":
+                raise Exception("Unbalanced brackets in search query.")
+            node.brackets += 1
         else:
-            char = text[i]
-            if char != ' ':
-                word += char
-                if char not in ['(', ')'] and (i >= max_index or text[i + 1]
-                                               not in ['(', ')']):
-                    continue
-            elif len(word) == 0:
-                continue
-        output.append(word)
-        word = ''
-    return output
+            raise Exception("Unexpected '" + str(value) + "' in search query.")
+        if self.Peek()[0] == "WEIGHT":
+            node.weight = self.Next()[1]
+            self.weighted_nodes.append(node)
+        return node
 
 
-def InfixToPostfix(text):
-    stack = Stack()
-    output = []
-    for word in text:
-        if not IsOperator(word):
-            output.append(word)
-        elif word == '(':
-            stack.push(word)
-        elif word == ')':
-            while (not stack.is_empty) and (stack.peek() != '('):
-                output.append(stack.pop())
-            if (not stack.is_empty) and (stack.peek() != '('):
-                return False
-            else:
-                stack.pop()  # removes open bracket
+def WalkQueryTree(node):
+    # yields every node in a tree with its bracket depth, parents first.
+    stack = [(node, node.brackets)]
+    while stack:
+        node, depth = stack.pop()
+        yield node, depth
+        for child in reversed(node.children):
+            stack.append((child, depth + child.brackets))
+
+
+def GetInfixTokens(node):
+    # returns the operators and tag names of a tree in their original order,
+    # without brackets.
+    if node.type == "TAG":
+        return [node.value]
+    if node.type == "NOT":
+        return ["NOT"] + GetInfixTokens(node.children[0])
+    tokens = GetInfixTokens(node.children[0])
+    for child in node.children[1:]:
+        tokens.append(node.type)
+        tokens += GetInfixTokens(child)
+    return tokens
+
+
+def AddPostfixTokens(node, output):
+    if node.type == "TAG":
+        output.append(node.value)
+    elif node.type == "CALCWEIGHT":
+        AddPostfixTokens(node.children[0], output)
+        output.append(node.value)
+        output.append("CALCWEIGHT")
+    elif node.type == "NOT":
+        AddPostfixTokens(node.children[0], output)
+        output.append("NOT")
+    else:
+        AddPostfixTokens(node.children[0], output)
+        for child in node.children[1:]:
+            AddPostfixTokens(child, output)
+            output.append(node.type)
+
+
+def GetTopLevelTerms(tree):
+    # returns the operands of the top level AND (or ADDWEIGHT) of a tree.
+    if tree.type in ("AND", "ADDWEIGHT") and tree.brackets == 0:
+        return tree.children
+    return [tree]
+
+
+def MakeWeightedTree(tree):
+    # converts a parsed tree into a sum of weighted terms, returning the new
+    # tree, the total weight shift, and how many weights were used. '-tag[w]'
+    # gives w points for not having tag, so is scored as -w if the tag is
+    # present and shifted by +w.
+    terms = []
+    total_shift = 0
+    used_weights = 0
+    for term in GetTopLevelTerms(tree):
+        negated = term.type == "NOT" and term.brackets == 0
+        condition = term.children[0] if negated else term
+        weight = condition.weight
+        if weight == None:
+            weight = '1'
         else:
-            while (not stack.is_empty) and (Operators.precedence[stack.peek()]
-                                            <= Operators.precedence[word]):
-                output.append(stack.pop())
-            stack.push(word)
-    while not stack.is_empty:
-        output.append(stack.pop())
-    return output
+            used_weights += 1
+        if negated:
+            total_shift += float(weight)
+            weight = str(-float(weight))
+        terms.append(QueryNode("CALCWEIGHT", [condition], weight))
+    return QueryNode("ADDWEIGHT", terms), total_shift, used_weights
+
+
+class ParsedQuery:
+    """ A class used to store a parsed search query: its syntax tree, the tag
+        names it uses and its postfix form. Instances are cached and shared by
+        ParseSearchText, so should not be modified."""
+    def __init__(self, tree, tag_names, weighted=False, total_shift=0,
+                 misplaced_weights=False):
+        """ The constructor for the ParsedQuery class.
+              Inputs: tree (the root QueryNode of the query), tag_names (a list
+            of the tag names in the query, in order of first appearance),
+            weighted (a Boolean detailing whether the query is weighted),
+            total_shift (a number detailing the value to shift weighted scores
+            by) and misplaced_weights (a Boolean detailing whether a weight was
+            used anywhere other than after a top level term).
+              Outputs: None."""
+        self.tree = tree
+        self.tag_names = tuple(tag_names)
+        self.weighted = weighted
+        self.total_shift = total_shift
+        self.misplaced_weights = misplaced_weights
+        postfix = []
+        AddPostfixTokens(tree, postfix)
+        self.postfix = tuple(postfix)
+
+
+@lru_cache(maxsize=256)
+def ParseSearchText(text, weighted=False):
+    parser = QueryParser(TokeniseSearchText(text))
+    tree = parser.Parse()
+    tag_names = list(dict.fromkeys(parser.tags))  # removes duplicates
+    if not weighted:
+        if len(parser.weighted_nodes) != 0:
+            raise Exception("Weights can only be used in weighted searches.")
+        return ParsedQuery(tree, tag_names)
+    tree, total_shift, used_weights = MakeWeightedTree(tree)
+    return ParsedQuery(tree, tag_names, True, total_shift,
+                       used_weights != len(parser.weighted_nodes))
+
+
+def ConvertSearchText(text):
+    # returns parsed query, list of required tags
+    query = ParseSearchText(text)
+    return query, list(query.tag_names)
+
+
+def InfixToPostfix(query):
+    return list(query.postfix)
 
 
 def InsertValuesIntoQuery(query, values):
@@ -230,346 +446,700 @@ def EvaluatePostfix(postfix):
     return stack.pop()
 
 
-def ExtremeSearch(search_text):
-    from SQL import GetTagIDsFromNames, GetAllItemTags
+def CompileQuery(postfix, tag_ids, compile_term=CompileTerm):
+    # compiles a postfix query into a single function that takes the set of an
+    # item's tag IDs and returns what EvaluatePostfix would for that item (a
+    # Boolean, or a score for weighted queries), so no list copying, operator
+    # lookups or stack operations are needed per item. compile_term can be
+    # replaced to compile functions that take something other than tag sets.
+    stack = Stack()
+    for word in postfix:
+        if not IsOperator(word):
+            if word in tag_ids:
+                stack.push(compile_term(tag_ids[word]))
+            else:
+                stack.push(word)  # a constant, e.g. a weight for CALCWEIGHT
+            continue
+        arity = Operators.arity[word]
+        if len(stack) < arity:
+            raise Exception("Invalid postfix expression input.")
+        operands = []
+        for i in range(arity):
+            operands.append(stack.pop())
+        operands = operands[::-1]
+        for i, operand in enumerate(operands):
+            # CALCWEIGHT weights are left as constants so they are only
+            # converted to numbers once, at compile time.
+            if not callable(operand) and not (word == "CALCWEIGHT"
+                                              and i == 1):
+                operands[i] = CompileConstant(operand)
+        stack.push(Operators.compile_funcs[word](*operands))
+    compiled = stack.pop()
+    return compiled if callable(compiled) else CompileConstant(compiled)
+
+
+def GetTermItems(term_ids, index):
+    # a term is either a single tag ID, or a list of the tag IDs that matched a
+    # wildcard (in which case an item matches if it has any of them).
+    if isinstance(term_ids, int):
+        return index.GetItems(term_ids)
+    items = set()
+    for tag_id in term_ids:
+        items |= index.GetItems(tag_id)
+    return items
+
+
+def EvaluatePostfixOnIndex(postfix, tag_ids, index):
+    # evaluates a boolean postfix query once over whole posting lists instead
+    # of once per item: AND is intersection, OR is union, XOR is symmetric
+    # difference and NOT is difference against the set of all items.
+    stack = Stack()
+    for word in postfix:
+        if not IsOperator(word):
+            stack.push(GetTermItems(tag_ids[word], index))
+            continue
+        arity = Operators.arity[word]
+        if len(stack) < arity or word not in Operators.set_operators:
+            raise Exception("Invalid postfix expression input.")
+        if word == "NOT":
+            stack.push(index.items - stack.pop())
+        else:
+            b = stack.pop()
+            a = stack.pop()
+            stack.push(Operators.set_operators[word](a, b))
+    if len(stack) != 1:
+        raise Exception("Invalid postfix expression input.")
+    return sorted(stack.pop())
+
+
+def GetTermCount(term_ids, index):
+    if isinstance(term_ids, int):
+        return index.GetCount(term_ids)
+    return min(len(index.items), sum(index.GetCount(i) for i in term_ids))
+
+
+def CompileProbeTerm(term_ids, index):
+    # like CompileTerm, but the compiled function takes a single item ID and
+    # looks it up in the index's posting lists.
+    if isinstance(term_ids, int):
+        items = index.GetItems(term_ids)
+        return lambda item: item in items
+    postings = [index.GetItems(i) for i in term_ids]
+    return lambda item: any(item in items for items in postings)
+
+
+class PlanNode:
+    """ A class used to represent a step in the plan for evaluating a Boolean
+        search over the ItemTagIndex. Each step bounds how many items it can
+        match using per-tag item counts, so that AND operands can be
+        applied rarest first, steps that cannot match anything are skipped,
+        and operands that would be expensive to build from posting lists are
+        instead checked item by item against the (smaller) candidate set."""
+    def __init__(self, node, tag_ids, index):
+        """ The constructor for the PlanNode class. Plans the given part of
+            a query and all of the parts within it.
+              Inputs: node (a QueryNode from a parsed Boolean query), tag_ids
+            (a dictionary of the tag names in the query to their tag IDs, or
+            lists of tag IDs for wildcards) and index (the ItemTagIndex).
+              Outputs: None."""
+        self.node = node
+        self.type = node.type
+        self.tag_ids = tag_ids
+        self.children = [PlanNode(c, tag_ids, index) for c in node.children]
+        self.probe = None
+        total = len(index.items)
+        if self.type == "TAG":
+            term_ids = tag_ids[node.value]
+            self.estimate = GetTermCount(term_ids, index)
+            if isinstance(term_ids, int):
+                self.cost = 0  # the posting list already exists
+                self.terms = 1
+                self.minimum = self.estimate
+            else:
+                self.cost = self.estimate
+                self.terms = len(term_ids)
+                self.minimum = max([index.GetCount(i) for i in term_ids] + [0])
+            return
+        # estimate is an upper bound on the number of matching items, and
+        # minimum a lower bound, so that a step is only skipped if it really
+        # cannot match anything.
+        self.terms = sum(c.terms for c in self.children)
+        if self.type == "NOT":
+            self.estimate = total - self.children[0].minimum
+            self.minimum = total - self.children[0].estimate
+            self.cost = self.children[0].cost + total
+            self.strategies = []
+            return
+        self.cost = sum(c.cost + c.estimate for c in self.children)
+        if self.type == "AND":
+            # intersect from the rarest operand, then remove negated operands
+            # from the largest, as that shrinks the candidates the most.
+            included = [c for c in self.children if c.type != "NOT"]
+            excluded = [c for c in self.children if c.type == "NOT"]
+            included.sort(key=lambda c: c.estimate)
+            excluded.sort(key=lambda c: c.estimate)
+            self.children = included + excluded
+            self.estimate = min(c.estimate for c in self.children)
+            self.minimum = max(
+                0,
+                sum(c.minimum for c in self.children) -
+                (len(self.children) - 1) * total)
+        else:
+            # an OR or XOR operand that matches nothing has no effect.
+            self.children = [c for c in self.children if c.estimate != 0]
+            self.estimate = min(total, sum(c.estimate for c in self.children))
+            if self.type == "OR":
+                self.minimum = max([c.minimum for c in self.children] + [0])
+            else:
+                self.minimum = 0
+        self.strategies = self.GetStrategies()
+
+    def GetStrategies(self):
+        # returns how each operand of an AND will be applied, based on the
+        # estimated number of candidate items at that point.
+        if self.type != "AND":
+            return ["UNION" if self.type == "OR" else "SYMMETRIC DIFFERENCE"
+                    ] * len(self.children)
+        strategies = []
+        candidates = None
+        for child in self.children:
+            negated = child.type == "NOT"
+            target = child.children[0] if negated else child
+            if candidates == None:
+                strategies.append("START")
+                candidates = child.estimate
+            elif candidates * target.terms < target.cost:
+                strategies.append("SCAN")
+            else:
+                strategies.append("SUBTRACT" if negated else "INTERSECT")
+            candidates = min(candidates, child.estimate)
+        return strategies
+
+    def Probe(self, index):
+        # returns a function that checks whether a single item matches this
+        # step, compiling it the first time it is needed.
+        if self.probe == None:
+            postfix = []
+            AddPostfixTokens(self.node, postfix)
+            self.probe = CompileQuery(
+                postfix, self.tag_ids,
+                lambda term_ids: CompileProbeTerm(term_ids, index))
+        return self.probe
+
+    def Evaluate(self, index):
+        """ Returns the set of IDs of the items that match this step. The
+            returned set must not be modified. """
+        if self.estimate == 0:
+            return set()
+        if self.type == "TAG":
+            return GetTermItems(self.tag_ids[self.node.value], index)
+        if self.type == "NOT":
+            return index.items - self.children[0].Evaluate(index)
+        if self.type == "AND":
+            return self.EvaluateAND(index)
+        result = set()
+        for child in self.children:
+            if self.type == "OR":
+                result |= child.Evaluate(index)
+            else:
+                result ^= child.Evaluate(index)
+        return result
+
+    def EvaluateAND(self, index):
+        result = None
+        for child in self.children:
+            if result != None and len(result) == 0:
+                break
+            negated = child.type == "NOT"
+            target = child.children[0] if negated else child
+            if result == None:
+                result = child.Evaluate(index)
+            elif len(result) * target.terms < target.cost:
+                # cheaper to check each candidate than to build the operand
+                probe = target.Probe(index)
+                result = {i for i in result if probe(i) != negated}
+            elif negated:
+                result = result - target.Evaluate(index)
+            else:
+                result = result & target.Evaluate(index)
+        return result
+
+    def Describe(self, depth=0, strategy=None):
+        """ Returns a list of lines describing this step and the steps within
+            it, for displaying why a search is fast or slow. """
+        line = "  " * depth
+        if strategy != None:
+            line += strategy + " "
+        if self.type == "TAG":
+            line += "TAG " + self.node.value
+            if self.terms != 1:
+                line += f' ({self.terms} tags)'
+        else:
+            line += self.type
+        if self.minimum == self.estimate:
+            line += f' - {self.estimate} items'
+        else:
+            line += f' - {self.minimum} to {self.estimate} items'
+        if self.estimate == 0:
+            line += ", skipped"
+        lines = [line]
+        if self.type == "TAG" or self.estimate == 0:
+            return lines
+        if self.type == "NOT":
+            return lines + self.children[0].Describe(depth + 1)
+        for child, child_strategy in zip(self.children, self.strategies):
+            lines += child.Describe(depth + 1, child_strategy)
+        return lines
+
+
+def PlanQuery(query, tag_ids, index):
+    # returns the root PlanNode for a parsed Boolean query.
+    return PlanNode(query.tree, tag_ids, index)
+
+
+class SearchCache:
+    """ A class used to store the results of recent searches, so that repeated
+        searches do not need to be evaluated again. Entries are keyed on the
+        normalised search and the database generation it was evaluated at, so
+        any write to the database makes older entries unreachable; the least
+        recently used entries are discarded once the cache is full."""
+    def __init__(self, max_size=64):
+        """ The constructor for the SearchCache class.
+              Inputs: max_size (an integer detailing the maximum number of
+            search results stored at once).
+              Outputs: None."""
+        from collections import OrderedDict
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def Get(self, key):
+        """ Returns a copy of the results stored for the given key, or None if
+            there are no stored results for that key. """
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key].copy()
+
+    def Add(self, key, results):
+        """ Stores a copy of the results of a search under the given key.
+              Inputs: key (a tuple from MakeSearchCacheKey) and results (a list
+            of matching item IDs, or a dict of item IDs to scores).
+              Outputs: None."""
+        self.entries[key] = results.copy()
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def Clear(self):
+        """ Removes all stored results and resets the hit and miss counts.
+              Inputs: None.
+              Outputs: None."""
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self):
+        """ A property that returns a dictionary of the cache's hit count, miss
+            count and current size, for diagnostics."""
+        return {
+            "HITS": self.hits,
+            "MISSES": self.misses,
+            "SIZE": len(self.entries),
+            "MAX_SIZE": self.max_size
+        }
+
+
+global search_cache
+search_cache = SearchCache()
+
+
+def MakeSearchCacheKey(search_type, query, tag_ids, *extra):
+    from SQL import GetGeneration
+    resolved = tuple(
+        sorted((tag, i if isinstance(i, int) else tuple(i))
+               for tag, i in tag_ids.items()))
+    return (search_type, tuple(query), resolved, extra, GetGeneration())
+
+
+PARALLEL_SEARCH_THRESHOLD = 100000  # smaller databases are searched serially
+
+global shard_executors
+shard_executors = []  # one single process executor per shard of item IDs
+global shard_cache
+shard_cache = {}  # (in a worker process) shard -> (generation, item tags)
+
+
+def EvaluateShard(database_name, generation, first_id, last_id, postfix,
+                  tag_ids, weighted, total_shift, minimum_score):
+    # run in a worker process: evaluates a postfix query for every item with
+    # an ID in the given range, returning a list of the matching item IDs, or
+    # a dictionary of item IDs to scores for weighted queries. Each shard is
+    # always sent to the same process, so its item tags are only read from
+    # the database again once the database has changed.
+    from SQL import ConnectDatabase, GetShardItemTags
+    global shard_cache
+    key = (database_name, first_id, last_id)
+    if key not in shard_cache or shard_cache[key][0] != generation:
+        ConnectDatabase(database_name)
+        shard_cache.clear()
+        shard_cache[key] = (generation, GetShardItemTags(first_id, last_id))
+    item_tags = shard_cache[key][1]
+    # compiled queries are closures, which cannot be sent between processes,
+    # so each worker compiles the query itself.
+    compiled = CompileQuery(postfix, tag_ids)
+    if not weighted:
+        return [i for i, tags in item_tags.items() if compiled(tags)]
+    scores = {}
+    for i, tags in item_tags.items():
+        score = compiled(tags) + total_shift
+        if minimum_score == None or score >= minimum_score:
+            scores[i] = score
+    return scores
+
+
+def GetShardExecutors(count):
+    from concurrent.futures import ProcessPoolExecutor
+    global shard_executors
+    if len(shard_executors) != count:
+        for executor in shard_executors:
+            executor.shutdown(wait=False)
+        shard_executors = [
+            ProcessPoolExecutor(max_workers=1) for i in range(count)
+        ]
+    return shard_executors
+
+
+def EvaluateInParallel(postfix,
+                       tag_ids,
+                       weighted=False,
+                       total_shift=0,
+                       minimum_score=None):
+    # splits the item IDs into one shard per worker process, evaluates the
+    # query on every shard at once and merges the results. Returns None if
+    # the search should be evaluated serially instead.
+    from SQL import GetItemIDRange, GetDatabaseName, GetGeneration
+    workers = config.settings["search_workers"]
+    item_count, first_id, last_id = GetItemIDRange()
+    if workers < 2 or item_count < PARALLEL_SEARCH_THRESHOLD:
+        return None
+    shard_size = (last_id - first_id) // workers + 1
+    futures = []
+    for i, executor in enumerate(GetShardExecutors(workers)):
+        start = first_id + i * shard_size
+        futures.append(
+            executor.submit(EvaluateShard, GetDatabaseName(), GetGeneration(),
+                            start, start + shard_size - 1, list(postfix),
+                            tag_ids, weighted, total_shift, minimum_score))
+    try:
+        results = [future.result() for future in futures]
+    except Exception as e:  # e.g. a worker process was killed
+        debug.Log(f'Parallel search failed ({e}); evaluating it serially.')
+        GetShardExecutors(0)
+        return None
+    if not weighted:
+        return [i for shard in results for i in shard]
+    matches = {}
+    for shard in results:
+        matches.update(shard)
+    return matches
+
+
+def EvaluateBooleanQuery(query, tag_ids, execution_mode=None):
+    # execution modes: "memory" evaluates the planned query over the in-memory
+    # index, "database" evaluates it inside SQLite so that the index never
+    # needs to be loaded, and "parallel" evaluates it in several processes for
+    # large databases (both falling back to "memory" if they cannot be used).
+    from SQL import GetItemIDsMatchingPostfix, GetItemTagIndex
+    if execution_mode == None:
+        execution_mode = config.settings["search_execution_mode"]
+    if execution_mode == "database":
+        matches = GetItemIDsMatchingPostfix(query.postfix, tag_ids)
+        if matches != None:
+            return matches
+        debug.Log("Search could not be run in the database; evaluating it "
+                  "in memory instead.")
+    elif execution_mode == "parallel":
+        matches = EvaluateInParallel(query.postfix, tag_ids)
+        if matches != None:
+            return matches
+    index = GetItemTagIndex()
+    return sorted(PlanQuery(query, tag_ids, index).Evaluate(index))
+
+
+def ExtremeSearch(search_text, execution_mode=None):
+    from SQL import GetTagIDsFromNames
     search_text, inp_tags = ConvertSearchText(search_text)
     query = InfixToPostfix(search_text)
     tag_ids = GetTagIDsFromNames(inp_tags)
     for tag in inp_tags:
         if tag not in tag_ids.keys():
             return ("INVALID", "TAGS")
-    matches = []
-    data = GetAllItemTags()
-    for item in data:
-        values = {}
-        for tag in tag_ids:
-            if isinstance(tag_ids[tag], int):
-                if tag_ids[tag] in item[1]:  # assuming form [itemID, tagIDs]
-                    values[tag] = True
-                else:
-                    values[tag] = False
-            else:
-                values[tag] = False
-                for match in tag_ids[tag]:
-                    if match in item[1]:
-                        values[tag] = True
-                        break
-        item_query = InsertValuesIntoQuery(query, values)
-        if EvaluatePostfix(item_query):
-            matches.append(item[0])  # assuming form [itemID, tagIDs]
+    key = MakeSearchCacheKey("EXTREME", query, tag_ids)
+    matches = search_cache.Get(key)
+    if matches == None:
+        matches = EvaluateBooleanQuery(search_text, tag_ids, execution_mode)
+        search_cache.Add(key, matches)
     return matches
 
 
-def CheckValidity(text):
-    bracket_depth = 0
-    for word in text:
-        if IsOperator(word):
-            if bracket_depth != 1 and word in (Operators.operators["OR"] +
-                                               Operators.operators["XOR"]):
-                return False  # ORs and XORs must be in brackets
-        if word == "(":
-            bracket_depth += 1
-            if bracket_depth == 2:
-                return False  # Max bracket depth = 1
-        elif word == ")":
-            bracket_depth -= 1
-    if bracket_depth != 0:
-        return False
-    current_bracket = []
-    for word in text:
-        if word == "(":
-            current_bracket = []
-        elif word == ")":
-            current_split = []
-            max_len = len(current_bracket)
-            for i in range(max_len + 1):
-                if i != max_len:
-                    inner_word = current_bracket[i]
-                if i == max_len or (IsOperator(inner_word) and inner_word
-                                    in (Operators.operators["OR"] +
-                                        Operators.operators["XOR"])):
-                    not_count = 0
-                    tag_count = 0
-                    for split_word in current_split:
-                        if not IsOperator(split_word):
-                            tag_count += 1
-                        elif split_word in Operators.operators["NOT"]:
-                            not_count += 1
-                    if not_count >= tag_count:
-                        return False  # must be at least 1 inclusive term in OR/XOR
-                    current_split = []
-                else:
-                    current_split.append(inner_word)
-            current_bracket = []
-        else:
-            current_bracket.append(word)
+def CheckBracketTerms(node):
+    # each part of a bracket split by ORs and XORs must have an inclusive term.
+    tag_count = 0
+    not_count = 0
+    for word in GetInfixTokens(node) + ["OR"]:
+        if word in ("OR", "XOR"):
+            if not_count >= tag_count:
+                return False
+            tag_count = 0
+            not_count = 0
+        elif word == "NOT":
+            not_count += 1
+        elif not IsOperator(word):
+            tag_count += 1
+    return True
+
+
+def CheckValidity(query):
+    for node, depth in WalkQueryTree(query.tree):
+        if depth > 1:
+            return False  # Max bracket depth = 1
+        if depth != 1 and node.type in ("OR", "XOR"):
+            return False  # ORs and XORs must be in brackets
+        if node.brackets != 0 and not CheckBracketTerms(node):
+            return False  # must be at least 1 inclusive term in OR/XOR
     return True
 
 
-def CheckStrictValidity(text):
-    if not CheckValidity(text):
+def CheckStrictValidity(query):
+    if not CheckValidity(query):
         return False
-    bracket_depth = 0
     tag_count = 0
     not_count = 0
-    max_index = len(text) - 1
-    for i, word in enumerate(text):
-        if '(' in word:
-            bracket_depth += 1
-        elif ')' in word:
-            bracket_depth -= 1
-        elif bracket_depth == 0:
-            if not IsOperator(word):
-                tag_count += 1
-            elif word in Operators.operators["NOT"]:
-                if i != max_index and text[i + 1][0] == '(':
-                    continue
-                not_count += 1
+    for node, depth in WalkQueryTree(query.tree):
+        if depth != 0:
+            continue
+        if node.type == "TAG":
+            tag_count += 1
+        elif node.type == "NOT" and node.children[0].brackets == 0:
+            not_count += 1
     if not_count > tag_count:
         return False  # must be at least 1 inclusive term in the expression
     return True
 
 
-def GetTopLevelInformation(text):
-    bracket_depth = 0
+def GetTopLevelInformation(query):
+    # returns the tags that the top level of a query requires and removes,
+    # and whether anything else (e.g. a bracket) must be evaluated as well.
     required = []
     remove = []
     requires_evaluation = False
-    max_index = len(text) - 1
-    for i, word in enumerate(text):
-        if word == "(":
-            bracket_depth += 1
-        elif word == ")":
-            bracket_depth -= 1
-        elif bracket_depth == 0 and not IsOperator(word):
-            if i == 0:
-                required.append(word)
-                continue
-            if text[i - 1] in Operators.operators["NOT"]:
-                remove.append(word)
-            else:
-                required.append(word)
-        elif bracket_depth == 0 and word in Operators.operators["NOT"]:
-            if i != max_index and text[i + 1][0] == '(':
-                requires_evaluation = True
-        elif word in (Operators.operators["OR"] + Operators.operators["XOR"]):
+    for term in GetTopLevelTerms(query.tree):
+        if term.type == "TAG":
+            required.append(term.value)
+        elif term.type == "NOT" and term.children[0].type == "TAG":
+            remove.append(term.children[0].value)
+        else:
             requires_evaluation = True
     return required, remove, requires_evaluation
 
 
-def StrictSearch(search_text):
-    from SQL import GetAllItemTags, GetTagIDsFromNames
+def StrictSearch(search_text, execution_mode=None):
+    from SQL import GetTagIDsFromNames
     search_text, inp_tags = ConvertSearchText(search_text)
     if not CheckStrictValidity(search_text):
         return ("INVALID", "VALIDITY")
-    temp_required, temp_remove, requires_evaluation = GetTopLevelInformation(
-        search_text)
     query = InfixToPostfix(search_text)
     tag_ids = GetTagIDsFromNames(inp_tags)
     for tag in inp_tags:
         if tag not in tag_ids.keys():
             return ("INVALID", "TAGS")
-    required = []
-    for i in temp_required:
-        i = tag_ids[i]
-        if isinstance(i, int):
-            required.append(i)
-    remove = []
-    for i in temp_remove:
-        i = tag_ids[i]
-        if isinstance(i, int):
-            remove.append(i)
-    matches = []
-    data = GetAllItemTags()
-    for item in data:
-        values = {}
-        for tag in tag_ids:
-            if isinstance(tag_ids[tag], int):
-                if tag_ids[tag] in item[1]:  # assuming form [itemID, tagIDs]
-                    values[tag] = True
-                else:
-                    values[tag] = False
-            else:
-                values[tag] = False
-                for match in tag_ids[tag]:
-                    if match in item[1]:
-                        values[tag] = True
-                        break
-        do_continue = False
-        for tag in required:
-            if tag not in item[1]:
-                do_continue = True
-                break
-        if do_continue:
-            continue
-        for tag in remove:
-            if tag in item[1]:
-                do_continue = True
-                break
-        if do_continue:
-            continue
-        if requires_evaluation:
-            item_query = InsertValuesIntoQuery(query, values)
-            if not EvaluatePostfix(item_query):
-                continue
-        matches.append(item[0])  # assuming form [itemID, tagIDs]
+    key = MakeSearchCacheKey("STRICT", query, tag_ids)
+    matches = search_cache.Get(key)
+    if matches == None:
+        matches = EvaluateBooleanQuery(search_text, tag_ids, execution_mode)
+        search_cache.Add(key, matches)
     return matches
 
 
-def FormatTag(word):
-    # returns formatted expression, actual word, value to shift final weight by
-    char_1 = word[0]
-    shift_value = 0
-    if char_1 in Operators.pre_operators:
-        word = word[1:]
-        if char_1 == '+':  # (+ means inclusive)
-            formatted = word
-        elif char_1 == "-":
-            split = SplitByCharacters(word, ['[', ']'])
-            word = split[0]
-            value = float(split[1])
-            formatted = word + '[' + str(-value) + ']'
-            shift_value = value
-        else:
-            formatted = GetOperatorType(char_1) + ' ' + word
-    else:
-        formatted = word
-    return formatted, word, shift_value
+def ConvertWeightedSearchText(text):
+    # returns parsed query, list of required tags, value to shift scores by
+    query = ParseSearchText(text, weighted=True)
+    return query, list(query.tag_names), query.total_shift
 
 
-def ConvertWeightedSearchText(text):
-    split_text = SplitText(text)
-    tag_names = []
-    output = ""
-    last_index = len(split_text) - 1
-    bracket_depth = 0
-    total_shift = 0
-    inverse_bracket_end_weight = False
-    for i, word in enumerate(split_text):
-        if i != 0:
-            split = output.split("[")
-            if len(split) > 1:
-                output = split[0] + ' CALCWEIGHT ' + split[1][:-2] + ' '
-        if word == '(':
-            bracket_depth += 1
-        elif word == ')':
-            bracket_depth -= 1
-        if bracket_depth == 0 and (not IsOperator(word)
-                                   or word == ')') and ('[' not in word
-                                                        or ']' not in word):
-            if word == ')' and i < last_index:
-                if split_text[i + 1][0] != '[':
-                    if inverse_bracket_end_weight:
-                        word += '[-1] '
-                        total_shift += 1
-                        inverse_bracket_end_weight = False
-                    else:
-                        word += '[1] '
-                elif inverse_bracket_end_weight:
-                    value = float(split_text[i + 1][1:-1])
-                    split_text[i + 1] = '[' + str(-value) + ']'
-                    total_shift += value
-                    inverse_bracket_end_weight = False
-            elif inverse_bracket_end_weight:
-                word += '[-1] '
-                total_shift += 1
-                inverse_bracket_end_weight = False
+def CheckWeightValidity(query):
+    if not CheckValidity(query):
+        return False
+    return not query.misplaced_weights  # weights cannot be inside brackets
+
+
+class IncidenceColumns:
+    """ A class used to cache the columns of the item x tag incidence matrix as
+        NumPy arrays, so that weighted searches can be evaluated over every
+        item at once. The matrix is stored sparsely (as the row positions of
+        each tag's items) and each column is only built the first time it is
+        used, which keeps memory bounded for databases with many tags."""
+    def __init__(self):
+        """ The constructor for the IncidenceColumns class. Creates an empty
+            cache that will be built from an ItemTagIndex when first updated.
+              Inputs: None.
+              Outputs: None."""
+        self.index = None
+        self.index_version = None
+        self.item_ids = np.zeros(0, dtype=np.int64)
+        self.rows = {}  # tag ID -> array of row positions of its items
+
+    def Update(self, index):
+        """ Clears the cached columns if the given index has changed since
+            they were built.
+              Inputs: index (the SQL.ItemTagIndex to build columns from).
+              Outputs: None."""
+        if index.version == self.index_version:
+            return
+        self.item_ids = np.array(sorted(index.items), dtype=np.int64)
+        self.rows = {}
+        self.index = index
+        self.index_version = index.version
+
+    def GetRows(self, tag_id):
+        """ Returns a sorted array of the row positions of the items that have
+            the given tag. """
+        if tag_id not in self.rows:
+            items = np.fromiter(self.index.GetItems(tag_id), dtype=np.int64)
+            self.rows[tag_id] = np.searchsorted(self.item_ids, np.sort(items))
+        return self.rows[tag_id]
+
+    def GetColumn(self, term_ids, positions=None):
+        """ Returns a Boolean array over every item (in ascending item ID
+            order) that is True for the items matching the term, where a term
+            is a tag ID or a list of tag IDs matched by a wildcard. If a sorted
+            array of row positions is given, the array only covers the items
+            at those positions. """
+        tag_ids = [term_ids] if isinstance(term_ids, int) else term_ids
+        if positions is None or 4 * len(positions) > len(self.item_ids):
+            column = np.zeros(len(self.item_ids), dtype=bool)
+            for tag_id in tag_ids:
+                column[self.GetRows(tag_id)] = True
+            return column if positions is None else column[positions]
+        # looking up a few positions is faster than building the whole column
+        column = np.zeros(len(positions), dtype=bool)
+        for tag_id in tag_ids:
+            rows = self.GetRows(tag_id)
+            if len(rows) == 0:
+                continue
+            found = np.searchsorted(rows, positions)
+            found[found == len(rows)] = 0
+            column |= rows[found] == positions
+        return column
+
+
+global incidence_columns
+incidence_columns = IncidenceColumns()
+
+
+def AsScores(values):
+    # booleans must be added as numbers, as adding Boolean arrays is an OR.
+    if isinstance(values, np.ndarray) and values.dtype == bool:
+        return values.astype(float)
+    return values
+
+
+def EvaluateWeightedPostfixOnColumns(postfix,
+                                     tag_ids,
+                                     columns,
+                                     positions=None):
+    # evaluates a weighted postfix query once over whole columns of the
+    # incidence matrix, giving the score of every item as a single array (or
+    # of only the items at the given row positions).
+    stack = Stack()
+    for word in postfix:
+        if not IsOperator(word):
+            if word in tag_ids:
+                stack.push(columns.GetColumn(tag_ids[word], positions))
             else:
-                word += '[1]'
-        if word[0] == '(':
-            output += word
+                stack.push(word)  # a weight, used by CALCWEIGHT
             continue
-        elif ')' in word:
-            split = word.split('[')
-            if len(split) > 1:
-                word = split[0] + ' CALCWEIGHT ' + split[1][:-2] + ' '
-                if i < last_index and (not IsOperator(split_text[i + 1])
-                                       or split_text[i + 1][0] == '('):
-                    word += 'ADDWEIGHT '
-                elif i < (last_index - 1) and (
-                        split_text[i + 1] in Operators.operators["NOT"]
-                        and split_text[i + 2][0] == '('):
-                    word += 'ADDWEIGHT '
-            output += word
+        arity = Operators.arity[word]
+        if len(stack) < arity:
+            raise Exception("Invalid postfix expression input.")
+        if word == "NOT":
+            stack.push(np.logical_not(stack.pop()))
             continue
-        if IsOperator(word):
-            if word in Operators.operators["NOT"]:
-                next_word = split_text[i + 1]
-                if next_word == '(':
-                    inverse_bracket_end_weight = True
-            elif bracket_depth == 0 and word in Operators.operators['AND']:
-                output += 'ADDWEIGHT '
-            else:
-                output += GetOperatorType(word) + ' '
-        elif i < last_index:
-            next_word = split_text[i + 1]
-            if IsOperator(next_word) and next_word != '(':
-                if bracket_depth == 0:
-                    new_text, word, shift_value = FormatTag(word.lower())
-                    total_shift += shift_value
-                else:
-                    new_text, word = ReducePreOperators(word.lower())
-                if i < (last_index) - 1 and next_word in Operators.operators[
-                        "NOT"] and split_text[i + 2][0] == '(':
-                    # if the next operator is a NOT inverting a bracketed section, must add 'ADDWEIGHT '
-                    split = new_text.split('[')
-                    new_text = split[0] + ' CALCWEIGHT ' + split[
-                        1][:-1] + ' ADDWEIGHT'
-                output += new_text + ' '
-                if word not in tag_names:
-                    word = SplitByCharacters(word, ['['])[0]
-                    if len(word) > 1:
-                        tag_names.append(word)
-            else:
-                if bracket_depth == 0:
-                    new_text, word, shift_value = FormatTag(word.lower())
-                    total_shift += shift_value
-                    split = new_text.split('[')
-                    if len(split) > 1:
-                        new_text = split[0] + ' CALCWEIGHT ' + split[
-                            1][:-1] + ' '
-                    output += new_text + 'ADDWEIGHT '
-                else:
-                    new_text, word = ReducePreOperators(word.lower())
-                    output += new_text + ' AND '
-                if word not in tag_names:
-                    word = SplitByCharacters(word, ['['])[0]
-                    if len(word) > 0:
-                        tag_names.append(word)
+        b = stack.pop()
+        a = stack.pop()
+        if word == "CALCWEIGHT":
+            stack.push(np.where(a, float(b), 0.0))
+        elif word == "ADDWEIGHT":
+            stack.push(AsScores(a) + AsScores(b))
+        elif word == "AND":
+            stack.push(np.logical_and(a, b))
+        elif word == "OR":
+            stack.push(np.logical_or(a, b))
+        elif word == "XOR":
+            stack.push(np.not_equal(a, b))
+    return stack.pop()
+
+
+def GetTopPositions(item_ids, scores, limit):
+    # returns the positions of the highest scores (at most limit of them),
+    # highest first, with equal scores in ascending item ID order.
+    if limit <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if limit < len(scores):
+        threshold = np.partition(scores, len(scores) - limit)[len(scores) -
+                                                              limit]
+        keep = np.flatnonzero(scores >= threshold)
+    else:
+        keep = np.arange(len(scores))
+    order = np.lexsort((item_ids[keep], -scores[keep]))
+    return keep[order[:limit]]
+
+
+def PruneWeightedCandidates(query, tag_ids, columns, limit, minimum_score):
+    # scores every item term by term, starting with the largest weights, and
+    # after each term drops the items that cannot reach the top limit scores
+    # (or the minimum score) even if they gain every remaining positive
+    # weight. Returns the row positions of the remaining candidates.
+    terms = sorted(query.tree.children, key=lambda t: -abs(float(t.value)))
+    weights = [float(term.value) for term in terms]
+    remaining_gain = sum(w for w in weights if w > 0)
+    remaining_loss = sum(w for w in weights if w < 0)
+    positions = np.arange(len(columns.item_ids))
+    scores = np.full(len(positions), float(query.total_shift))
+    for term, weight in zip(terms, weights):
+        postfix = []
+        AddPostfixTokens(term.children[0], postfix)
+        matches = EvaluateWeightedPostfixOnColumns(postfix, tag_ids, columns,
+                                                   positions)
+        scores = scores + np.where(matches, weight, 0.0)
+        if weight > 0:
+            remaining_gain -= weight
         else:
-            if bracket_depth == 0:
-                new_text, word, shift_value = FormatTag(word.lower())
-                total_shift += shift_value
-            else:
-                new_text, word = ReducePreOperators(word.lower())
-            output += new_text
-            if word not in tag_names:
-                word = SplitByCharacters(word, ['['])[0]
-                if len(word) > 0:
-                    tag_names.append(word)
-    split = output.split("[")
-    if len(split) > 1:
-        output = split[0] + ' CALCWEIGHT ' + split[1][:-1] + ' '
-    return SplitText(output), tag_names, total_shift
-
-
-def CheckWeightValidity(text):
-    if not CheckValidity(text):
-        return False
-    bracket_depth = 0
-    for word in text:
-        if '(' in word:
-            bracket_depth += 1
-        elif ')' in word:
-            bracket_depth -= 1
-        elif bracket_depth > 0:
-            if word == 'CALCWEIGHT':
-                return False
-    return True
+            remaining_loss -= weight
+        highest = scores + remaining_gain + 1e-9  # allow for rounding errors
+        keep = np.ones(len(positions), dtype=bool)
+        if minimum_score != None:
+            keep &= highest >= minimum_score
+        lowest = scores + remaining_loss
+        # finding the lowest of the top scores is only worthwhile if some item
+        # could be below it.
+        if 0 < limit < len(positions) and highest.min() < lowest.max():
+            keep &= highest >= np.partition(lowest, len(lowest) -
+                                            limit)[len(lowest) - limit]
+        positions = positions[keep]
+        scores = scores[keep]
+        if len(positions) == 0:
+            break
+    return positions
 
 
-def WeightedSearch(search_text, minimum_score=None):
-    from SQL import GetTagIDsFromNames, GetAllItemTags
+def WeightedSearch(search_text, minimum_score=None, limit=None):
+    from SQL import GetTagIDsFromNames, GetItemTagIndex
     search_text, inp_tags, total_shift = ConvertWeightedSearchText(search_text)
     if not CheckWeightValidity(search_text):
         return ("INVALID", "VALIDITY")
@@ -578,32 +1148,236 @@ def WeightedSearch(search_text, minimum_score=None):
     for tag in inp_tags:
         if tag not in tag_ids.keys():
             return ("INVALID", "TAGS")
-    matches = {}
-    data = GetAllItemTags()
-    for item in data:
-        values = {}
-        for tag in tag_ids.keys():
-            if isinstance(tag_ids[tag], int):
-                if tag_ids[tag] in item[1]:  # assuming form [itemID, tagIDs]
-                    values[tag] = True
-                else:
-                    values[tag] = False
-            else:
-                values[tag] = False
-                for match in tag_ids[tag]:
-                    if match in item[1]:
-                        values[tag] = True
-                        break
-        item_query = InsertValuesIntoQuery(query, values)
-        matches[item[0]] = EvaluatePostfix(
-            item_query) + total_shift  # assuming form [itemID, tagIDs]
+    key = MakeSearchCacheKey("WEIGHTED", query, tag_ids, total_shift,
+                             minimum_score, limit)
+    matches = search_cache.Get(key)
+    if matches != None:
+        return matches
+    if config.settings["search_execution_mode"] == "parallel":
+        matches = EvaluateInParallel(query, tag_ids, True, total_shift,
+                                     minimum_score)
+        if matches != None:
+            if limit != None:
+                top = sorted(matches, key=lambda k: matches[k], reverse=True)
+                matches = {i: matches[i] for i in top[:limit]}
+            search_cache.Add(key, matches)
+            return matches
+    incidence_columns.Update(GetItemTagIndex())
+    item_ids = incidence_columns.item_ids
+    positions = None
+    if limit != None:
+        positions = PruneWeightedCandidates(search_text, tag_ids,
+                                            incidence_columns, limit,
+                                            minimum_score)
+        item_ids = item_ids[positions]
+    # the remaining items are scored in full so that their scores are exactly
+    # the same as they would be without a limit.
+    scores = EvaluateWeightedPostfixOnColumns(query, tag_ids,
+                                              incidence_columns, positions)
+    scores = np.broadcast_to(AsScores(scores), item_ids.shape) + total_shift
+    if minimum_score != None:
+        keep = scores >= minimum_score
+        item_ids = item_ids[keep]
+        scores = scores[keep]
+    if limit != None:
+        # returned in order of descending score
+        top = GetTopPositions(item_ids, scores, limit)
+        item_ids = item_ids[top]
+        scores = scores[top]
+    matches = dict(zip(item_ids.tolist(), scores.tolist()))
+    search_cache.Add(key, matches)
+    return matches
+
+
+def CountWeightedMatches(search_text, minimum_score=None):
+    # returns the number of items a weighted search matches without a limit,
+    # so that the total can be shown when only the top results are fetched.
+    # the scores are only counted, never sorted or turned into a dictionary.
+    from SQL import GetTagIDsFromNames, GetItemTagIndex
+    search_text, inp_tags, total_shift = ConvertWeightedSearchText(search_text)
+    if not CheckWeightValidity(search_text):
+        return ("INVALID", "VALIDITY")
+    query = InfixToPostfix(search_text)
+    tag_ids = GetTagIDsFromNames(inp_tags)
+    for tag in inp_tags:
+        if tag not in tag_ids.keys():
+            return ("INVALID", "TAGS")
+    incidence_columns.Update(GetItemTagIndex())
     if minimum_score == None:
+        return len(incidence_columns.item_ids)
+    scores = EvaluateWeightedPostfixOnColumns(query, tag_ids,
+                                              incidence_columns)
+    scores = np.broadcast_to(AsScores(scores),
+                             incidence_columns.item_ids.shape) + total_shift
+    return int(np.count_nonzero(scores >= minimum_score))
+
+
+def ChunkSearchResults(matches, chunk_size=100):
+    # yields the IDs of matching items in lists of at most chunk_size, with
+    # weighted results in order of descending score.
+    if isinstance(matches, dict):
+        matches = sorted(matches, key=lambda k: matches[k], reverse=True)
+    for i in range(0, len(matches), chunk_size):
+        yield matches[i:i + chunk_size]
+
+
+def StrictSearchChunks(search_text, chunk_size=100, execution_mode=None):
+    # the query is checked and evaluated straight away, so that an invalid
+    # query is returned as ("INVALID", ...) rather than a generator.
+    matches = StrictSearch(search_text, execution_mode)
+    if isinstance(matches, tuple):
         return matches
-    to_return = {}
-    for item in matches.keys():
-        if matches[item] >= minimum_score:
-            to_return[item] = matches[item]
-    return to_return
+    return ChunkSearchResults(matches, chunk_size)
+
+
+def ExtremeSearchChunks(search_text, chunk_size=100, execution_mode=None):
+    matches = ExtremeSearch(search_text, execution_mode)
+    if isinstance(matches, tuple):
+        return matches
+    return ChunkSearchResults(matches, chunk_size)
+
+
+def WeightedSearchChunks(search_text,
+                         minimum_score=None,
+                         limit=None,
+                         chunk_size=100):
+    matches = WeightedSearch(search_text, minimum_score, limit)
+    if isinstance(matches, tuple):
+        return matches
+    return ChunkSearchResults(matches, chunk_size)
+
+
+def ExplainSearch(search_text, search_type="STRICT", execution_mode=None):
+    # returns a list of lines describing how a search would be evaluated and
+    # roughly how many items each step would match, without running it.
+    from SQL import GetTagIDsFromNames, GetItemTagIndex, ExplainPostfixQuery
+    if search_type == "WEIGHTED":
+        search_text, inp_tags, total_shift = ConvertWeightedSearchText(
+            search_text)
+        valid = CheckWeightValidity(search_text)
+    else:
+        search_text, inp_tags = ConvertSearchText(search_text)
+        valid = search_type != "STRICT" or CheckStrictValidity(search_text)
+    if not valid:
+        return ("INVALID", "VALIDITY")
+    tag_ids = GetTagIDsFromNames(inp_tags)
+    for tag in inp_tags:
+        if tag not in tag_ids.keys():
+            return ("INVALID", "TAGS")
+    index = GetItemTagIndex()
+    if search_type == "WEIGHTED":
+        lines = [f'Scores all {len(index.items)} items, shifted by '
+                 f'{total_shift}:']
+        for term in search_text.tree.children:
+            lines += PlanNode(term.children[0], tag_ids,
+                              index).Describe(1, "WEIGHT " + term.value)
+        return lines
+    if execution_mode == None:
+        execution_mode = config.settings["search_execution_mode"]
+    if execution_mode == "database":
+        steps = ExplainPostfixQuery(search_text.postfix, tag_ids)
+        if steps != None:
+            return ["Evaluated by SQLite:"] + ["  " + s for s in steps]
+    lines = [f'Evaluated over the index of {len(index.items)} items:']
+    return lines + PlanQuery(search_text, tag_ids, index).Describe(1)
+
+
+class TagPrefixIndex:
+    """ A class used to suggest tags for the word being typed into the search
+        bar. Every tag name and synonym is kept in one sorted list, so the tags
+        starting with a given prefix form a contiguous run that can be found by
+        binary search, rather than matching a pattern against every tag."""
+    def __init__(self):
+        """ The constructor for the TagPrefixIndex class. Creates an empty
+            index that must be built before it is used.
+              Inputs: None.
+              Outputs: None."""
+        self.version = None  # the tag catalog version the index was built at
+        self.keys = []  # normalised names and synonyms, in sorted order
+        self.tag_ids = []  # the ID of the tag that each key belongs to
+        self.names = {}  # tag ID -> name
+        self.ranked = {}  # (prefix, limit) -> most popular matching tag IDs
+        self.ranked_version = None  # the popularity version of self.ranked
+
+    def Build(self, tag_data, version):
+        """ Replaces the contents of the index with the given tags.
+              Inputs: tag_data (a dictionary mapping each tag ID to a list of
+            its name, description and synonyms, as returned by
+            SQL.GetAllTagData) and version (the tag catalog version that the
+            data was read at).
+              Outputs: None."""
+        from os.path import normcase
+        entries = []
+        for tag_id, (name, _, synonyms) in tag_data.items():
+            # keys are normalised in the same way as by fnmatch, so that
+            # prefix matches agree with the wildcard matches they replace.
+            for text in set([name] + synonyms):
+                entries.append((normcase(text), tag_id))
+        entries.sort()
+        self.keys = [entry[0] for entry in entries]
+        self.tag_ids = [entry[1] for entry in entries]
+        self.names = {tag_id: data[0] for tag_id, data in tag_data.items()}
+        self.version = version
+        self.ranked = {}
+
+    def GetMatches(self,
+                   prefix,
+                   limit=None,
+                   popularity=None,
+                   popularity_version=None):
+        """ Returns the names of the first (limit) tags with a name or synonym
+            starting with the given prefix, in the alphabetical order of the
+            matching names and synonyms. If a popularity function (taking a tag
+            ID) is given, the (limit) most popular matching tags are returned
+            instead, from most to least popular. If a popularity_version is
+            also given, rankings are remembered until it changes, as short
+            prefixes can match a large fraction of all tags. """
+        from bisect import bisect_left
+        from os.path import normcase
+        import heapq
+        prefix = normcase(prefix)
+        if popularity_version != None:
+            if popularity_version != self.ranked_version:
+                self.ranked = {}
+                self.ranked_version = popularity_version
+            if (prefix, limit) in self.ranked:
+                return [
+                    self.names[tag_id]
+                    for tag_id in self.ranked[(prefix, limit)]
+                ]
+        matches = {}  # used as an ordered set of tag IDs
+        i = bisect_left(self.keys, prefix)
+        while (i < len(self.keys) and (popularity != None
+                                       or len(matches) != limit)
+               and self.keys[i].startswith(prefix)):
+            matches[self.tag_ids[i]] = None
+            i += 1
+        if popularity != None:
+            # ties are kept in alphabetical order.
+            if limit == None:
+                matches = sorted(matches, key=popularity, reverse=True)
+            else:
+                matches = heapq.nlargest(limit, matches, key=popularity)
+            if popularity_version != None:
+                self.ranked[(prefix, limit)] = matches
+        return [self.names[tag_id] for tag_id in matches]
+
+
+def RecordSearchedTags(search_text, weighted=False):
+    """ Records that each tag named in a search has been searched for once
+        more, so that popular tags can be suggested first. Wildcard terms are
+        not counted, as they were not typed as whole tags.
+          Inputs: search_text (the string of the search) and weighted (a
+        Boolean describing whether the search is a weighted search).
+          Outputs: None."""
+    from SQL import GetTagIDsFromNames, RecordTagSearches
+    tag_names = [
+        tag for tag in ParseSearchText(search_text, weighted).tag_names
+        if "*" not in tag
+    ]
+    tag_ids = GetTagIDsFromNames(tag_names)
+    if len(tag_ids) > 0:
+        RecordTagSearches(sorted(set(tag_ids.values())))
 
 
 def FormatResultsToHTML(items):
@@ -682,26 +1456,7 @@ def FormatImportTags(text):
 
 
 def GetLevenshteinDist(a, b):
-    rows = len(a) + 1
-    columns = len(b) + 1
-    distance = np.zeros((rows, columns),
-                        dtype=int)  # initialize a matrix of zeroes
-    for i in range(1, rows):
-        for j in range(1, columns):
-            # populate matrix with indexes of strings.
-            distance[i][0] = i
-            distance[0][j] = j
-    for column in range(1, columns):
-        for row in range(1, rows):
-            if a[row - 1] == b[column - 1]:
-                cost = 0  # if characters are identical in the same position, cost is 0
-            else:
-                cost = 1
-            distance[row][column] = min(
-                distance[row - 1][column] + 1,  # cost of deletions
-                distance[row][column - 1] + 1,  # cost of insertions
-                distance[row - 1][column - 1] + cost)  # cost of substitutions
-    return distance[row][column]
+    return GetEditDistance(a, b)
 
 
 def GetTagSimilarity(a, b):
@@ -716,8 +1471,270 @@ def GetTagSimilarity(a, b):
     return max(ratio, partial_ratio, token_sort_ratio, token_set_ratio)
 
 
-def GetTagMostSimilar(a, options):
+def GetCommonCharacterCount(a_counts, b_counts):
+    # the size of the multiset intersection of two strings' characters, which
+    # bounds the number of characters any alignment of them can match.
+    if len(a_counts) > len(b_counts):
+        a_counts, b_counts = b_counts, a_counts
+    return sum(min(n, b_counts.get(char, 0)) for char, n in a_counts.items())
+
+
+def GetMostCommonCharactersInWindow(counts, text, width):
+    # the largest common character count between a string (given by counts)
+    # and any substring of text of the given width.
+    window = {}
+    common = 0
+    most = 0
+    for i, char in enumerate(text):
+        n = window.get(char, 0)
+        if n < counts.get(char, 0):
+            common += 1
+        window[char] = n + 1
+        if i >= width:
+            removed = text[i - width]
+            window[removed] -= 1
+            if window[removed] < counts.get(removed, 0):
+                common -= 1
+        if common > most:
+            most = common
+    return most
+
+
+def GetPartialRatioBound(counts, length, text):
+    # partial_ratio compares a string (given by counts and its length) with
+    # substrings of text of the same length, except that those starting too
+    # near to the end of text are cut short.
+    bound = GetMostCommonCharactersInWindow(counts, text, length) / length
+    suffix = {}
+    common = 0
+    for i, char in enumerate(reversed(text[len(text) - length + 1:])):
+        n = suffix.get(char, 0)
+        if n < counts.get(char, 0):
+            common += 1
+        suffix[char] = n + 1
+        bound = max(bound, 2 * common / (length + i + 1))
+    return bound
+
+
+class TagSimilarityBound:
+    """ A class used to cheaply find an upper bound on GetTagSimilarity between
+        one search string and many tags, so that tags which cannot reach a
+        similarity threshold can be skipped without being scored. Each fuzzy
+        ratio is 2M/T for some strings of total length T with M matching
+        characters, so it cannot exceed the ratio given by the characters that
+        the strings have in common."""
+    def __init__(self, a):
+        """ The constructor for the TagSimilarityBound class. Precomputes the
+            character counts and tokens of the search string.
+              Inputs: a (the search string, as passed to GetTagSimilarity).
+              Outputs: None."""
+        from collections import Counter
+        from fuzzywuzzy.utils import full_process
+        self.text = a
+        self.counts = Counter(a)
+        # token_sort_ratio compares the sorted tokens of each processed
+        # string, which have the same characters as the tokens joined in order.
+        self.tokens = full_process(a, force_ascii=True).split()
+        self.processed = " ".join(self.tokens)
+        self.processed_counts = Counter(self.processed)
+        self.token_set = set(self.tokens)
+
+    def MayReach(self, b, threshold):
+        """ Returns False only if GetTagSimilarity(a, b) is certainly less than
+            the given threshold (an integer from 0-100). Scores are rounded, so
+            a tag is only ruled out if its bound is over one below the
+            threshold. """
+        from collections import Counter
+        from fuzzywuzzy.utils import full_process
+        limit = (threshold - 1) / 100
+        a_length = len(self.text)
+        if a_length == 0:
+            return True
+        b_counts = Counter(b)
+        common = GetCommonCharacterCount(self.counts, b_counts)
+        if 2 * common / (a_length + len(b)) >= limit:  # ratio
+            return True
+        if len(b) >= a_length and 2 * common / (a_length + common) >= limit:
+            # partial_ratio only compares the search string with substrings of
+            # b, so a tighter bound is worth finding.
+            if GetPartialRatioBound(self.counts, a_length, b) >= limit:
+                return True
+        b_tokens = full_process(b, force_ascii=True).split()
+        processed = " ".join(b_tokens)
+        length = len(self.processed) + len(processed)
+        # token_sort_ratio (which is 100 if both processed strings are empty)
+        if length == 0 or 2 * GetCommonCharacterCount(
+                self.processed_counts, Counter(processed)) / length >= limit:
+            return True
+        if len(b) < a_length or len(self.tokens) == 0 or len(b_tokens) == 0:
+            return False
+        # token_set_ratio compares the common tokens (S) with S + the tokens
+        # only in either string (D1 and D2), and S + D1 with S + D2.
+        b_token_set = set(b_tokens)
+        common_tokens = self.token_set & b_token_set
+        only_a = " ".join(self.token_set - b_token_set)
+        only_b = " ".join(b_token_set - self.token_set)
+        shared = GetCommonCharacterCount(Counter(only_a), Counter(only_b))
+        if len(common_tokens) == 0:
+            bound = 2 * shared / (len(only_a) + len(only_b))
+        elif len(only_a) == 0 or len(only_b) == 0:
+            return True
+        else:
+            s = len(" ".join(common_tokens))
+            bound = max(2 * s / (2 * s + 1 + min(len(only_a), len(only_b))),
+                        2 * (s + 1 + shared) /
+                        (2 * s + 2 + len(only_a) + len(only_b)))
+        return bound >= limit
+
+
+def GetTagMostSimilar(a, options, threshold=None):
+    # if a threshold is given, tags that cannot reach it are left out rather
+    # than being scored.
     matches = {}
+    bound = TagSimilarityBound(a) if threshold != None else None
     for option in options:
-        matches[option] = GetTagSimilarity(a, option)
-    return matches
\ No newline at end of file
+        if bound == None or bound.MayReach(option, threshold):
+            matches[option] = GetTagSimilarity(a, option)
+    return matches
+
+
+TAG_SEARCH_DEBOUNCE = 0.15  # seconds without typing before tags are scored
+TAG_SEARCH_CACHED_TEXTS = 8  # how many texts' scores the worker remembers
+
+
+class TagSearchWorker:
+    """ A class used to score tags against the tags menu search text on a
+        single long-lived background thread. Scoring only starts once the text
+        has not changed for TAG_SEARCH_DEBOUNCE seconds, and every request is
+        given a generation number, so that scoring for text that has since
+        changed is abandoned part way through and its results are dropped
+        rather than replacing newer ones."""
+    def __init__(self, debounce=TAG_SEARCH_DEBOUNCE):
+        """ The constructor for the TagSearchWorker class. The thread itself
+            is only started when the first request is submitted.
+              Inputs: debounce (the number of seconds to wait for the text to
+            stop changing before scoring).
+              Outputs: None."""
+        from threading import Condition
+        self.debounce = debounce
+        self.generation = 0  # the generation of the newest request
+        self.request = None  # (generation, text, options, threshold)
+        self.submitted = 0  # the time the newest request was submitted
+        self.scoring = False
+        self.result = None  # (generation, matches) of the last finished job
+        self.scores = {}  # (text, threshold) -> {option: score or None}
+        self.condition = Condition()
+        self.thread = None
+
+    @property
+    def busy(self):
+        """ A property that returns a Boolean value describing whether a
+            request is waiting to be scored or is being scored. """
+        with self.condition:
+            return self.request != None or self.scoring
+
+    def Submit(self, text, options, threshold=None):
+        """ Replaces any waiting or in-progress request with a new one.
+              Inputs: text (the search string), options (a list of tag names)
+            and threshold (as passed to GetTagMostSimilar).
+              Outputs: the generation number of the new request."""
+        from threading import Thread
+        from time import time as CurrentTime
+        with self.condition:
+            self.generation += 1
+            self.request = (self.generation, text, list(options), threshold)
+            self.submitted = CurrentTime()
+            if self.thread == None:
+                self.thread = Thread(target=self.Run, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+            return self.generation
+
+    def Cancel(self):
+        """ Abandons any waiting or in-progress request without replacing it.
+              Inputs: None.
+              Outputs: None."""
+        with self.condition:
+            self.generation += 1
+            self.request = None
+            self.result = None
+
+    def TakeResult(self):
+        """ Returns the matches (as returned by GetTagMostSimilar) for the
+            newest request if it has finished and they have not already been
+            taken, and None otherwise. """
+        with self.condition:
+            result = self.result
+            self.result = None
+        if result == None or result[0] != self.generation:
+            return None
+        return result[1]
+
+    def Run(self):
+        """ The body of the worker thread, which waits for requests and then
+            scores them for as long as the program runs.
+              Inputs: None.
+              Outputs: None."""
+        from time import time as CurrentTime
+        while True:
+            with self.condition:
+                while True:
+                    if self.request == None:
+                        self.condition.wait()
+                        continue
+                    remaining = self.submitted + self.debounce - CurrentTime()
+                    if remaining > 0:
+                        self.condition.wait(remaining)
+                        continue
+                    break
+                generation, text, options, threshold = self.request
+                self.request = None
+                self.scoring = True
+            try:
+                matches = self.Score(generation, text, options, threshold)
+            except Exception as e:
+                import debug
+                debug.Log(f'Tag search failed: {e}')
+                matches = None
+            with self.condition:
+                if matches != None and generation == self.generation:
+                    self.result = (generation, matches)
+                self.scoring = False
+
+    def Score(self, generation, text, options, threshold):
+        """ Scores tags in the same way as GetTagMostSimilar, checking
+            periodically whether the request has been replaced. Scores are
+            remembered for the last few texts, so if scoring is abandoned and
+            the same text is later searched again (for example after a typo is
+            deleted) only the tags not yet scored are scored.
+              Inputs: generation (the generation of the request), text,
+            options and threshold (as passed to GetTagMostSimilar).
+              Outputs: the matches, or None if the request was replaced."""
+        key = (text, threshold)
+        scores = self.scores.pop(key, {})
+        self.scores[key] = scores  # moved to the end, as most recently used
+        while len(self.scores) > TAG_SEARCH_CACHED_TEXTS:
+            del self.scores[next(iter(self.scores))]
+        bound = TagSimilarityBound(text) if threshold != None else None
+        matches = {}
+        for i, option in enumerate(options):
+            if i % 64 == 0 and generation != self.generation:
+                return None
+            if option not in scores:
+                if bound == None or bound.MayReach(option, threshold):
+                    scores[option] = GetTagSimilarity(text, option)
+                else:
+                    scores[option] = None  # cannot reach the threshold
+            if scores[option] != None:
+                matches[option] = scores[option]
+        return matches
+
+
+def GetSimilarTags(a, options, threshold):
+    """ Returns the tags in options with a similarity of at least threshold to
+        the string a, from most to least similar. """
+    matches = GetTagMostSimilar(a, options, threshold)
+    return sorted(
+        [option for option in matches if matches[option] >= threshold],
+        key=lambda k: matches[k],
+        reverse=True)
\ No newline at end of file
@@ -0,0 +1,20 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import encryption
+import SQL
+
+
+@pytest.fixture
+def database(tmp_path):
+    """ Loads a new, empty database in a temporary directory, using the
+        default settings and a fixed encryption key. """
+    config.settings.update(config.DEFAULT_SETTINGS)
+    config.settings["key"] = bytes(range(32))
+    encryption.CreateCiphers(config.settings["key"])
+    SQL.LoadDatabase(str(tmp_path / "test"))
+    return SQL
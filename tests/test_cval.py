@@ -0,0 +1,42 @@
+import io
+import pytest
+import cval
+
+KEY = b"AAECAwQFBgcICQoLDA0ODxAREhMUFRYXGBkaGxwdHh8="
+RECORDS = [[f'item {i}', None, i, 1.5, 2.5, 0, 5, ["a", "b"][:i % 3]]
+           for i in range(2500)]
+
+
+@pytest.mark.parametrize("compression", ["zlib", "lzma"])
+def test_binary_round_trip(compression):
+    file_ = io.BytesIO()
+    progress = []
+    assert cval.WriteRecords(file_, KEY, "items", RECORDS, len(RECORDS),
+                             lambda *counts: progress.append(counts),
+                             compression) == len(RECORDS)
+    assert progress[-1] == (len(RECORDS), len(RECORDS))
+    file_.seek(0)
+    assert file_.read(len(cval.BINARY_HEADER)) == cval.BINARY_HEADER
+    file_.seek(0)
+    blocks = list(cval.ReadRecordBlocks(file_, KEY, "items"))
+    assert [len(block) for block in blocks] == [1000, 1000, 500]
+    assert [record for block in blocks for record in block] == RECORDS
+
+
+@pytest.mark.parametrize("compression", ["zlib", "lzma"])
+def test_binary_file_errors(compression):
+    file_ = io.BytesIO()
+    cval.WriteRecords(file_, KEY, "items", RECORDS, compression=compression)
+    data = file_.getvalue()
+    with pytest.raises(ValueError):
+        list(cval.ReadRecords(io.BytesIO(data), KEY, "tags"))
+    for end in [len(data) - 1, len(data) - 200, len(cval.BINARY_HEADER) + 5]:
+        with pytest.raises(ValueError):
+            list(cval.ReadRecords(io.BytesIO(data[:end]), KEY, "items"))
+
+
+def test_file_compression_is_chosen_by_extension():
+    assert cval.GetFileCompression("export.CVALZ") == "zlib"
+    assert cval.GetFileCompression("dir.cvalz/export.cvalx") == "lzma"
+    assert cval.GetFileCompression("export.CVAL") == None
+    assert cval.GetFileCompression("export.txt") == None
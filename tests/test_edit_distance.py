@@ -0,0 +1,62 @@
+import random
+import pytest
+from edit_distance import (GetEditDistance, GetBoundedEditDistance,
+                           GetEditDistances)
+
+
+def GetReferenceDistance(a, b):
+    # the standard dynamic programming algorithm, one row at a time.
+    previous = list(range(len(b) + 1))
+    for i, a_char in enumerate(a, 1):
+        current = [i]
+        for j, b_char in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1,
+                    previous[j - 1] + (a_char != b_char)))
+        previous = current
+    return previous[-1]
+
+
+def GetRandomPairs(count, max_length, seed):
+    generator = random.Random(seed)
+    pairs = []
+    for _ in range(count):
+        a = "".join(
+            generator.choice("abcd ") for _ in range(generator.randint(
+                0, max_length)))
+        # b is often an edited copy of a, so that small distances are common.
+        if generator.random() < 0.5:
+            b = list(a)
+            for _ in range(generator.randint(0, 5)):
+                position = generator.randint(0, len(b))
+                b[position:position + generator.randint(0, 1)] = (
+                    generator.choice(["", "a", "e"]))
+            b = "".join(b)
+        else:
+            b = "".join(
+                generator.choice("abce") for _ in range(generator.randint(
+                    0, max_length)))
+        pairs.append((a, b))
+    return pairs
+
+
+@pytest.mark.parametrize("max_length", [8, 64, 150])
+def test_edit_distance_matches_reference(max_length):
+    for a, b in GetRandomPairs(200, max_length, max_length):
+        expected = GetReferenceDistance(a, b)
+        assert GetEditDistance(a, b) == expected
+        assert GetEditDistance(b, a) == expected
+        for max_distance in [0, 2, 5]:
+            bounded = GetBoundedEditDistance(a, b, max_distance)
+            assert bounded == (expected
+                               if expected <= max_distance else None)
+
+
+def test_edit_distances_share_query_masks():
+    query = "x" * 70 + "tag name"
+    candidates = ["", "tag name", query, query[1:] + "!", "y" * 80]
+    expected = [GetReferenceDistance(query, c) for c in candidates]
+    assert GetEditDistances(query, candidates) == expected
+    assert GetEditDistances(query, candidates, 2) == [
+        d if d <= 2 else None for d in expected
+    ]
@@ -0,0 +1,177 @@
+import pytest
+from searches import (ParseSearchText, CheckStrictValidity,
+                      CheckWeightValidity, WeightedSearch,
+                      CountWeightedMatches)
+
+
+@pytest.mark.parametrize("text, postfix", [
+    ("a NOT b", ["a", "b", "NOT", "AND"]),
+    ("a -b", ["a", "b", "NOT", "AND"]),
+    ("+a !b", ["a", "b", "NOT", "AND"]),
+    ("-(a OR b) c", ["a", "b", "OR", "NOT", "c", "AND"]),
+    ("a (b XOR -c d)", ["a", "b", "c", "NOT", "XOR", "d", "AND", "AND"]),
+])
+def test_strict_query_postfix(text, postfix):
+    query = ParseSearchText(text)
+    assert list(query.postfix) == postfix
+    assert CheckStrictValidity(query)
+
+
+@pytest.mark.parametrize("text", [
+    "a OR b", "a b OR c", "((a OR b)) c", "(a OR -b) c", "(-a XOR b) c"
+])
+def test_invalid_strict_queries(text):
+    assert not CheckStrictValidity(ParseSearchText(text))
+
+
+@pytest.mark.parametrize("text", [
+    "", "a AND", "AND a", "(a OR b", "a OR b)", "a)b", "a[2]", "a[2", "a]"
+])
+def test_malformed_strict_queries_raise(text):
+    with pytest.raises(Exception):
+        ParseSearchText(text)
+
+
+@pytest.mark.parametrize("text, postfix, total_shift", [
+    ("a[2] b c[-1]", [
+        "a", "2", "CALCWEIGHT", "b", "1", "CALCWEIGHT", "ADDWEIGHT", "c",
+        "-1", "CALCWEIGHT", "ADDWEIGHT"
+    ], 0),
+    ("(a OR b)[2] c", [
+        "a", "b", "OR", "2", "CALCWEIGHT", "c", "1", "CALCWEIGHT",
+        "ADDWEIGHT"
+    ], 0),
+    ("-a[3] b", [
+        "a", "-3.0", "CALCWEIGHT", "b", "1", "CALCWEIGHT", "ADDWEIGHT"
+    ], 3),
+    ("-(a OR b)[2] c", [
+        "a", "b", "OR", "-2.0", "CALCWEIGHT", "c", "1", "CALCWEIGHT",
+        "ADDWEIGHT"
+    ], 2),
+])
+def test_weighted_query_postfix(text, postfix, total_shift):
+    query = ParseSearchText(text, weighted=True)
+    assert list(query.postfix) == postfix
+    assert query.total_shift == total_shift
+    assert CheckWeightValidity(query)
+
+
+def test_invalid_weighted_queries():
+    # weights can only follow top level terms.
+    assert not CheckWeightValidity(
+        ParseSearchText("a (b[2] OR c)", weighted=True))
+    for text in ["a[x]", "a[2][3]", "a[]"]:
+        with pytest.raises(Exception):
+            ParseSearchText(text, weighted=True)
+
+
+def AddRandomItems(database, count=300):
+    import random
+    generator = random.Random(1)
+    database.AddTags([(tag, "", []) for tag in
+                      ["rare", "b", "c", "d", "tab", "tac"]])
+    items = []
+    for i in range(count):
+        tags = [tag for tag in ["b", "c", "d", "tab", "tac"]
+                if generator.random() < 0.4]
+        if i % 25 == 0:
+            tags.append("rare")
+        items.append((f'i{i}', None, 0, 1, 1, 0, 5, tags))
+    database.AddItems(items)
+
+
+def EvaluateEachItem(database, query, tag_ids):
+    # the original evaluator, which evaluates the query once for every item.
+    from searches import EvaluatePostfix, InsertValuesIntoQuery
+    matches = []
+    for item_id, item_tags in database.GetAllItemTags():
+        values = {}
+        for name, term_ids in tag_ids.items():
+            if isinstance(term_ids, int):
+                term_ids = [term_ids]
+            values[name] = any(i in item_tags for i in term_ids)
+        if EvaluatePostfix(InsertValuesIntoQuery(list(query.postfix),
+                                                 values)):
+            matches.append(item_id)
+    return matches
+
+
+@pytest.mark.parametrize("text", [
+    "b", "b c", "b -c", "b NOT c d", "rare (b OR c)", "rare (b XOR c)",
+    "-(b OR c) d", "b (c OR -d)", "rare -b -c", "ta* -d", "b (ta* XOR rare)",
+    "-(rare OR b) (c OR d)"
+])
+def test_execution_modes_agree(database, text):
+    from searches import (EvaluateBooleanQuery, EvaluatePostfixOnIndex,
+                          PlanQuery)
+    AddRandomItems(database)
+    query = ParseSearchText(text)
+    tag_ids = database.GetTagIDsFromNames(query.tag_names)
+    expected = EvaluateEachItem(database, query, tag_ids)
+    assert len(expected) > 0
+    index = database.GetItemTagIndex()
+    assert EvaluatePostfixOnIndex(query.postfix, tag_ids, index) == expected
+    assert sorted(PlanQuery(query, tag_ids, index).Evaluate(index)) == expected
+    assert database.GetItemIDsMatchingPostfix(query.postfix,
+                                              tag_ids) == expected
+    for execution_mode in ["memory", "database"]:
+        assert EvaluateBooleanQuery(query, tag_ids,
+                                    execution_mode) == expected
+
+
+def test_explain_falls_back_to_memory(database):
+    from searches import ExplainSearch
+    database.AddTags([("a", "", []), ("b", "", [])])
+    database.AddItems([("x", None, 0, 1, 1, 0, 5, ["a", "b"])])
+    lines = ExplainSearch("a -b", "STRICT", "database")
+    assert lines[0] == "Evaluated by SQLite:"
+    # SQLite cannot parse the deeply nested statement of a long query.
+    lines = ExplainSearch(" ".join(["a", "b"] * 50), "STRICT", "database")
+    assert lines[0] == "Evaluated over the index of 1 items:"
+
+
+@pytest.mark.parametrize("minimum_score", [None, 0, 1, 3])
+def test_weighted_match_count_ignores_limit(database, minimum_score):
+    database.AddTags([("a", "", []), ("b", "", []), ("c", "", [])])
+    database.AddItems([(f'i{i}', None, 0, 1, 1, 0, 5,
+                        [tag for j, tag in enumerate("abc") if i >> j & 1])
+                       for i in range(40)])
+    query = "a[2] b c[-1]"
+    everything = WeightedSearch(query, minimum_score)
+    top = WeightedSearch(query, minimum_score, limit=5)
+    assert len(top) == min(5, len(everything))
+    assert CountWeightedMatches(query, minimum_score) == len(everything)
+
+
+def GetRandomTagNames(count, seed):
+    import random
+    generator = random.Random(seed)
+    words = ["art", "Artist", "blue", "sky", "sky-blue", "night", "nights",
+             "a", "the", "photo", "photography", "tag", "tags", "x"]
+    names = []
+    for _ in range(count):
+        name = " ".join(
+            generator.choice(words) for _ in range(generator.randint(1, 3)))
+        if generator.random() < 0.3:
+            name = name.replace(generator.choice("aeiost"), "", 1)
+        names.append(name)
+    return names
+
+
+@pytest.mark.parametrize("threshold", [20, 50, 75, 90])
+def test_similarity_bound_keeps_tags_that_reach_threshold(threshold):
+    import config
+    from searches import GetTagSimilarity, TagSimilarityBound
+    options = GetRandomTagNames(150, threshold)
+    texts = GetRandomTagNames(12, -threshold) + ["", "sky blu", "NIGHT!"]
+    thresholds = [threshold, config.DEFAULT_SETTINGS[
+        "levenshtein_search_threshold"]]
+    ruled_out = 0
+    for text in texts:
+        bound = TagSimilarityBound(text)
+        for option in options:
+            for value in thresholds:
+                if not bound.MayReach(option, value):
+                    ruled_out += 1
+                    assert GetTagSimilarity(text, option) < value
+    assert ruled_out > 0
@@ -0,0 +1,117 @@
+def test_update_tag_keeps_synonyms_shared_with_other_tags(database):
+    database.AddTags([("a", "", ["shared", "x"]), ("b", "", ["shared"])])
+    database.UpdateTag("a", ["shared", "x"], "a", "", ["x"])
+    assert database.tag_catalog.synonyms[1] == ["x"]
+    assert database.tag_catalog.synonyms[2] == ["shared"]
+    database.tag_catalog.Load()
+    assert database.tag_catalog.synonyms[1] == ["x"]
+    assert database.tag_catalog.synonyms[2] == ["shared"]
+    assert database.GetTagDataFromSynonym("shared")["NAME"] == "b"
+
+
+def test_item_export_after_removing_used_tag(database):
+    database.AddTags([("a", "", []), ("b", "", []), ("c", "", ["see"])])
+    database.AddItems([("x", None, 0, 1, 1, 0, 5, ["a", "c"]),
+                       ("y", None, 0, 1, 1, 0, 5, ["c"])])
+    database.RemoveTag("c")
+    items = [item for batch in database.GetItemDataBatches() for item in batch]
+    assert [item[0] for item in items] == ["x", "y"]
+    assert [item[7] for item in items] == [["a"], []]
+    assert database.GetTagDataFromSynonym("see") == None
+
+
+def test_item_export_skips_dangling_item_tags(database):
+    # databases from before RemoveTag deleted ItemTags rows can still have
+    # rows for tags that no longer exist.
+    database.AddTags([("a", "", [])])
+    database.AddItems([("x", None, 0, 1, 1, 0, 5, ["a"])])
+    database.database.QueryAndCommit("""INSERT INTO ItemTags (ItemID, TagID)
+                                        VALUES (1, 99)""")
+    items = [item for batch in database.GetItemDataBatches() for item in batch]
+    assert items[0][7] == ["a"]
+
+
+def test_failed_import_adds_nothing(database):
+    database.AddTags([("a", "", [])])
+    database.BeginImport()
+    database.AddTags([("b", "", ["c"])])
+    database.AddItems([("x", None, 0, 1, 1, 0, 5, ["a", "b"])])
+    database.EndImport(False)
+    assert database.GetTagNames() == ["a"]
+    assert database.GetItemNames() == []
+    assert database.GetItemTagIndex().GetCount(1) == 0
+    database.BeginImport()
+    database.AddItems([("x", None, 0, 1, 1, 0, 5, ["a"])])
+    database.EndImport(True)
+    database.LoadDatabase(database.GetDatabaseName())
+    assert database.GetItemNames() == ["x"]
+
+
+def GetChanges(database, since):
+    items = [
+        item for batch in database.GetItemDataBatches(changed_since=since)
+        for item in batch
+    ]
+    return items, database.GetDeletedItems(since)
+
+
+def ApplyChanges(database, changes):
+    items, deletions = changes
+    database.ApplyDeletedItems(deletions)
+    return database.UpsertItems(items)
+
+
+def test_replaying_older_delta_does_not_restore_deleted_item(
+        database, tmp_path):
+    database.AddTags([("a", "", [])])
+    database.AddItems([("i0", None, 0, 1, 1, 0, 5, ["a"]),
+                       ("i1", None, 0, 1, 1, 0, 5, [])])
+    first = GetChanges(database, 0)
+    marker = database.CurrentTime()
+    database.RemoveItem("i0")
+    second = GetChanges(database, marker)
+    assert second[1][0][0] == "i0"
+
+    # the newer delta may also be applied before the item ever existed.
+    for name, order in [("replayed", [first, second, second, first]),
+                        ("reversed", [second, first])]:
+        database.LoadDatabase(str(tmp_path / name))
+        database.AddTags([("a", "", [])])
+        for changes in order:
+            ApplyChanges(database, changes)
+        assert sorted(database.GetItemNames()) == ["i1"]
+    # an item updated after it was deleted is still added.
+    items = [["i0", None, 0, 1, marker + 1000, 0, 5, []]]
+    assert database.UpsertItems(items) == 1
+    assert sorted(database.GetItemNames()) == ["i0", "i1"]
+
+
+def test_changed_item_tags_skip_dangling_item_tags(database):
+    database.AddTags([("a", "", ["b"])])
+    database.AddItems([("x", None, 0, 1, 1, 0, 5, ["a"])])
+    database.database.QueryAndCommit("""INSERT INTO ItemTags (ItemID, TagID)
+                                        VALUES (1, 99)""")
+    assert database.GetChangedItemTagData(0) == [["a", "", ["b"]]]
+
+
+def test_tag_changes_are_included_in_deltas(database, tmp_path):
+    database.AddTags([("a", "", []), ("c", "", []), ("d", "", [])])
+    database.AddItems([("x", None, 0, 1, 1, 0, 5, ["a", "c"]),
+                       ("y", None, 0, 1, 1, 0, 5, ["d"]),
+                       ("z", None, 0, 1, 1, 0, 5, ["a"])])
+    first = GetChanges(database, 0)
+    marker = database.CurrentTime()
+    database.RemoveTag("c")
+    database.UpdateTag("d", [], "d", "changed", ["e"])
+    second = GetChanges(database, marker)
+    assert sorted(item[0] for item in second[0]) == ["x", "y"]
+    assert database.GetChangedItemTagData(marker) == [["a", "", []],
+                                                      ["d", "changed", ["e"]]]
+
+    database.LoadDatabase(str(tmp_path / "other"))
+    database.AddTags([("a", "", []), ("c", "", []), ("d", "", [])])
+    ApplyChanges(database, first)
+    assert ApplyChanges(database, second) == 1
+    items = [item for batch in database.GetItemDataBatches() for item in batch]
+    assert [item[7] for item in items] == [["a"], ["d"], ["a"]]
+    assert ApplyChanges(database, second) == 0